@@ -17,7 +17,7 @@ SECRET_KEY = os.getenv('SECRET_KEY')
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = os.getenv('DEBUG')
 
-ALLOWED_HOSTS = []
+ALLOWED_HOSTS = os.getenv('ALLOWED_HOSTS').split(',') if os.getenv('ALLOWED_HOSTS') else []
 
 # Application definition
 
@@ -28,6 +28,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 
     'rest_framework',
     'django_filters',
@@ -37,6 +38,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'sales_network.middleware.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -44,6 +46,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'sales_network.middleware.ReplicaStickinessMiddleware',
 ]
 
 ROOT_URLCONF = 'config.urls'
@@ -69,6 +72,11 @@ WSGI_APPLICATION = 'config.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
+# Постоянные соединения (CONN_MAX_AGE секунд) или пул psycopg 3 размером POSTGRES_POOL_SIZE.
+# Под ASGI постоянные соединения не переиспользуются между запросами и копятся до max_connections, поэтому
+# по умолчанию соединение закрывается после запроса: для ASGI задайте POSTGRES_POOL_SIZE, CONN_MAX_AGE - только для WSGI
+DATABASE_POOL_SIZE = int(os.getenv('POSTGRES_POOL_SIZE') or 0)
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql_psycopg2',
@@ -77,9 +85,77 @@ DATABASES = {
         'PASSWORD': os.getenv('POSTGRES_PASSWORD'),
         'HOST': os.getenv('POSTGRES_HOST'),
         'PORT': os.getenv('POSTGRES_PORT', default='5432'),
+        # Пул сам держит соединения открытыми и несовместим с CONN_MAX_AGE
+        'CONN_MAX_AGE': 0 if DATABASE_POOL_SIZE else int(os.getenv('CONN_MAX_AGE') or 0),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {'pool': {'min_size': 1, 'max_size': DATABASE_POOL_SIZE}} if DATABASE_POOL_SIZE else {},
     }
 }
 
+# Реплики для чтения: POSTGRES_REPLICA_HOSTS=host[:port],... с теми же БД и пользователем, что и основная.
+# В тестах реплики - зеркала основной БД
+REPLICA_DATABASES = []
+for number, address in enumerate(filter(None, os.getenv('POSTGRES_REPLICA_HOSTS', '').split(',')), start=1):
+    host, _, port = address.strip().partition(':')
+    DATABASES[f'replica_{number}'] = dict(
+        DATABASES['default'], HOST=host, PORT=port or DATABASES['default']['PORT'],
+        OPTIONS=dict(DATABASES['default']['OPTIONS']), TEST={'MIRROR': 'default'},
+    )
+    REPLICA_DATABASES.append(f'replica_{number}')
+
+DATABASE_ROUTERS = ['sales_network.replicas.ReplicaRouter']
+
+# Сколько секунд после записи пользователь читает с основной БД: должно покрывать отставание реплик
+REPLICA_STICKY_SECONDS = int(os.getenv('REPLICA_STICKY_SECONDS') or 5)
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        },
+        # Отметки об отзыве токенов. В одной БД Redis с ответами их может вытеснить политика maxmemory, поэтому
+        # для них можно задать отдельную БД Redis (REDIS_USERS_URL) с maxmemory-policy noeviction
+        'users': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_USERS_URL') or os.getenv('REDIS_URL'),
+            'KEY_PREFIX': 'users',
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+        'users': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'users',
+            'OPTIONS': {'MAX_ENTRIES': 100000},
+        },
+    }
+
+# Кэш общий для всех процессов (несколько воркеров gunicorn/uvicorn) только в Redis. Локальный кэш процесса
+# не видит сброса поколений и отметок об отзыве токенов из других процессов, поэтому без REDIS_URL ответы API
+# не кэшируются, а пользователь при аутентификации проверяется по БД
+SHARED_CACHE = bool(os.getenv('REDIS_URL'))
+
+# Время жизни закэшированных ответов API, сбрасываются они при любых изменениях данных
+RESPONSE_CACHE_TIMEOUT = int(os.getenv('RESPONSE_CACHE_TIMEOUT') or 300)
+
+# Метрики запросов (/metrics/): токен для доступа (если не задан, эндпоинт отвечает 404), порог медленного запроса
+# в секундах для лога sales_network.requests (0 - не писать) и число повторов одного SQL-запроса, при котором
+# запрос считается N+1
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+SLOW_REQUEST_SECONDS = float(os.getenv('SLOW_REQUEST_SECONDS') or 0)
+DUPLICATE_QUERY_THRESHOLD = int(os.getenv('DUPLICATE_QUERY_THRESHOLD') or 10)
+
+# Сколько дней хранится журнал изменений (/changes/): курсоры до удаленных по сроку записей требуют полной
+# синхронизации
+CHANGES_RETENTION_DAYS = int(os.getenv('CHANGES_RETENTION_DAYS') or 7)
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -123,12 +199,17 @@ AUTH_USER_MODEL = 'users.USER'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'users.authentication.ClaimsJWTAuthentication',
+    ],
+    'DEFAULT_FILTER_BACKENDS': ['django_filters.rest_framework.DjangoFilterBackend'],
+    'DEFAULT_RENDERER_CLASSES': [
+        'sales_network.renderers.InstrumentedJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
     ],
-    'DEFAULT_FILTER_BACKENDS': ['django_filters.rest_framework.DjangoFilterBackend']
 }
 
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=15),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
+    'TOKEN_OBTAIN_SERIALIZER': 'users.serializers.ClaimsTokenObtainPairSerializer',
 }
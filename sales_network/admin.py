@@ -1,17 +1,40 @@
 from django.contrib import admin
 from django.contrib import messages
-from .models import NetworkElement
+from .models import NetworkElement, DebtTransaction
 
 @admin.action(description='Анулировать долг перед поставщиком')
 def make_zero_debt(modeladmin, request, queryset):
-    queryset.update(debt_to_parent=0)
+    # Долг не перезаписывается: в журнал добавляются встречные проводки, которые сразу учитываются
+    queryset.zero_debt()
     messages.success(request, 'У выбранных элементов анулирован долг')
 
 
+@admin.action(description='Удалить вместе с поддеревьями', permissions=['delete'])
+def delete_subtrees(modeladmin, request, queryset):
+    # Без страницы подтверждения: стандартное удаление собирает все поддерево в память, чтобы его показать
+    counts = queryset.delete_subtrees()
+    messages.success(request, f'Удалено элементов: {counts["deleted"]}, связей с продуктами: '
+                              f'{counts["product_links"]}, проводок: {counts["debt_transactions"]}')
+
+
 @admin.register(NetworkElement)
 class CustomUserAdmin(admin.ModelAdmin):
-    list_display = ('name','network_lvl', 'email', 'debt_to_parent', 'parent')
+    list_display = ('name','network_lvl', 'email', 'debt_to_parent', 'subtree_debt', 'descendants_count', 'parent')
     list_display_links = ('parent', )
-    # search_fields = ('city',)
+    search_fields = ('name', 'city')
     ordering = ('city',)
-    actions = [make_zero_debt]
+    actions = [make_zero_debt, delete_subtrees]
+
+
+@admin.register(DebtTransaction)
+class DebtTransactionAdmin(admin.ModelAdmin):
+    list_display = ('element', 'amount', 'comment', 'created_at', 'compacted')
+    list_filter = ('compacted',)
+    list_select_related = ('element',)
+    raw_id_fields = ('element',)
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
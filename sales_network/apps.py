@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class SalesNetworkConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'sales_network'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,120 @@
+from django.http import HttpResponse
+from django.views import View
+from rest_framework import status
+from rest_framework.exceptions import APIException, NotAuthenticated, NotFound, PermissionDenied, ValidationError
+from rest_framework.request import Request
+
+from users.authentication import ClaimsJWTAuthentication
+from .filters import NetworkElementFilter
+from .models import NetworkElement, Product
+from .paginators import NetworkCursorPagination
+from .renderers import InstrumentedJSONRenderer
+from .serializers import NetworkElementSerializer, ProductSerializer
+from .tree import build_tree, parse_tree_params, tree_queryset
+
+TREE_CHUNK_SIZE = 2000
+
+
+class AsyncReadView(View):
+    """
+    Асинхронное чтение для ASGI: аутентификация по claims JWT и проверка активности без запросов к БД,
+    выборка через асинхронный ORM. Ответы и курсоры совпадают с синхронными ViewSet, кэш ответов не используется.
+    """
+    http_method_names = ['get', 'head', 'options']
+    queryset = None
+    serializer_class = None
+    filterset_class = None
+    authentication = ClaimsJWTAuthentication()
+    renderer = InstrumentedJSONRenderer()
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            await self.check_access(request)
+            self.drf_request = Request(request)
+            data = await super().dispatch(request, *args, **kwargs)
+        except APIException as error:
+            return self.error_response(error)
+        if isinstance(data, HttpResponse):
+            return data
+        return HttpResponse(self.renderer.render(data), content_type='application/json')
+
+    async def check_access(self, request):
+        # Те же правила, что IsActiveUser и IsAuthenticated у синхронных представлений
+        result = await self.authentication.aauthenticate(request)
+        if result is None:
+            raise NotAuthenticated()
+        request.user, request.auth = result
+        if not request.user.is_active:
+            raise PermissionDenied()
+
+    def error_response(self, error):
+        detail = error.detail if isinstance(error.detail, (list, dict)) else {'detail': error.detail}
+        response = HttpResponse(self.renderer.render(detail), status=error.status_code,
+                                content_type='application/json')
+        if error.status_code == status.HTTP_401_UNAUTHORIZED:
+            response['WWW-Authenticate'] = self.authentication.authenticate_header(self.request)
+        return response
+
+    def get_queryset(self):
+        return self.queryset.all()
+
+    def filter_queryset(self, queryset):
+        if self.filterset_class is None:
+            return queryset
+        filterset = self.filterset_class(self.drf_request.query_params, queryset=queryset, request=self.drf_request)
+        if not filterset.is_valid():
+            raise ValidationError(filterset.errors)
+        return filterset.qs
+
+    def serialize(self, instance, many=False):
+        return self.serializer_class(instance, many=many, context={'request': self.drf_request}).data
+
+
+class AsyncListView(AsyncReadView):
+
+    async def get(self, request):
+        paginator = NetworkCursorPagination()
+        page = await paginator.apaginate_queryset(self.filter_queryset(self.get_queryset()), self.drf_request)
+        return paginator.get_page_data(self.serialize(page, many=True))
+
+
+class AsyncDetailView(AsyncReadView):
+
+    async def get(self, request, pk):
+        try:
+            instance = await self.get_queryset().aget(pk=pk)
+        except self.queryset.model.DoesNotExist:
+            raise NotFound()
+        return self.serialize(instance)
+
+
+class NetworkElementListView(AsyncListView):
+    queryset = NetworkElement.objects.with_products()
+    serializer_class = NetworkElementSerializer
+    filterset_class = NetworkElementFilter
+
+
+class NetworkElementDetailView(AsyncDetailView):
+    queryset = NetworkElement.objects.with_products()
+    serializer_class = NetworkElementSerializer
+
+
+class NetworkTreeView(AsyncReadView):
+    serializer_class = NetworkElementSerializer
+
+    async def get(self, request):
+        root_id, max_depth = parse_tree_params(self.drf_request.query_params)
+        elements = [element async for element in tree_queryset(root_id, max_depth).aiterator(TREE_CHUNK_SIZE)]
+        if root_id is not None and not elements:
+            raise NotFound('Элемент не найден')
+        return build_tree(self.serialize(elements, many=True))
+
+
+class ProductListView(AsyncListView):
+    queryset = Product.objects.all()
+    serializer_class = ProductSerializer
+
+
+class ProductDetailView(AsyncDetailView):
+    queryset = Product.objects.all()
+    serializer_class = ProductSerializer
@@ -0,0 +1,520 @@
+import asyncio
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, models
+from django.test import Client
+from django.test.utils import setup_test_environment, teardown_test_environment
+from rest_framework.renderers import JSONRenderer
+from rest_framework.reverse import reverse
+from rest_framework.test import APIClient
+
+from users.models import User
+from users.serializers import ClaimsTokenObtainPairSerializer
+from .importers import NetworkImporter
+from .models import NetworkElement, Product
+from .renderers import BINARY_RENDERER_CLASSES, InstrumentedJSONRenderer
+from .serializers import NetworkElementSerializer, ValuesListSerializer
+
+
+@contextmanager
+def benchmark_database(keepdb=False):
+    """Отдельная тестовая база, чтобы замеры не трогали рабочие данные"""
+    setup_test_environment()
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=keepdb)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=keepdb)
+        teardown_test_environment()
+
+
+def generate_records(depth, fan_out, roots=1, product_ids=(), products_per_element=0, countries=('Russia',),
+                     seed=0):
+    """Строки синтетической сети для NetworkImporter: roots корней, fan_out потомков у каждого, depth уровней"""
+    rng = random.Random(seed)
+    level = [(str(number), None) for number in range(roots)]
+    number = 0
+    for lvl in range(depth + 1):
+        next_level = []
+        for ref, parent in level:
+            number += 1
+            yield {
+                'ref': ref,
+                'parent': parent,
+                'name': f'Element {number}',
+                'email': f'element{number}@example.com',
+                'country': rng.choice(countries),
+                'city': f'City {rng.randint(1, 50)}',
+                'street': 'Street',
+                'building': str(rng.randint(1, 200)),
+                'debt_to_parent': f'{rng.randint(0, 100000) / 100:.2f}' if parent else '0',
+                'products': rng.sample(product_ids, min(products_per_element, len(product_ids))),
+            }
+            if lvl < depth:
+                next_level.extend((f'{ref}.{child}', ref) for child in range(fan_out))
+        level = next_level
+
+
+def generate_network(depth, fan_out, roots=1, products=0, products_per_element=0, countries=('Russia',), seed=0):
+    """Создает синтетическую сеть через потоковый импорт и возвращает результат импорта"""
+    product_ids = [
+        product.pk for product in Product.objects.bulk_create(
+            Product(name=f'Synthetic product {seed}.{number}') for number in range(products)
+        )
+    ]
+    records = generate_records(depth, fan_out, roots, product_ids, products_per_element, countries, seed)
+    return NetworkImporter().run(records)
+
+
+SAVEPOINT_COMMANDS = ('SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO SAVEPOINT')
+
+
+def measure(call):
+    """Время выполнения и число SQL-запросов одного вызова"""
+    queries = 0
+
+    def count(execute, sql, params, many, context):
+        nonlocal queries
+        # Точки сохранения зависят от внешней транзакции (в тестах их больше), поэтому не считаются
+        if not sql.startswith(SAVEPOINT_COMMANDS):
+            queries += 1
+        return execute(sql, params, many, context)
+
+    with connection.execute_wrapper(count):
+        started = time.perf_counter()
+        result = call()
+        elapsed = time.perf_counter() - started
+    return result, elapsed, queries
+
+
+def api_client():
+    user, _ = User.objects.get_or_create(username='benchmark')
+    client = APIClient()
+    client.force_authenticate(user=user)
+    return client
+
+
+def fetch_tree_recursively(client, root_id):
+    """Прежний способ фронтенда: список всех элементов, затем рекурсивный retrieve каждого узла"""
+    children = {}
+    requests = 0
+    url, params = reverse('network:network-list'), {'page_size': 1000}
+    while url:
+        requests += 1
+        page = client.get(url, params).json()
+        for item in page['results']:
+            children.setdefault(item['parent'], []).append(item['id'])
+        url, params = page['next'], None
+
+    def fetch(pk):
+        nonlocal requests
+        requests += 1
+        node = client.get(reverse('network:network-detail', args=(pk,))).json()
+        node['children'] = [fetch(child) for child in children.get(pk, ())]
+        return node
+
+    return fetch(root_id), requests
+
+
+def benchmark_tree(depth, fan_out):
+    """Сравнение /network/tree/ с рекурсивным получением того же дерева"""
+    generate_network(depth, fan_out)
+    client = api_client()
+    root_id = NetworkElement.objects.get(parent=None).pk
+    size = NetworkElement.objects.count()
+
+    cache.clear()
+    _, tree_time, tree_queries = measure(
+        lambda: client.get(reverse('network:network-tree'), {'root': root_id})
+    )
+    cache.clear()
+    (_, requests), recursive_time, recursive_queries = measure(lambda: fetch_tree_recursively(client, root_id))
+
+    return {
+        'elements': size,
+        'tree': {'seconds': tree_time, 'queries': tree_queries, 'requests': 1},
+        'recursive': {'seconds': recursive_time, 'queries': recursive_queries, 'requests': requests},
+    }
+
+
+# Допустимое число SQL-запросов на операцию; не должно зависеть от размера сети
+QUERY_BUDGETS = {
+    'create': 13,
+    'reparent': 13,
+    'list': 3,
+    'filter': 3,
+    'retrieve': 3,
+    'delete_subtree': 9,
+    'admin_debt_reset': 11,
+}
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def summarize(samples):
+    """p50/p95 времени (мс) и число запросов по замерам [(секунды, запросы), ...]"""
+    times = [elapsed * 1000 for elapsed, _ in samples]
+    queries = [count for _, count in samples]
+    return {
+        'runs': len(samples),
+        'p50_ms': round(percentile(times, 0.5), 3),
+        'p95_ms': round(percentile(times, 0.95), 3),
+        'queries_p50': percentile(queries, 0.5),
+        'queries_max': max(queries),
+    }
+
+
+def current_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class NetworkBenchmark:
+    """
+    Замеры операций API и admin на синтетической сети. Каждая операция выполняется repeat раз на случайных
+    элементах, кэш ответов сбрасывается перед каждым вызовом, чтобы замерялась работа с БД.
+    """
+
+    def __init__(self, repeat=20, seed=0):
+        self.repeat = repeat
+        self.rng = random.Random(seed)
+        self.client = api_client()
+        admin, _ = User.objects.get_or_create(username='benchmark-admin', defaults={
+            'is_staff': True, 'is_superuser': True,
+        })
+        self.admin_client = Client()
+        self.admin_client.force_login(admin)
+
+    def run(self):
+        operations = {
+            'create': self.create,
+            'reparent': self.reparent,
+            'list': self.list,
+            'filter': self.filter,
+            'retrieve': self.retrieve,
+            'delete_subtree': self.delete_subtree,
+            'admin_debt_reset': self.admin_debt_reset,
+        }
+        results = {}
+        for name, operation in operations.items():
+            samples = []
+            for _ in range(self.repeat):
+                call = operation()
+                cache.clear()
+                response, elapsed, queries = measure(call)
+                if response.status_code >= 400:
+                    raise RuntimeError(f'{name}: HTTP {response.status_code} {response.content[:500]!r}')
+                samples.append((elapsed, queries))
+            results[name] = summarize(samples)
+            results[name]['query_budget'] = QUERY_BUDGETS[name]
+        return results
+
+    def random_element(self, **filters):
+        ids = list(NetworkElement.objects.filter(**filters).values_list('pk', flat=True))
+        return self.rng.choice(ids)
+
+    def create(self):
+        parent = self.random_element()
+        data = {
+            'name': 'Benchmark element', 'email': 'benchmark@example.com', 'country': 'Russia', 'city': 'City',
+            'street': 'Street', 'building': '1', 'parent': parent,
+            'products': list(Product.objects.values_list('pk', flat=True)[:2]),
+        }
+        return lambda: self.client.post(reverse('network:network-list'), data, format='json')
+
+    def reparent(self):
+        # Новый родитель выше по уровню, поэтому не может оказаться потомком переносимого элемента
+        element = NetworkElement.objects.get(pk=self.random_element(network_lvl__gte=2))
+        parent = self.random_element(network_lvl__lt=element.network_lvl - 1)
+        url = reverse('network:network-detail', args=(element.pk,))
+        return lambda: self.client.patch(url, {'parent': parent}, format='json')
+
+    def list(self):
+        return lambda: self.client.get(reverse('network:network-list'), {'page_size': 50})
+
+    def filter(self):
+        country = NetworkElement.objects.get(pk=self.random_element()).country
+        params = {'country': country, 'network_lvl_min': 1, 'search': 'element 1', 'page_size': 50}
+        return lambda: self.client.get(reverse('network:network-list'), params)
+
+    def retrieve(self):
+        url = reverse('network:network-detail', args=(self.random_element(),))
+        return lambda: self.client.get(url)
+
+    def delete_subtree(self):
+        level = NetworkElement.objects.aggregate(level=models.Max('network_lvl'))['level']
+        url = reverse('network:network-detail', args=(self.random_element(network_lvl=max(level - 1, 1)),))
+        return lambda: self.client.delete(url)
+
+    def admin_debt_reset(self):
+        ids = list(NetworkElement.objects.filter(network_lvl__gte=1).values_list('pk', flat=True))
+        selected = self.rng.sample(ids, min(10, len(ids)))
+        url = reverse('admin:sales_network_networkelement_changelist')
+        return lambda: self.admin_client.post(url, {'action': 'make_zero_debt', '_selected_action': selected})
+
+
+def benchmark_network(depth, fan_out, roots=1, products=0, products_per_element=0, countries=('Russia',),
+                      repeat=20, seed=0):
+    """Генерирует сеть и замеряет операции; результат пригоден для сравнения между коммитами"""
+    imported = generate_network(depth, fan_out, roots, products, products_per_element, countries, seed)
+    connection.cursor().execute('ANALYZE')
+    return {
+        'commit': current_commit(),
+        'started_at': datetime.now(timezone.utc).isoformat(),
+        'database': connection.vendor,
+        'network': {
+            'depth': depth, 'fan_out': fan_out, 'roots': roots, 'products': products,
+            'products_per_element': products_per_element, 'countries': list(countries),
+            'elements': imported.created, 'seed': seed,
+        },
+        'operations': NetworkBenchmark(repeat, seed).run(),
+    }
+
+
+def rendering_paths(page_size):
+    """Способы получить тело страницы списка элементов: (сериализация, рендерер)"""
+    fast = ValuesListSerializer(NetworkElementSerializer)
+    paths = {
+        'model_serializer': (
+            lambda: NetworkElementSerializer(
+                NetworkElement.objects.with_products().order_by('pk')[:page_size], many=True,
+            ).data,
+            JSONRenderer(),
+        ),
+        'values_serializer': (
+            lambda: fast.to_representation(fast.values(NetworkElement.objects.order_by('pk'))[:page_size]),
+            InstrumentedJSONRenderer(),
+        ),
+    }
+    for renderer_class in BINARY_RENDERER_CLASSES:
+        paths[f'values_{renderer_class.format}'] = (paths['values_serializer'][0], renderer_class())
+    return paths
+
+
+def benchmark_rendering(depth, fan_out, roots=1, products=0, products_per_element=0, page_size=1000, repeat=10,
+                        seed=0):
+    """
+    Сериализация и рендеринг страницы списка: ModelSerializer с JSONRenderer DRF против ValuesListSerializer
+    с orjson (и MessagePack, если установлен). Медианы времени, число запросов, размер ответа и совпадение
+    ответов с ModelSerializer: побайтное и по данным (порядок продуктов элемента не определен).
+    """
+    imported = generate_network(depth, fan_out, roots, products, products_per_element, seed=seed)
+    connection.cursor().execute('ANALYZE')
+    results = {}
+    outputs = {}
+    for name, (serialize, renderer) in rendering_paths(page_size).items():
+        samples = []
+        for _ in range(repeat):
+            data, serialize_time, queries = measure(serialize)
+            content, render_time, _ = measure(lambda: renderer.render(data))
+            samples.append((serialize_time, render_time, queries))
+        outputs[name] = (data, content, renderer.media_type)
+        results[name] = {
+            'serialize_ms': round(percentile([row[0] * 1000 for row in samples], 0.5), 3),
+            'render_ms': round(percentile([row[1] * 1000 for row in samples], 0.5), 3),
+            'total_ms': round(percentile([(row[0] + row[1]) * 1000 for row in samples], 0.5), 3),
+            'queries': max(row[2] for row in samples),
+            'bytes': len(content),
+        }
+
+    def normalized(data):
+        return [dict(item, products=sorted(item['products'])) for item in data]
+
+    baseline_data, baseline_content, _ = outputs['model_serializer']
+    for name, (data, content, media_type) in outputs.items():
+        results[name]['equal'] = normalized(data) == normalized(baseline_data)
+        if media_type == JSONRenderer.media_type:
+            results[name]['byte_equal'] = content == baseline_content
+    return {
+        'commit': current_commit(),
+        'elements': imported.created,
+        'page_size': page_size,
+        'paths': results,
+    }
+
+
+# Конфигурации серверов для сравнения: синхронные ViewSet под gunicorn (WSGI) и под uvicorn (ASGI),
+# асинхронные представления под uvicorn
+SERVER_SCENARIOS = {
+    'wsgi_sync_views': ('wsgi', ''),
+    'asgi_sync_views': ('asgi', ''),
+    'asgi_async_views': ('asgi', 'async/'),
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def server_command(kind, port, workers, threads):
+    if kind == 'wsgi':
+        return [sys.executable, '-m', 'gunicorn', 'config.wsgi:application', '--bind', f'127.0.0.1:{port}',
+                '--workers', str(workers), '--threads', str(threads), '--backlog', '4096', '--log-level', 'warning']
+    return [sys.executable, '-m', 'uvicorn', 'config.asgi:application', '--host', '127.0.0.1', '--port', str(port),
+            '--workers', str(workers), '--backlog', '4096', '--log-level', 'warning', '--no-access-log']
+
+
+@contextmanager
+def serve(kind, workers, threads=1, timeout=30):
+    """Запускает сервер на тестовой базе с отключенным кэшем ответов и возвращает порт"""
+    port = free_port()
+    env = dict(
+        os.environ, DJANGO_SETTINGS_MODULE=settings.SETTINGS_MODULE, POSTGRES_DB=connection.settings_dict['NAME'],
+        RESPONSE_CACHE_TIMEOUT='0', SLOW_REQUEST_SECONDS='0', DEBUG='', ALLOWED_HOSTS='127.0.0.1',
+    )
+    if kind == 'asgi':
+        # Постоянные соединения под ASGI копятся до max_connections: только пул или закрытие после запроса
+        env['CONN_MAX_AGE'] = '0'
+    process = subprocess.Popen(server_command(kind, port, workers, threads), env=env, stdout=subprocess.DEVNULL)
+    try:
+        deadline = time.monotonic() + timeout
+        while True:
+            if process.poll() is not None:
+                raise RuntimeError(f'Сервер {kind} завершился с кодом {process.returncode}')
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f'Сервер {kind} не запустился за {timeout} с')
+                time.sleep(0.1)
+        yield port
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+
+async def read_response(reader):
+    """Статус, признак закрытия соединения и тело ответа HTTP/1.1 (Content-Length или chunked)"""
+    head = await reader.readuntil(b'\r\n\r\n')
+    status_line, *lines = head.decode('latin1').split('\r\n')
+    headers = {}
+    for line in lines:
+        if line:
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+    if 'content-length' in headers:
+        body = await reader.readexactly(int(headers['content-length']))
+    elif headers.get('transfer-encoding') == 'chunked':
+        chunks = []
+        while size := int((await reader.readline()).strip(), 16):
+            chunks.append(await reader.readexactly(size))
+            await reader.readline()
+        await reader.readline()
+        body = b''.join(chunks)
+    else:
+        body = await reader.read()
+    return int(status_line.split()[1]), headers.get('connection', '').lower() == 'close', body
+
+
+async def load(port, paths, token, concurrency, duration, seed=0):
+    """
+    concurrency клиентов в течение duration секунд запрашивают пути из paths по кругу, соединения
+    переиспользуются, если сервер их не закрывает (синхронные воркеры gunicorn закрывают после каждого ответа)
+    """
+    latencies, errors = [], 0
+    deadline = time.monotonic() + duration
+
+    async def client(number):
+        nonlocal errors
+        rng = random.Random(seed + number)
+        reader = writer = None
+        while time.monotonic() < deadline:
+            path = rng.choice(paths)
+            request = (f'GET {path} HTTP/1.1\r\nHost: 127.0.0.1:{port}\r\n'
+                       f'Authorization: Bearer {token}\r\nAccept: application/json\r\n\r\n').encode()
+            started = time.perf_counter()
+            try:
+                if writer is None:
+                    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+                writer.write(request)
+                status, close, _ = await read_response(reader)
+            except (OSError, asyncio.IncompleteReadError):
+                errors += 1
+                writer = None
+                continue
+            latencies.append(time.perf_counter() - started)
+            if status != 200:
+                errors += 1
+            if close:
+                writer.close()
+                writer = None
+        if writer is not None:
+            writer.close()
+
+    started = time.monotonic()
+    await asyncio.gather(*(client(number) for number in range(concurrency)))
+    elapsed = time.monotonic() - started
+    times = [latency * 1000 for latency in latencies]
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'rps': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(percentile(times, 0.5), 2) if times else None,
+        'p95_ms': round(percentile(times, 0.95), 2) if times else None,
+        'p99_ms': round(percentile(times, 0.99), 2) if times else None,
+    }
+
+
+def server_paths(prefix, element_ids, root_ids, rng, count=200):
+    """Смесь чтений: страница списка, элемент, дерево поддерева первого уровня, список продуктов"""
+    paths = []
+    for _ in range(count):
+        paths += [
+            f'/{prefix}network/?page_size=50',
+            f'/{prefix}network/{rng.choice(element_ids)}/',
+            f'/{prefix}network/tree/?root={rng.choice(root_ids)}&max_depth=1',
+            f'/{prefix}product/',
+        ]
+    return paths
+
+
+def benchmark_servers(depth, fan_out, roots=1, products=0, products_per_element=0, concurrency=200, duration=10,
+                      workers=4, threads=1, scenarios=tuple(SERVER_SCENARIOS), seed=0):
+    """Пропускная способность и задержки чтений под gunicorn (WSGI) и uvicorn (ASGI) на одной сети"""
+    imported = generate_network(depth, fan_out, roots, products, products_per_element, seed=seed)
+    connection.cursor().execute('ANALYZE')
+    user, _ = User.objects.get_or_create(username='benchmark')
+    token = str(ClaimsTokenObtainPairSerializer.get_token(user).access_token)
+    rng = random.Random(seed)
+    element_ids = list(NetworkElement.objects.values_list('pk', flat=True))
+    root_ids = list(NetworkElement.objects.filter(network_lvl=1).values_list('pk', flat=True))
+    # Соединение команды не должно занимать место в max_connections во время нагрузки
+    connection.close()
+
+    results = {}
+    for name in scenarios:
+        kind, prefix = SERVER_SCENARIOS[name]
+        paths = server_paths(prefix, element_ids, root_ids, rng)
+        with serve(kind, workers, threads) as port:
+            asyncio.run(load(port, paths, token, min(concurrency, 20), 1, seed))  # прогрев воркеров
+            results[name] = asyncio.run(load(port, paths, token, concurrency, duration, seed))
+    return {
+        'commit': current_commit(),
+        'started_at': datetime.now(timezone.utc).isoformat(),
+        'network': {'depth': depth, 'fan_out': fan_out, 'roots': roots, 'elements': imported.created},
+        'load': {'concurrency': concurrency, 'duration': duration, 'workers': workers, 'threads': threads},
+        'servers': results,
+    }
@@ -0,0 +1,173 @@
+import hashlib
+from urllib.parse import urlencode
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import models, transaction
+from django.http import Http404
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from rest_framework.response import Response
+
+from .replicas import mark_written, may_be_stale
+
+KEY_PREFIX = 'sales_network'
+NAMESPACES = ('network', 'product')
+
+
+def _generation_key(namespace):
+    return f'{KEY_PREFIX}:generation:{namespace}'
+
+
+def _counter_key(namespace, kind):
+    return f'{KEY_PREFIX}:stats:{namespace}:{kind}'
+
+
+def get_generation(namespace):
+    key = _generation_key(namespace)
+    generation = cache.get(key)
+    if generation is None:
+        cache.add(key, uuid4().hex, None)
+        generation = cache.get(key)
+    return generation
+
+
+def _bump(namespaces):
+    cache.set_many({_generation_key(namespace): uuid4().hex for namespace in namespaces}, None)
+
+
+def invalidate(*namespaces):
+    """
+    Делает недействительными все закэшированные ответы пространств имен: ключи содержат поколение,
+    поэтому старые записи просто перестают читаться. Поколение меняется сразу и еще раз после коммита,
+    чтобы параллельное чтение незакоммиченного состояния не осталось в кэше.
+    """
+    _bump(namespaces)
+    transaction.on_commit(lambda: (_bump(namespaces), mark_written()))
+
+
+def _count(namespace, kind):
+    key = _counter_key(namespace, kind)
+    if not cache.add(key, 1, None):
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, None)
+
+
+def get_stats():
+    keys = {(namespace, kind): _counter_key(namespace, kind)
+            for namespace in NAMESPACES for kind in ('hits', 'misses')}
+    values = cache.get_many(keys.values())
+    return {
+        namespace: {kind: values.get(keys[namespace, kind], 0) for kind in ('hits', 'misses')}
+        for namespace in NAMESPACES
+    }
+
+
+def response_cache_key(namespace, request, action):
+    params = urlencode(sorted(request.query_params.lists()), doseq=True)
+    return f'{KEY_PREFIX}:response:{namespace}:{get_generation(namespace)}:{action}:{request.path}?{params}'
+
+
+class CachedReadMixin:
+    """
+    Кэширует данные ответов list и retrieve до первой записи в связанные модели. Работает только с общим
+    кэшем (SHARED_CACHE): сброс поколения в одном процессе должен быть виден всем остальным.
+    """
+    cache_namespace = None
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        if not settings.SHARED_CACHE:
+            return handler(request, *args, **kwargs)
+        key = response_cache_key(self.cache_namespace, request, self.action)
+        data = cache.get(key)
+        if data is not None:
+            _count(self.cache_namespace, 'hits')
+            return Response(data)
+
+        _count(self.cache_namespace, 'misses')
+        response = handler(request, *args, **kwargs)
+        if response.status_code == 200 and not may_be_stale():
+            cache.set(key, response.data, settings.RESPONSE_CACHE_TIMEOUT)
+        return response
+
+
+def version_state(queryset):
+    """Число строк, сумма версий и время последнего изменения выборки одним агрегатным запросом"""
+    return queryset.order_by().aggregate(
+        rows=models.Count('pk'), version=models.Sum('version'), updated_at=models.Max('updated_at'),
+    )
+
+
+def make_etag(state):
+    # Изменение строки меняет сумму версий и время изменения, добавление и удаление - число строк.
+    # ETag слабый: одни и те же данные отдаются разными рендерерами
+    digest = hashlib.md5(f"{state['rows']}:{state['version']}:{state['updated_at']}".encode(),
+                         usedforsecurity=False).hexdigest()
+    return f'W/"{digest}"'
+
+
+class ConditionalReadMixin:
+    """
+    ETag и Last-Modified для list и retrieve по версиям строк: при совпавшем If-None-Match ответ 304
+    отдается после одного агрегатного запроса (или без запросов, пока версия в кэше), без выборки и
+    сериализации строк. Ставится перед CachedReadMixin и использует его пространство имен кэша.
+    """
+
+    def list(self, request, *args, **kwargs):
+        state = self.get_version_state(request, self.filter_queryset(self.get_queryset()))
+        # Удаление строк не меняет время последнего изменения, поэтому список сравнивается только по ETag
+        return self.conditional_response(super().list, state, False, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        lookup = {self.lookup_field: kwargs[self.lookup_url_kwarg or self.lookup_field]}
+        try:
+            queryset = self.filter_queryset(self.get_queryset()).filter(**lookup)
+        except (TypeError, ValueError, DjangoValidationError):
+            # Как в get_object_or_404 из DRF: нечисловой pk - это 404, а не ошибка сервера
+            raise Http404
+        state = self.get_version_state(request, queryset)
+        if not state['rows']:
+            return super().retrieve(request, *args, **kwargs)
+        return self.conditional_response(super().retrieve, state, True, request, *args, **kwargs)
+
+    def get_version_state(self, request, queryset):
+        # Хранится рядом с закэшированным ответом и сбрасывается той же сменой поколения
+        if not settings.SHARED_CACHE:
+            return version_state(queryset)
+        key = response_cache_key(self.cache_namespace, request, f'{self.action}:version')
+        state = cache.get(key)
+        if state is None:
+            state = version_state(queryset)
+            if not may_be_stale():
+                cache.set(key, state, settings.RESPONSE_CACHE_TIMEOUT)
+        return state
+
+    def conditional_response(self, handler, state, with_last_modified, request, *args, **kwargs):
+        # Версия читается до данных: при параллельной записи клиент получит старый ETag и новые данные,
+        # что приведет лишь к лишней загрузке, а не к устаревшему ответу 304
+        etag = make_etag(state)
+        last_modified = None
+        if with_last_modified and state['updated_at'] is not None:
+            last_modified = int(state['updated_at'].timestamp())
+
+        response = get_conditional_response(request._request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = handler(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+        # Клиенты и прокси хранят ответ, но перед использованием проверяют его условным запросом
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
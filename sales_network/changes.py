@@ -0,0 +1,108 @@
+import base64
+
+from django.db.models import Q
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+
+from .models import Change, NetworkElement, Product
+from .serializers import NetworkElementSerializer, ProductSerializer
+
+DEFAULT_PAGE_SIZE = 500
+MAX_PAGE_SIZE = 1000
+
+
+class CursorExpired(APIException):
+    """Ответ 410 с курсором next на конец журнала, с которого продолжают после полной синхронизации"""
+    status_code = status.HTTP_410_GONE
+    default_detail = 'Курсор старше срока хранения журнала изменений, нужна полная синхронизация'
+    default_code = 'cursor_expired'
+
+    def __init__(self, head):
+        super().__init__({'detail': self.default_detail, 'next': encode_cursor(*head)})
+
+
+def feed_models():
+    """Выборка текущего состояния и сериализатор для каждой модели журнала"""
+    return {
+        'network': (NetworkElement.objects.with_products(), NetworkElementSerializer),
+        'product': (Product.objects.all(), ProductSerializer),
+    }
+
+
+def encode_cursor(txid, change_id):
+    return base64.urlsafe_b64encode(f'{txid}:{change_id}'.encode()).decode()
+
+
+def decode_cursor(value):
+    try:
+        txid, change_id = (int(part) for part in base64.urlsafe_b64decode(value.encode()).decode().split(':')[:2])
+    except (TypeError, ValueError, UnicodeDecodeError):
+        raise ValidationError({'since': ['Некорректный курсор']})
+    return txid, change_id
+
+
+def check_watermark(position):
+    """
+    Курсор до границы сжатия мог пропустить записи, удаленные по сроку хранения (в том числе удаления объектов).
+    Граница читается после записей страницы: сжатие, завершившееся между запросами, тоже будет замечено.
+    Чтение без курсора начинается с позиции (0, 0) и после такого сжатия тоже получает 410.
+    """
+    watermark = Change.objects.watermark()
+    if position < watermark:
+        head = Change.objects.committed().order_by('-txid', '-id').values_list('txid', 'id').first()
+        raise CursorExpired(max(head or watermark, watermark))
+
+
+def parse_page_size(query_params):
+    try:
+        page_size = int(query_params.get('page_size', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        raise ValidationError({'page_size': ['Размер страницы должен быть целым числом']})
+    return min(max(page_size, 1), MAX_PAGE_SIZE)
+
+
+def change_page(query_params, context=None):
+    """
+    Страница журнала изменений после курсора since: по одной записи на объект с его текущим состоянием (upsert)
+    или отметкой об удалении (delete), в порядке последнего изменения. Запросов - один к журналу, один к границе
+    сжатия и по одному на модель, поэтому стоимость зависит от числа изменений, а не от размера таблиц.
+    """
+    page_size = parse_page_size(query_params)
+    position = (0, 0)
+    since = query_params.get('since')
+    queryset = Change.objects.committed()
+    if since:
+        position = decode_cursor(since)
+        txid, change_id = position
+        queryset = queryset.filter(Q(txid__gt=txid) | Q(txid=txid, id__gt=change_id))
+    entries = list(queryset.order_by('txid', 'id').values_list(
+        'txid', 'id', 'model', 'object_id', 'action',
+    )[:page_size + 1])
+    check_watermark(position)
+    has_more = len(entries) > page_size
+    entries = entries[:page_size]
+    if entries:
+        position = entries[-1][:2]
+
+    # Несколько изменений объекта на странице сводятся к последнему
+    latest = {}
+    for _, _, model, object_id, action in entries:
+        latest.pop((model, object_id), None)
+        latest[model, object_id] = action
+
+    states = {}
+    for model, (queryset, serializer_class) in feed_models().items():
+        ids = [object_id for (name, object_id), action in latest.items() if name == model and action == Change.UPSERT]
+        if ids:
+            items = serializer_class(queryset.filter(pk__in=ids), many=True, context=context or {}).data
+            states.update(((model, item['id']), item) for item in items)
+
+    changes = []
+    for (model, object_id), action in latest.items():
+        # Объект, удаленный после изменения, отдается сразу удаленным
+        if action == Change.UPSERT and (model, object_id) in states:
+            changes.append({'model': model, 'id': object_id, 'action': Change.UPSERT,
+                            'data': states[model, object_id]})
+        else:
+            changes.append({'model': model, 'id': object_id, 'action': Change.DELETE})
+    return {'next': encode_cursor(*position), 'has_more': has_more, 'changes': changes}
@@ -0,0 +1,58 @@
+import csv
+import json
+
+from django.contrib.postgres.aggregates import ArrayAgg
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F, Q, Value
+
+# ref (равен id) и parent (ref родителя) - те же колонки, что читает импорт, поэтому выгрузку всей сети можно
+# импортировать обратно: родители находятся по ref, в том числе ниже по файлу
+EXPORT_FIELDS = ('id', 'name', 'email', 'country', 'city', 'street', 'building', 'ref', 'parent', 'created_at',
+                 'debt_to_parent', 'network_lvl', 'products')
+
+
+def export_rows(queryset, chunk_size=2000):
+    """
+    Строки выгрузки через серверный курсор. Продукты агрегируются в SQL в массив id,
+    поэтому на всю выгрузку приходится один запрос.
+    """
+    rows = queryset.order_by('pk').values(
+        'id', 'name', 'email', 'country', 'city', 'street', 'building', 'created_at', 'debt_to_parent',
+        'network_lvl',
+    ).annotate(
+        ref=F('id'),
+        parent=F('parent_id'),
+        products=ArrayAgg('products__id', filter=Q(products__isnull=False), ordering='products__id',
+                          default=Value([])),
+    )
+    for row in rows.iterator(chunk_size=chunk_size):
+        yield {name: row[name] for name in EXPORT_FIELDS}
+
+
+def ndjson_lines(rows):
+    encoder = DjangoJSONEncoder(ensure_ascii=False)
+    for row in rows:
+        yield encoder.encode(row) + '\n'
+
+
+class Echo:
+    """Псевдобуфер для csv.writer: возвращает строку вместо записи"""
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows):
+    # Формат колонок совместим с import_network: ref и parent, продукты через ';'
+    writer = csv.writer(Echo())
+    yield writer.writerow(EXPORT_FIELDS)
+    for row in rows:
+        row['products'] = ';'.join(str(product) for product in row['products'])
+        row['created_at'] = row['created_at'].isoformat() if row['created_at'] else ''
+        yield writer.writerow(row[name] for name in EXPORT_FIELDS)
+
+
+EXPORT_FORMATS = {
+    'ndjson': (ndjson_lines, 'application/x-ndjson'),
+    'csv': (csv_lines, 'text/csv'),
+}
@@ -0,0 +1,68 @@
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import SAFE_METHODS
+
+
+def parse_fields(query_params, available):
+    """Набор полей из ?fields=a,b и ?exclude=c или None, если ни один параметр не задан"""
+    if 'fields' not in query_params and 'exclude' not in query_params:
+        return None
+    errors = {}
+    selected = {}
+    for param in ('fields', 'exclude'):
+        names = [name.strip() for name in query_params.get(param, '').split(',') if name.strip()]
+        unknown = [name for name in names if name not in available]
+        if unknown:
+            errors[param] = [f'Неизвестные поля: {", ".join(unknown)}']
+        selected[param] = set(names)
+    if errors:
+        raise ValidationError(errors)
+
+    fields = selected['fields'] or set(available)
+    fields -= selected['exclude']
+    if not fields:
+        raise ValidationError({'fields': ['Не выбрано ни одного поля']})
+    return fields
+
+
+def restrict_queryset(queryset, fields):
+    """
+    Выборка только колонок запрошенных полей (первичный ключ нужен всегда). Связи многие-ко-многим
+    подгружаются, только если поле запрошено, иначе запрос к таблице связей не выполняется.
+    """
+    opts = queryset.model._meta
+    columns = [field.name for field in opts.concrete_fields if field.name in fields]
+    lookups = [lookup for lookup in queryset._prefetch_related_lookups
+               if getattr(lookup, 'prefetch_to', lookup).split('__')[0] in fields]
+    return queryset.only(opts.pk.name, *columns).prefetch_related(None).prefetch_related(*lookups)
+
+
+class SparseFieldsetMixin:
+    """
+    Разреженные наборы полей при чтении: ?fields=id,name,parent или ?exclude=street,building задают поля
+    сериализатора (через context['fields']) и колонки выборки. Поля из fieldset_required для действия
+    (например, id и parent для дерева) добавляются всегда.
+    """
+    fieldset_required = {}
+
+    def get_requested_fields(self):
+        if not hasattr(self, '_requested_fields'):
+            self._requested_fields = None
+            if self.request.method in SAFE_METHODS:
+                available = self.get_serializer_class()().fields.keys()
+                fields = parse_fields(self.request.query_params, available)
+                if fields is not None:
+                    fields |= set(self.fieldset_required.get(self.action, ()))
+                self._requested_fields = fields
+        return self._requested_fields
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['fields'] = self.get_requested_fields()
+        return context
+
+    def get_queryset(self):
+        return self.restrict_queryset(super().get_queryset())
+
+    def restrict_queryset(self, queryset):
+        fields = self.get_requested_fields()
+        return queryset if fields is None else restrict_queryset(queryset, fields)
@@ -0,0 +1,41 @@
+import django_filters
+from django.db.models import Q
+from django_filters import utils
+
+from .models import NetworkElement
+
+
+class CharInFilter(django_filters.BaseInFilter, django_filters.CharFilter):
+    """Несколько значений через запятую: ?country=Russia,USA"""
+
+
+class NetworkElementFilter(django_filters.FilterSet):
+    """
+    Фильтры списка элементов сети. Каждому фильтру соответствует индекс в БД (см. NetworkElement.Meta.indexes):
+    B-tree для точных значений и диапазонов, триграммный GIN для поиска подстроки без учета регистра.
+    """
+    country = CharInFilter(lookup_expr='in')
+    city = CharInFilter(lookup_expr='in')
+    debt_to_parent = django_filters.RangeFilter()
+    network_lvl = django_filters.RangeFilter()
+    created_at = django_filters.IsoDateTimeFromToRangeFilter()
+    name = django_filters.CharFilter(lookup_expr='icontains')
+    # NumberFilter вместо ModelChoiceFilter: проверка значения не требует запроса к БД
+    parent = django_filters.NumberFilter()
+    search = django_filters.CharFilter(method='filter_search', label='Поиск по названию и городу')
+
+    class Meta:
+        model = NetworkElement
+        fields = []
+
+    def filter_search(self, queryset, name, value):
+        # Оба условия попадают в триграммные индексы, поэтому OR выполняется через BitmapOr
+        return queryset.filter(Q(name__icontains=value) | Q(city__icontains=value))
+
+
+def filter_elements(request, queryset):
+    """Фильтры списка элементов для выборок вне NetworkElementViewSet (например, элементы продукта)"""
+    filterset = NetworkElementFilter(request.query_params, queryset=queryset, request=request)
+    if not filterset.is_valid():
+        raise utils.translate_validation(filterset.errors)
+    return filterset.qs
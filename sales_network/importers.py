@@ -0,0 +1,274 @@
+import csv
+import io
+import json
+import time
+from collections import defaultdict, deque
+from dataclasses import dataclass, field
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from .models import NetworkElement, NetworkElementClosure, Product
+from .stats import schedule_refresh
+
+ELEMENT_FIELDS = ('name', 'email', 'country', 'city', 'street', 'building', 'debt_to_parent')
+MAX_REPORTED_ERRORS = 1000
+
+
+@dataclass
+class ImportRow:
+    line: int
+    ref: str | None
+    parent_ref: str | None
+    parent_id: int | None
+    products: list
+    values: dict
+    network_lvl: int | None = None
+
+
+@dataclass
+class ImportResult:
+    created: int = 0
+    failed: int = 0
+    elapsed: float = 0.0
+    errors: list = field(default_factory=list)
+
+    @property
+    def rows_per_second(self):
+        return (self.created + self.failed) / self.elapsed if self.elapsed else 0.0
+
+
+def read_csv(stream):
+    """Строки CSV-файла; продукты перечисляются через ';'"""
+    for record in csv.DictReader(stream):
+        record['products'] = [value for value in (record.get('products') or '').split(';') if value.strip()]
+        yield record
+
+
+@dataclass
+class InvalidRecord:
+    """Строка, которую не удалось разобрать; импортер записывает ее как ошибку строки"""
+    message: str
+
+
+def read_jsonl(stream):
+    for line in stream:
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as error:
+                yield InvalidRecord(f'Некорректный JSON: {error.msg}')
+
+
+READERS = {
+    'csv': read_csv,
+    'jsonl': read_jsonl,
+}
+
+
+def open_text(file):
+    """Оборачивает бинарный поток (например, загруженный файл) для построчного чтения"""
+    if isinstance(file, io.TextIOBase):
+        return file
+    return io.TextIOWrapper(file, encoding='utf-8', newline='')
+
+
+class NetworkImporter:
+    """
+    Потоковый импорт элементов сети.
+
+    Каждая строка может иметь ссылку `ref`, по которой на нее ссылаются другие строки через `parent`
+    (в том числе до ее появления в файле), либо указывать существующий элемент через `parent_id`.
+    Уровни и циклы проверяются в памяти, запись идет пачками через bulk_create. В памяти держится только
+    текущая пачка, строки, ожидающие своего родителя, и соответствие ref -> (pk, уровень).
+
+    Ограничение: на строку с ref может сослаться любая следующая строка, поэтому все встреченные ref хранятся
+    до конца импорта, и память растет как O(число ref) (порядка сотни байт на ref). Строки без ref памяти
+    не занимают. Файлы с десятками миллионов ref стоит делить на части, ссылаясь из следующих частей
+    на уже загруженные элементы через parent_id.
+    """
+
+    def __init__(self, chunk_size=1000):
+        self.chunk_size = chunk_size
+        self.result = ImportResult()
+        self._chunk = []
+        self._ready = deque()
+        self._waiting = defaultdict(list)
+        self._resolved = {}
+        self._failed_refs = set()
+        self._seen_refs = set()
+
+    def run(self, records):
+        started = time.perf_counter()
+        with transaction.atomic():
+            for line, record in enumerate(records, start=1):
+                row = self._parse(line, record)
+                if row is not None:
+                    self._place(row)
+                    self._drain()
+            while self._chunk:
+                self._flush()
+                self._drain()
+            self._fail_unresolved()
+            if self.result.created:
+                schedule_refresh()
+        self.result.elapsed = time.perf_counter() - started
+        return self.result
+
+    def _parse(self, line, record):
+        if isinstance(record, InvalidRecord):
+            self._error(line, record.message)
+            return None
+        if not isinstance(record, dict):
+            self._error(line, 'Строка должна быть JSON-объектом')
+            return None
+        try:
+            ref = self._optional_str(record.get('ref'))
+            parent_ref = self._optional_str(record.get('parent'))
+            parent_id = self._optional_str(record.get('parent_id'))
+            parent_id = int(parent_id) if parent_id is not None else None
+            products = [int(product) for product in record.get('products') or []]
+        except (TypeError, ValueError):
+            self._error(line, 'Некорректные ссылки на родителя или продукты')
+            return None
+
+        row = ImportRow(line, ref, parent_ref, parent_id, products,
+                        {name: record.get(name) for name in ELEMENT_FIELDS if record.get(name) not in (None, '')})
+        if ref is not None:
+            if ref in self._seen_refs:
+                self._error(line, f'Повторяющийся ref "{ref}"')
+                return None
+            self._seen_refs.add(ref)
+        if parent_ref is not None and parent_id is not None:
+            self._fail(row, 'Нельзя одновременно указывать parent и parent_id')
+            return None
+        if parent_ref is not None and parent_ref == ref:
+            self._fail(row, 'Элемент не может быть родителем самому себе')
+            return None
+
+        element = NetworkElement(**row.values)
+        try:
+            element.clean_fields(exclude=['parent', 'products', 'created_at', 'network_lvl'])
+        except ValidationError as error:
+            self._fail(row, error.message_dict)
+            return None
+        row.values = {name: getattr(element, name) for name in ELEMENT_FIELDS}
+        return row
+
+    @staticmethod
+    def _optional_str(value):
+        if value is None or value == '':
+            return None
+        return str(value)
+
+    def _place(self, row):
+        if row.parent_ref is None:
+            self._chunk.append(row)
+        elif row.parent_ref in self._resolved:
+            row.parent_id, parent_lvl = self._resolved[row.parent_ref]
+            row.network_lvl = parent_lvl + 1
+            self._chunk.append(row)
+        elif row.parent_ref in self._failed_refs:
+            self._fail(row, 'Родительская строка не импортирована')
+        else:
+            # Родитель еще не записан: строка ждет его в памяти
+            self._waiting[row.parent_ref].append(row)
+        if len(self._chunk) >= self.chunk_size:
+            self._flush()
+
+    def _drain(self):
+        while self._ready:
+            self._place(self._ready.popleft())
+
+    def _flush(self):
+        chunk, self._chunk = self._chunk, []
+        chunk = self._resolve_database_parents(chunk)
+        chunk = self._check_products(chunk)
+        if not chunk:
+            return
+
+        elements = NetworkElement.objects.bulk_create([
+            NetworkElement(parent_id=row.parent_id, network_lvl=row.network_lvl, **row.values) for row in chunk
+        ])
+        element_ids = [element.pk for element in elements]
+        NetworkElementClosure.objects.link_many(element_ids)
+        NetworkElement.objects.filter(pk__in=element_ids).shift_ancestor_totals(1)
+        NetworkElement.products.through.objects.bulk_create([
+            NetworkElement.products.through(networkelement_id=element.pk, product_id=product_id)
+            for row, element in zip(chunk, elements)
+            for product_id in set(row.products)
+        ])
+        self.result.created += len(elements)
+
+        for row, element in zip(chunk, elements):
+            if row.ref is not None:
+                self._resolved[row.ref] = (element.pk, row.network_lvl)
+                self._ready.extend(self._waiting.pop(row.ref, ()))
+
+    def _resolve_database_parents(self, chunk):
+        parent_ids = {row.parent_id for row in chunk if row.network_lvl is None and row.parent_id is not None}
+        levels = {}
+        if parent_ids:
+            levels = dict(NetworkElement.objects.filter(pk__in=parent_ids).values_list('pk', 'network_lvl'))
+        resolved = []
+        for row in chunk:
+            if row.network_lvl is None:
+                if row.parent_id is None:
+                    row.network_lvl = 0
+                elif row.parent_id in levels:
+                    row.network_lvl = levels[row.parent_id] + 1
+                else:
+                    self._fail(row, f'Родитель с id={row.parent_id} не найден')
+                    continue
+            resolved.append(row)
+        return resolved
+
+    def _check_products(self, chunk):
+        product_ids = {product for row in chunk for product in row.products}
+        existing = set()
+        if product_ids:
+            existing = set(Product.objects.filter(pk__in=product_ids).values_list('pk', flat=True))
+        checked = []
+        for row in chunk:
+            missing = set(row.products) - existing
+            if missing:
+                self._fail(row, f'Продукты не найдены: {sorted(missing)}')
+            else:
+                checked.append(row)
+        return checked
+
+    def _fail_unresolved(self):
+        # Оставшиеся строки ждут родителя, который так и не был записан: либо его нет в файле, либо это цикл
+        waiting_rows = {row.ref: row for rows in self._waiting.values() for row in rows if row.ref is not None}
+        for parent_ref in list(self._waiting):
+            if parent_ref not in self._waiting:
+                continue
+            message = 'Обнаружена циклическая ссылка в иерархии'
+            if not self._in_cycle(parent_ref, waiting_rows):
+                message = f'Родительская строка "{parent_ref}" не найдена'
+            for row in self._waiting.pop(parent_ref):
+                self._fail(row, message)
+
+    @staticmethod
+    def _in_cycle(ref, waiting_rows):
+        visited = set()
+        while ref in waiting_rows and ref not in visited:
+            visited.add(ref)
+            ref = waiting_rows[ref].parent_ref
+        return ref in visited
+
+    def _fail(self, row, message):
+        failed = [(row, message)]
+        while failed:
+            row, message = failed.pop()
+            self._error(row.line, message)
+            if row.ref is not None:
+                self._failed_refs.add(row.ref)
+                failed.extend(
+                    (child, 'Родительская строка не импортирована') for child in self._waiting.pop(row.ref, ())
+                )
+
+    def _error(self, line, message):
+        self.result.failed += 1
+        if len(self.result.errors) < MAX_REPORTED_ERRORS:
+            self.result.errors.append({'line': line, 'error': message})
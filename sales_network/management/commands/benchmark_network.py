@@ -0,0 +1,52 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from sales_network.benchmarks import benchmark_database, benchmark_network
+
+
+class Command(BaseCommand):
+    help = ('Замер p50/p95 времени и числа SQL-запросов основных операций на синтетической сети '
+            '(в отдельной тестовой базе), результат в JSON')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--depth', type=int, default=3, help='Число уровней под корнем (не меньше 2)')
+        parser.add_argument('--fan-out', type=int, default=10, help='Число потомков у каждого элемента')
+        parser.add_argument('--roots', type=int, default=1, help='Число корневых элементов')
+        parser.add_argument('--products', type=int, default=20, help='Число продуктов')
+        parser.add_argument('--products-per-element', type=int, default=3)
+        parser.add_argument('--countries', default='Russia,USA,China', help='Страны через запятую')
+        parser.add_argument('--repeat', type=int, default=20, help='Число замеров каждой операции')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Путь к JSON-файлу с результатом (по умолчанию stdout)')
+        parser.add_argument('--check', action='store_true',
+                            help='Завершиться с ошибкой, если операция превысила бюджет запросов')
+        parser.add_argument('--keepdb', action='store_true', help='Не удалять тестовую базу после замера')
+
+    def handle(self, *args, **options):
+        if options['depth'] < 2:
+            raise CommandError('Для замера переноса нужна сеть глубиной не меньше 2')
+
+        with benchmark_database(keepdb=options['keepdb']):
+            result = benchmark_network(
+                options['depth'], options['fan_out'], options['roots'], options['products'],
+                options['products_per_element'], tuple(options['countries'].split(',')), options['repeat'],
+                options['seed'],
+            )
+
+        self.stderr.write(f"Элементов: {result['network']['elements']}")
+        for name, row in result['operations'].items():
+            self.stderr.write(
+                f"{name:>18}: p50 {row['p50_ms']:.1f} мс, p95 {row['p95_ms']:.1f} мс, "
+                f"SQL-запросов {row['queries_max']} (бюджет {row['query_budget']})"
+            )
+        report = json.dumps(result, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as stream:
+                stream.write(report)
+        else:
+            self.stdout.write(report)
+
+        over_budget = [name for name, row in result['operations'].items() if row['queries_max'] > row['query_budget']]
+        if options['check'] and over_budget:
+            raise CommandError(f"Превышен бюджет запросов: {', '.join(over_budget)}")
@@ -0,0 +1,35 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from sales_network.benchmarks import benchmark_database, benchmark_rendering
+
+
+class Command(BaseCommand):
+    help = ('Сравнение сериализации и рендеринга списка элементов: ModelSerializer и JSONRenderer против '
+            'выборки values() и orjson/MessagePack (в отдельной тестовой базе)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--depth', type=int, default=3, help='Число уровней под корнем')
+        parser.add_argument('--fan-out', type=int, default=10, help='Число потомков у каждого элемента')
+        parser.add_argument('--products', type=int, default=20, help='Число продуктов')
+        parser.add_argument('--products-per-element', type=int, default=3)
+        parser.add_argument('--page-size', type=int, default=1000, help='Размер страницы списка')
+        parser.add_argument('--repeat', type=int, default=10, help='Число замеров')
+        parser.add_argument('--keepdb', action='store_true', help='Не удалять тестовую базу после замера')
+
+    def handle(self, *args, **options):
+        with benchmark_database(keepdb=options['keepdb']):
+            result = benchmark_rendering(
+                options['depth'], options['fan_out'], products=options['products'],
+                products_per_element=options['products_per_element'], page_size=options['page_size'],
+                repeat=options['repeat'],
+            )
+
+        self.stderr.write(f"Элементов: {result['elements']}, страница: {result['page_size']}")
+        for name, row in result['paths'].items():
+            self.stderr.write(
+                f"{name:>18}: сериализация {row['serialize_ms']:.1f} мс, рендеринг {row['render_ms']:.1f} мс, "
+                f"SQL-запросов {row['queries']}, {row['bytes']} байт, совпадает: {row['equal']}"
+            )
+        self.stdout.write(json.dumps(result, ensure_ascii=False, indent=2))
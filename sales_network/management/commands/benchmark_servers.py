@@ -0,0 +1,53 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from sales_network.benchmarks import SERVER_SCENARIOS, benchmark_database, benchmark_servers
+
+
+class Command(BaseCommand):
+    help = ('Сравнение пропускной способности чтений под gunicorn (WSGI) и uvicorn (ASGI) при большом числе '
+            'одновременных клиентов на синтетической сети (в отдельной тестовой базе), результат в JSON')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--depth', type=int, default=3, help='Число уровней под корнем')
+        parser.add_argument('--fan-out', type=int, default=10, help='Число потомков у каждого элемента')
+        parser.add_argument('--roots', type=int, default=1, help='Число корневых элементов')
+        parser.add_argument('--products', type=int, default=20, help='Число продуктов')
+        parser.add_argument('--products-per-element', type=int, default=3)
+        parser.add_argument('--concurrency', type=int, default=200, help='Число одновременных клиентов')
+        parser.add_argument('--duration', type=float, default=10, help='Длительность нагрузки на сервер, с')
+        parser.add_argument('--workers', type=int, default=4, help='Число процессов у обоих серверов')
+        parser.add_argument('--threads', type=int, default=1,
+                            help='Потоков на воркер gunicorn (1 - синхронные воркеры)')
+        parser.add_argument('--scenarios', default=','.join(SERVER_SCENARIOS),
+                            help=f"Сценарии через запятую: {', '.join(SERVER_SCENARIOS)}")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Путь к JSON-файлу с результатом (по умолчанию stdout)')
+        parser.add_argument('--keepdb', action='store_true', help='Не удалять тестовую базу после замера')
+
+    def handle(self, *args, **options):
+        scenarios = tuple(options['scenarios'].split(','))
+        unknown = set(scenarios) - set(SERVER_SCENARIOS)
+        if unknown:
+            raise CommandError(f"Неизвестные сценарии: {', '.join(sorted(unknown))}")
+
+        with benchmark_database(keepdb=options['keepdb']):
+            result = benchmark_servers(
+                options['depth'], options['fan_out'], options['roots'], options['products'],
+                options['products_per_element'], options['concurrency'], options['duration'], options['workers'],
+                options['threads'], scenarios, options['seed'],
+            )
+
+        self.stderr.write(f"Элементов: {result['network']['elements']}, клиентов: {options['concurrency']}")
+        for name, row in result['servers'].items():
+            self.stderr.write(
+                f"{name:>17}: {row['rps']} запросов/с, p50 {row['p50_ms']} мс, p95 {row['p95_ms']} мс, "
+                f"p99 {row['p99_ms']} мс, ошибок {row['errors']}"
+            )
+        report = json.dumps(result, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as stream:
+                stream.write(report)
+        else:
+            self.stdout.write(report)
@@ -0,0 +1,26 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from sales_network.benchmarks import benchmark_database, benchmark_tree
+
+
+class Command(BaseCommand):
+    help = 'Сравнение /network/tree/ с рекурсивным retrieve на синтетической сети (в отдельной тестовой базе)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--depth', type=int, default=4, help='Число уровней под корнем')
+        parser.add_argument('--fan-out', type=int, default=10, help='Число потомков у каждого элемента')
+        parser.add_argument('--keepdb', action='store_true', help='Не удалять тестовую базу после замера')
+
+    def handle(self, *args, **options):
+        with benchmark_database(keepdb=options['keepdb']):
+            result = benchmark_tree(options['depth'], options['fan_out'])
+
+        self.stdout.write(f"Элементов: {result['elements']}")
+        for name in ('tree', 'recursive'):
+            row = result[name]
+            self.stdout.write(
+                f"{name:>10}: {row['seconds']:.3f} с, запросов к API: {row['requests']}, SQL-запросов: {row['queries']}"
+            )
+        self.stdout.write(json.dumps(result))
@@ -0,0 +1,18 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from sales_network.models import Change
+
+
+class Command(BaseCommand):
+    help = 'Сжимает журнал изменений: удаляет замененные и устаревшие записи (для запуска по расписанию)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.CHANGES_RETENTION_DAYS,
+                            help='Срок хранения записей в днях')
+
+    def handle(self, *args, **options):
+        deleted = Change.objects.compact(timedelta(days=options['days']))
+        self.stdout.write(f'Удалено записей журнала: {deleted}')
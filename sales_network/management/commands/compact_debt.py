@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from sales_network.models import DebtTransaction
+
+
+class Command(BaseCommand):
+    help = 'Учитывает накопленные проводки журнала в долге элементов сети (для запуска по расписанию)'
+
+    def handle(self, *args, **options):
+        elements = DebtTransaction.objects.compact()
+        self.stdout.write(f'Обновлен долг у {elements} элементов')
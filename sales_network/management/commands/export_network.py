@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from sales_network.exporters import EXPORT_FORMATS, export_rows
+from sales_network.models import NetworkElement
+
+
+class Command(BaseCommand):
+    help = 'Потоковая выгрузка всей сети в NDJSON или CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output-format', choices=sorted(EXPORT_FORMATS), default='ndjson')
+        parser.add_argument('--country', help='Выгрузить только элементы указанной страны')
+        parser.add_argument('--output', help='Путь к файлу (по умолчанию stdout)')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Размер пачки серверного курсора')
+
+    def handle(self, *args, **options):
+        queryset = NetworkElement.objects.all()
+        if options['country']:
+            queryset = queryset.filter(country=options['country'])
+
+        lines, _ = EXPORT_FORMATS[options['output_format']]
+        rows = export_rows(queryset, chunk_size=options['chunk_size'])
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8', newline='') as stream:
+                stream.writelines(lines(rows))
+        else:
+            for line in lines(rows):
+                self.stdout.write(line, ending='')
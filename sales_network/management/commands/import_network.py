@@ -0,0 +1,30 @@
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from sales_network.importers import NetworkImporter, READERS
+
+
+class Command(BaseCommand):
+    help = 'Потоковый импорт элементов сети из CSV или JSONL файла'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Путь к файлу с элементами сети')
+        parser.add_argument('--format', choices=sorted(READERS), help='Формат файла (по умолчанию по расширению)')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Размер пачки для bulk_create')
+
+    def handle(self, *args, **options):
+        path = Path(options['path'])
+        file_format = options['format'] or path.suffix.lstrip('.').lower()
+        if file_format not in READERS:
+            raise CommandError(f'Неизвестный формат файла: {file_format}')
+
+        with path.open(encoding='utf-8', newline='') as stream:
+            result = NetworkImporter(chunk_size=options['chunk_size']).run(READERS[file_format](stream))
+
+        for error in result.errors:
+            self.stderr.write(f"Строка {error['line']}: {error['error']}")
+        self.stdout.write(self.style.SUCCESS(
+            f'Импортировано: {result.created}, с ошибками: {result.failed}, '
+            f'время: {result.elapsed:.2f} с ({result.rows_per_second:.0f} строк/с)'
+        ))
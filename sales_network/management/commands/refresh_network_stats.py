@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from sales_network.stats import refresh_stale, refresh_stats
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитывает статистику сети по странам и уровням, если после прошлого пересчета были массовые записи '
+        '(для запуска по расписанию или фоновым процессом с --interval)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--blocking', action='store_true',
+                            help='Пересчет без CONCURRENTLY: быстрее, но блокирует чтение статистики')
+        parser.add_argument('--force', action='store_true', help='Пересчитать без отметки об устаревании')
+        parser.add_argument('--interval', type=float,
+                            help='Работать постоянно, проверяя отметку раз в указанное число секунд')
+
+    def handle(self, *args, **options):
+        concurrently = not options['blocking']
+        if options['force']:
+            refresh_stats(concurrently=concurrently)
+            self.stdout.write('Статистика сети пересчитана')
+            return
+        while True:
+            if refresh_stale(concurrently=concurrently):
+                self.stdout.write('Статистика сети пересчитана')
+            elif options['interval'] is None:
+                self.stdout.write('Статистика сети актуальна')
+            if options['interval'] is None:
+                return
+            # Все записи за интервал учитываются одним пересчетом
+            time.sleep(options['interval'])
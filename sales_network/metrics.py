@@ -0,0 +1,173 @@
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_current = ContextVar('sales_network_request_metrics', default=None)
+
+
+class RequestMetrics:
+    """Замеры одного запроса: заполняются middleware, обертками запросов к БД, сериализаторами и рендерером"""
+    __slots__ = ('endpoint', 'queries', 'db_time', 'serialization_time', 'render_time', 'statements')
+
+    def __init__(self):
+        self.endpoint = 'unresolved'
+        self.queries = 0
+        self.db_time = 0.0
+        self.serialization_time = 0.0
+        self.render_time = 0.0
+        # Текст запроса с плейсхолдерами одинаков для всех строк, поэтому N+1 виден как повтор одного текста
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        if _current.get() is not self:
+            # Обертка другого асинхронного запроса на общем соединении
+            return execute(sql, params, many, context)
+        started = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += perf_counter() - started
+            self.queries += 1
+            self.statements[sql] += 1
+
+    def duplicates(self, threshold):
+        return [(sql, count) for sql, count in self.statements.most_common() if count >= threshold]
+
+
+def current():
+    return _current.get()
+
+
+@contextmanager
+def collect():
+    metrics = RequestMetrics()
+    token = _current.set(metrics)
+    try:
+        yield metrics
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def timed(attribute):
+    """Добавляет время блока к полю метрик текущего запроса (вне запроса ничего не делает)"""
+    metrics = _current.get()
+    if metrics is None:
+        yield
+        return
+    started = perf_counter()
+    try:
+        yield
+    finally:
+        setattr(metrics, attribute, getattr(metrics, attribute) + perf_counter() - started)
+
+
+class _Series:
+    __slots__ = ('count', 'latency', 'buckets', 'queries', 'db_time', 'serialization_time', 'render_time',
+                 'response_bytes', 'duplicate_requests')
+
+    def __init__(self):
+        self.count = 0
+        self.latency = 0.0
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.queries = 0
+        self.db_time = 0.0
+        self.serialization_time = 0.0
+        self.render_time = 0.0
+        self.response_bytes = 0
+        self.duplicate_requests = 0
+
+
+def _labels(**labels):
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in labels.items()) + '}'
+
+
+class MetricsRegistry:
+    """
+    Агрегаты по эндпоинтам в памяти процесса. При нескольких воркерах каждый процесс отдает свои значения,
+    Prometheus различает их по instance.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._series = {}
+        self._statuses = Counter()
+
+    def observe(self, method, status, latency, metrics, response_bytes, has_duplicates):
+        key = (metrics.endpoint, method)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = _Series()
+            series.count += 1
+            series.latency += latency
+            for index, bound in enumerate(LATENCY_BUCKETS):
+                if latency <= bound:
+                    series.buckets[index] += 1
+                    break
+            series.queries += metrics.queries
+            series.db_time += metrics.db_time
+            series.serialization_time += metrics.serialization_time
+            series.render_time += metrics.render_time
+            series.response_bytes += response_bytes
+            series.duplicate_requests += has_duplicates
+            self._statuses[metrics.endpoint, method, status] += 1
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+            self._statuses.clear()
+
+    def render(self):
+        """Текстовый формат Prometheus"""
+        with self._lock:
+            series = sorted(self._series.items())
+            statuses = sorted(self._statuses.items())
+
+        lines = [
+            '# HELP sales_network_requests_total Число запросов',
+            '# TYPE sales_network_requests_total counter',
+        ]
+        for (endpoint, method, status), count in statuses:
+            lines.append(f'sales_network_requests_total{_labels(endpoint=endpoint, method=method, status=status)} {count}')
+
+        lines += [
+            '# HELP sales_network_request_duration_seconds Время обработки запроса',
+            '# TYPE sales_network_request_duration_seconds histogram',
+        ]
+        for (endpoint, method), values in series:
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS, values.buckets):
+                cumulative += count
+                lines.append(f'sales_network_request_duration_seconds_bucket'
+                             f'{_labels(endpoint=endpoint, method=method, le=bound)} {cumulative}')
+            lines.append(f'sales_network_request_duration_seconds_bucket'
+                         f'{_labels(endpoint=endpoint, method=method, le="+Inf")} {values.count}')
+            lines.append(f'sales_network_request_duration_seconds_sum{_labels(endpoint=endpoint, method=method)} '
+                         f'{values.latency}')
+            lines.append(f'sales_network_request_duration_seconds_count{_labels(endpoint=endpoint, method=method)} '
+                         f'{values.count}')
+
+        counters = (
+            ('db_queries_total', 'Число SQL-запросов', 'queries'),
+            ('db_duration_seconds_total', 'Время SQL-запросов', 'db_time'),
+            ('serialization_seconds_total', 'Время сериализации (serializer.data)', 'serialization_time'),
+            ('render_seconds_total', 'Время рендеринга ответа', 'render_time'),
+            ('response_bytes_total', 'Размер ответов (без потоковых)', 'response_bytes'),
+            ('duplicate_query_requests_total', 'Запросы с повторяющимися SQL-запросами (N+1)', 'duplicate_requests'),
+        )
+        for name, description, attribute in counters:
+            lines += [f'# HELP sales_network_{name} {description}', f'# TYPE sales_network_{name} counter']
+            for (endpoint, method), values in series:
+                lines.append(f'sales_network_{name}{_labels(endpoint=endpoint, method=method)} '
+                             f'{getattr(values, attribute)}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
@@ -0,0 +1,146 @@
+import logging
+from contextlib import ExitStack, contextmanager
+from time import perf_counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from rest_framework.permissions import SAFE_METHODS
+
+from .metrics import collect, current, registry
+from .replicas import pin
+
+logger = logging.getLogger('sales_network.requests')
+
+
+def endpoint_name(request, view_func):
+    """Имя эндпоинта для меток: класс представления и действие DRF, иначе имя маршрута"""
+    view_class = getattr(view_func, 'cls', None) or getattr(view_func, 'view_class', None)
+    if view_class is not None:
+        action = (getattr(view_func, 'actions', None) or {}).get(request.method.lower())
+        return f'{view_class.__name__}.{action}' if action else view_class.__name__
+    if request.resolver_match is not None:
+        return request.resolver_match.view_name
+    return getattr(view_func, '__qualname__', 'unknown')
+
+
+class InstrumentationMiddleware:
+    """
+    Время запроса, число и время SQL-запросов, время сериализации и рендеринга, размер ответа и повторяющиеся
+    SQL-запросы (N+1) по эндпоинтам. Данные отдаются на /metrics/, медленные запросы пишутся в лог
+    sales_network.requests, если задан SLOW_REQUEST_SECONDS.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with self.instrument() as metrics:
+            started = perf_counter()
+            response = self.get_response(request)
+            latency = perf_counter() - started
+        self.report(request, response, metrics, latency)
+        return response
+
+    async def __acall__(self, request):
+        with collect() as metrics:
+            # Асинхронный ORM выполняет запросы в синхронном потоке со своими соединениями, обертки ставятся там
+            await sync_to_async(self.attach)(metrics)
+            try:
+                started = perf_counter()
+                response = await self.get_response(request)
+                latency = perf_counter() - started
+            finally:
+                await sync_to_async(self.detach)(metrics)
+        self.report(request, response, metrics, latency)
+        return response
+
+    @staticmethod
+    @contextmanager
+    def instrument():
+        with collect() as metrics, ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(metrics))
+            yield metrics
+
+    @staticmethod
+    def attach(metrics):
+        for connection in connections.all():
+            connection.execute_wrappers.append(metrics)
+
+    @staticmethod
+    def detach(metrics):
+        # Параллельные запросы делят соединения синхронного потока, поэтому удаляется именно своя обертка
+        for connection in connections.all():
+            connection.execute_wrappers.remove(metrics)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        metrics = current()
+        if metrics is not None:
+            metrics.endpoint = endpoint_name(request, view_func)
+
+    @staticmethod
+    def report(request, response, metrics, latency):
+        duplicates = metrics.duplicates(settings.DUPLICATE_QUERY_THRESHOLD)
+        response_bytes = 0 if response.streaming else len(response.content)
+        registry.observe(request.method, response.status_code, latency, metrics, response_bytes, bool(duplicates))
+
+        if duplicates:
+            sql, count = duplicates[0]
+            logger.warning('Повторяющийся SQL-запрос (%s раз) в %s %s: %s',
+                           count, request.method, metrics.endpoint, sql[:300])
+        if settings.SLOW_REQUEST_SECONDS and latency >= settings.SLOW_REQUEST_SECONDS:
+            logger.warning(
+                'Медленный запрос %s %s (%s): %.3f с, SQL-запросов %s за %.3f с, сериализация %.3f с, '
+                'рендеринг %.3f с, %s байт',
+                request.method, request.get_full_path(), metrics.endpoint, latency, metrics.queries,
+                metrics.db_time, metrics.serialization_time, metrics.render_time, response_bytes,
+            )
+
+
+class ReplicaStickinessMiddleware:
+    """
+    Read-your-writes при чтении с реплик: после успешного изменяющего запроса пользователь
+    REPLICA_STICKY_SECONDS секунд читает с основной БД. Пользователь берется после обработки запроса,
+    поэтому учитывается и JWT-аутентификация DRF.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        response = self.get_response(request)
+        if self.is_write(request, response):
+            self.pin_user(request)
+        return response
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        if self.is_write(request, response):
+            # Пользователь сессии загружается лениво, запросом к БД
+            await sync_to_async(self.pin_user)(request)
+        return response
+
+    @staticmethod
+    def is_write(request, response):
+        return bool(settings.REPLICA_DATABASES) and request.method not in SAFE_METHODS and response.status_code < 400
+
+    @staticmethod
+    def pin_user(request):
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            pin(user.pk)
@@ -0,0 +1,51 @@
+# Generated by Django 5.1.7 on 2026-10-18 11:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def fill_closure(apps, schema_editor):
+    # Заполняем таблицу замыканий для уже существующих элементов уровень за уровнем
+    closure = apps.get_model('sales_network', 'NetworkElementClosure')._meta.db_table
+    element = apps.get_model('sales_network', 'NetworkElement')._meta.db_table
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {closure} (ancestor_id, descendant_id, depth) SELECT id, id, 0 FROM {element}'
+        )
+        depth = 0
+        inserted = cursor.rowcount
+        while inserted:
+            cursor.execute(
+                f'INSERT INTO {closure} (ancestor_id, descendant_id, depth) '
+                f'SELECT c.ancestor_id, e.id, c.depth + 1 FROM {closure} c '
+                f'JOIN {element} e ON e.parent_id = c.descendant_id WHERE c.depth = %s',
+                [depth],
+            )
+            depth += 1
+            inserted = cursor.rowcount
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales_network', '0004_alter_networkelement_debt_to_parent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NetworkElementClosure',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('depth', models.PositiveIntegerField(verbose_name='Глубина')),
+                ('ancestor', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='descendant_links', to='sales_network.networkelement', verbose_name='Предок')),
+                ('descendant', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='ancestor_links', to='sales_network.networkelement', verbose_name='Потомок')),
+            ],
+            options={
+                'verbose_name': 'Связь иерархии',
+                'verbose_name_plural': 'Связи иерархии',
+                'indexes': [models.Index(fields=['descendant', 'depth'], name='closure_descendant_depth_idx'), models.Index(fields=['ancestor', 'depth'], name='closure_ancestor_depth_idx')],
+                'constraints': [models.UniqueConstraint(fields=('ancestor', 'descendant'), name='closure_unique_ancestor_descendant')],
+            },
+        ),
+        migrations.RunPython(fill_closure, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.7 on 2026-10-18 12:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales_network', '0005_networkelementclosure'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='networkelement',
+            name='descendants_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество потомков'),
+        ),
+        migrations.AddField(
+            model_name='networkelement',
+            name='subtree_debt',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=15, verbose_name='Долг поддерева'),
+        ),
+        migrations.RunSQL(
+            'UPDATE sales_network_networkelement e SET '
+            'subtree_debt = COALESCE((SELECT SUM(COALESCE(d.debt_to_parent, 0)) '
+            'FROM sales_network_networkelementclosure c '
+            'JOIN sales_network_networkelement d ON d.id = c.descendant_id '
+            'WHERE c.ancestor_id = e.id AND c.depth > 0), 0), '
+            'descendants_count = (SELECT COUNT(*) FROM sales_network_networkelementclosure c '
+            'WHERE c.ancestor_id = e.id AND c.depth > 0)',
+            migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.1.7 on 2026-10-18 12:06
+
+import django.contrib.postgres.indexes
+import django.db.models.functions.text
+from django.contrib.postgres.operations import AddIndexConcurrently, TrigramExtension
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Индексы строятся CONCURRENTLY, чтобы не блокировать запись в большую таблицу
+    atomic = False
+
+    dependencies = [
+        ('sales_network', '0006_networkelement_subtree_totals'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        AddIndexConcurrently(
+            model_name='networkelement',
+            index=models.Index(fields=['country'], name='network_country_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='networkelement',
+            index=models.Index(fields=['city'], name='network_city_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='networkelement',
+            index=models.Index(fields=['network_lvl'], name='network_lvl_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='networkelement',
+            index=models.Index(fields=['debt_to_parent'], name='network_debt_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='networkelement',
+            index=models.Index(fields=['created_at'], name='network_created_at_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='networkelement',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('name'), name='gin_trgm_ops'), name='network_name_trgm_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='networkelement',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('city'), name='gin_trgm_ops'), name='network_city_trgm_idx'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.1.7 on 2026-10-18 12:09
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales_network', '0007_networkelement_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DebtTransaction',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=11, verbose_name='Сумма')),
+                ('comment', models.CharField(blank=True, default='', verbose_name='Комментарий')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата проводки')),
+                ('compacted', models.BooleanField(default=False, editable=False, verbose_name='Учтена в долге')),
+                ('element', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='debt_transactions', to='sales_network.networkelement', verbose_name='Звено сети')),
+            ],
+            options={
+                'verbose_name': 'Проводка по долгу',
+                'verbose_name_plural': 'Проводки по долгу',
+                'indexes': [models.Index(condition=models.Q(('compacted', False)), fields=['element'], name='debt_transaction_pending_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.1.7 on 2026-10-18 13:20
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    # Таблица связей создается Django автоматически, поэтому индекс добавляется SQL, CONCURRENTLY
+    atomic = False
+
+    dependencies = [
+        ('sales_network', '0009_versions'),
+    ]
+
+    operations = [
+        # Уникальный индекс (networkelement_id, product_id) покрывает продукты элемента, этот - элементы продукта;
+        # оба позволяют соединять таблицы только по индексу
+        migrations.RunSQL(
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS network_products_product_element_idx '
+            'ON sales_network_networkelement_products (product_id, networkelement_id)',
+            'DROP INDEX CONCURRENTLY IF EXISTS network_products_product_element_idx',
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.1.7 on 2026-10-18 16:05
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales_network', '0010_networkelement_products_product_idx'),
+    ]
+
+    operations = [
+        # Тот же расчет, что NetworkElementQuerySet.country_stats(). Представление зависит от колонок country,
+        # network_lvl и debt_to_parent: перед изменением их типа его нужно удалить и создать заново
+        migrations.RunSQL(
+            'CREATE MATERIALIZED VIEW sales_network_networkstats AS '
+            'SELECT e.country, COALESCE(e.network_lvl, 0) AS network_lvl, COUNT(*) AS elements, '
+            'COALESCE(SUM(e.debt_to_parent), 0) AS debt_to_parent, '
+            'COUNT(*) FILTER (WHERE EXISTS (SELECT 1 FROM sales_network_networkelement_products p '
+            'WHERE p.networkelement_id = e.id)) AS elements_with_products '
+            'FROM sales_network_networkelement e GROUP BY e.country, COALESCE(e.network_lvl, 0)',
+            'DROP MATERIALIZED VIEW IF EXISTS sales_network_networkstats',
+        ),
+        # Уникальный индекс нужен для REFRESH CONCURRENTLY и чтения статистики по стране
+        migrations.RunSQL(
+            'CREATE UNIQUE INDEX sales_network_networkstats_key ON sales_network_networkstats (country, network_lvl)',
+            'DROP INDEX IF EXISTS sales_network_networkstats_key',
+        ),
+    ]
@@ -0,0 +1,76 @@
+# Generated by Django 5.1.7 on 2026-10-18 13:05
+
+import django.db.models.functions.datetime
+from django.db import migrations, models
+
+# Триггеры уровня оператора с таблицами переходов: массовый UPDATE или DELETE дает одну вставку в журнал
+LOG_FUNCTIONS = """
+CREATE FUNCTION sales_network_log_change() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    INSERT INTO sales_network_change (txid, model, object_id, action)
+    SELECT pg_current_xact_id()::text::bigint, TG_ARGV[0], changed.id, TG_ARGV[1] FROM changed;
+    RETURN NULL;
+END $$;
+
+CREATE FUNCTION sales_network_log_products_change() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    INSERT INTO sales_network_change (txid, model, object_id, action)
+    SELECT DISTINCT pg_current_xact_id()::text::bigint, 'network', changed.networkelement_id, 'upsert' FROM changed;
+    RETURN NULL;
+END $$;
+"""
+
+
+def log_triggers(table, model):
+    return [
+        f'CREATE TRIGGER {table}_log_insert AFTER INSERT ON {table} REFERENCING NEW TABLE AS changed '
+        f"FOR EACH STATEMENT EXECUTE FUNCTION sales_network_log_change('{model}', 'upsert')",
+        f'CREATE TRIGGER {table}_log_update AFTER UPDATE ON {table} REFERENCING NEW TABLE AS changed '
+        f"FOR EACH STATEMENT EXECUTE FUNCTION sales_network_log_change('{model}', 'upsert')",
+        f'CREATE TRIGGER {table}_log_delete AFTER DELETE ON {table} REFERENCING OLD TABLE AS changed '
+        f"FOR EACH STATEMENT EXECUTE FUNCTION sales_network_log_change('{model}', 'delete')",
+    ]
+
+
+# Связи с продуктами входят в ответ элемента, поэтому их изменение - изменение элемента
+PRODUCTS_TABLE = 'sales_network_networkelement_products'
+PRODUCTS_TRIGGERS = [
+    f'CREATE TRIGGER {PRODUCTS_TABLE}_log_insert AFTER INSERT ON {PRODUCTS_TABLE} REFERENCING NEW TABLE AS changed '
+    f'FOR EACH STATEMENT EXECUTE FUNCTION sales_network_log_products_change()',
+    f'CREATE TRIGGER {PRODUCTS_TABLE}_log_delete AFTER DELETE ON {PRODUCTS_TABLE} REFERENCING OLD TABLE AS changed '
+    f'FOR EACH STATEMENT EXECUTE FUNCTION sales_network_log_products_change()',
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales_network', '0011_network_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Change',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('txid', models.BigIntegerField(verbose_name='Транзакция')),
+                ('model', models.CharField(max_length=20, verbose_name='Модель')),
+                ('object_id', models.BigIntegerField(verbose_name='Объект')),
+                ('action', models.CharField(choices=[('upsert', 'Изменение'), ('delete', 'Удаление')], max_length=10, verbose_name='Действие')),
+                ('created_at', models.DateTimeField(db_default=django.db.models.functions.datetime.Now(), verbose_name='Дата изменения')),
+            ],
+            options={
+                'verbose_name': 'Изменение',
+                'verbose_name_plural': 'Журнал изменений',
+                'indexes': [models.Index(fields=['txid', 'id'], name='change_position_idx')],
+            },
+        ),
+        migrations.RunSQL(
+            [LOG_FUNCTIONS,
+             *log_triggers('sales_network_networkelement', 'network'),
+             *log_triggers('sales_network_product', 'product'),
+             *PRODUCTS_TRIGGERS],
+            # Триггеры удаляются вместе с функциями
+            'DROP FUNCTION sales_network_log_change, sales_network_log_products_change CASCADE',
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.1.7 on 2026-10-18 13:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales_network', '0012_change'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('txid', models.BigIntegerField(verbose_name='Транзакция')),
+                ('change_id', models.BigIntegerField(verbose_name='Запись журнала')),
+            ],
+            options={
+                'verbose_name': 'Граница журнала изменений',
+                'verbose_name_plural': 'Границы журнала изменений',
+            },
+        ),
+    ]
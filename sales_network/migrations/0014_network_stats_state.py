@@ -0,0 +1,30 @@
+# Generated by Django 5.1.7 on 2026-10-18 13:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales_network', '0013_change_watermark'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NetworkStatsState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stale', models.BooleanField(default=True, verbose_name='Требует пересчета')),
+                ('refreshed_at', models.DateTimeField(blank=True, null=True, verbose_name='Дата пересчета')),
+            ],
+            options={
+                'verbose_name': 'Состояние статистики сети',
+                'verbose_name_plural': 'Состояние статистики сети',
+            },
+        ),
+        # Записи до этой миграции могли не попасть в статистику: первый запуск refresh_network_stats ее пересчитает
+        migrations.RunSQL(
+            'INSERT INTO sales_network_networkstatsstate (id, stale) VALUES (1, true)',
+            migrations.RunSQL.noop,
+        ),
+    ]
@@ -1,5 +1,149 @@
-from django.db import models
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.db import models, connection, transaction
+from django.db.models.functions import Coalesce, Now, Upper
 from django.core.exceptions import ValidationError
+from django.utils import timezone
+
+from .cache import invalidate
+from .stats import schedule_refresh
+
+# Число элементов в одной пачке удаления поддеревьев
+DELETE_CHUNK_SIZE = 1000
+
+
+class NetworkElementQuerySet(models.QuerySet):
+
+    def update(self, **kwargs):
+        # Долг и итоги поддерева меняются только вместе с итогами предков: через журнал проводок или перенос
+        maintained = sorted(set(kwargs) & set(NetworkElement.MAINTAINED_FIELDS))
+        if maintained:
+            raise ValueError(f'Поля {", ".join(maintained)} поддерживаются журналом проводок и итогами поддерева '
+                             f'и не изменяются через update()')
+        return self.update_maintained(**kwargs)
+
+    def update_maintained(self, **kwargs):
+        """update() без проверки полей: для запросов, которые сами согласуют итоги предков (см. shift_totals)"""
+        # Массовые обновления не отправляют post_save, поэтому кэш сбрасывается и версии строк меняются здесь
+        kwargs.setdefault('version', models.F('version') + 1)
+        kwargs.setdefault('updated_at', timezone.now())
+        rows = super().update(**kwargs)
+        invalidate('network')
+        schedule_refresh()
+        return rows
+
+    def with_products(self):
+        """
+        Продукты элементов одним запросом на выборку. Порядок по id продукта одинаков во всех ответах,
+        в том числе в списках ValuesListSerializer
+        """
+        return self.prefetch_related(models.Prefetch('products', queryset=Product.objects.order_by('pk')))
+
+    def touch(self):
+        """Новая версия строк без изменения полей, например после изменения связей с продуктами"""
+        return self.update()
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = super().bulk_create(objs, *args, **kwargs)
+        invalidate('network')
+        schedule_refresh()
+        return objs
+
+    def shift_ancestor_totals(self, sign):
+        """
+        Прибавляет (sign=1) или вычитает (sign=-1) итоги поддеревьев элементов выборки у всех их предков.
+        Элементы выборки не должны быть предками друг друга.
+        """
+        NetworkElementClosure.objects.filter(descendant__in=self, depth__gt=0).shift_totals(
+            debt=sign * (Coalesce('descendant__debt_to_parent', models.Value(0), output_field=models.DecimalField())
+                         + models.F('descendant__subtree_debt')),
+            count=sign * (models.F('descendant__descendants_count') + 1),
+        )
+
+    def subtree_roots(self):
+        """Элементы выборки, ни один предок которых в выборку не входит"""
+        return self.exclude(pk__in=NetworkElementClosure.objects.filter(
+            descendant__in=self, ancestor__in=self, depth__gt=0,
+        ).values('descendant'))
+
+    def with_balance(self):
+        """Текущий долг: учтенный в debt_to_parent плюс неучтенные проводки журнала"""
+        return self.annotate(balance=Coalesce(
+            models.F('debt_to_parent'), models.Value(0), output_field=models.DecimalField()
+        ) + Coalesce(
+            models.Sum('debt_transactions__amount', filter=models.Q(debt_transactions__compacted=False)),
+            models.Value(0), output_field=models.DecimalField(),
+        ))
+
+    def country_stats(self):
+        """
+        Число элементов, долг и число элементов с продуктами по странам и уровням. Тот же запрос, что у
+        материализованного представления статистики (см. stats.py), для СУБД без него.
+        """
+        links = NetworkElement.products.through.objects.filter(networkelement=models.OuterRef('pk'))
+        return self.annotate(level=Coalesce('network_lvl', 0)).values('country', 'level').annotate(
+            elements=models.Count('pk'),
+            debt_to_parent=Coalesce(models.Sum('debt_to_parent'), models.Value(0), output_field=models.DecimalField()),
+            elements_with_products=models.Count('pk', filter=models.Q(models.Exists(links))),
+        ).values('country', 'elements', 'debt_to_parent', 'elements_with_products',
+                 network_lvl=models.F('level')).order_by('country', 'level')
+
+    def zero_debt(self, comment='Аннулирование долга'):
+        """Аннулирует долг перед поставщиком встречными проводками и сразу учитывает их вместе с итогами предков"""
+        with transaction.atomic():
+            balances = self.with_balance().exclude(balance=0).values_list('pk', 'balance')
+            DebtTransaction.objects.post((pk, -balance, comment) for pk, balance in balances)
+            return DebtTransaction.objects.compact(element_ids=self.values_list('pk', flat=True))
+
+    def delete(self):
+        with transaction.atomic():
+            self.subtree_roots().shift_ancestor_totals(-1)
+            return super().delete()
+
+    def delete_subtrees(self, chunk_size=DELETE_CHUNK_SIZE):
+        """
+        Удаляет элементы выборки вместе с поддеревьями без сборщика удаления Django, который загружает всех
+        потомков и их связи в память. Потомки каждого корня читаются из таблицы замыканий пачками по chunk_size
+        (по индексу ancestor_id, descendant_id), и для пачки удаляются связи с продуктами, проводки, связи иерархии
+        и сами элементы. Все в одной транзакции, в памяти одновременно только id одной пачки.
+        Возвращает число удаленных элементов, связей с продуктами и проводок.
+        """
+        closure_table = NetworkElementClosure._meta.db_table
+        # Внешние ключи в PostgreSQL проверяются при коммите, поэтому порядок пачек (родитель раньше потомков
+        # или наоборот) не важен. Связи удаляются раньше элементов: журнал изменений получает удаление последним
+        tables = (
+            ('product_links', NetworkElement.products.through._meta.db_table, 'networkelement_id'),
+            ('debt_transactions', DebtTransaction._meta.db_table, 'element_id'),
+            (None, closure_table, 'descendant_id'),
+            ('deleted', NetworkElement._meta.db_table, 'id'),
+        )
+        counts = {'deleted': 0, 'product_links': 0, 'debt_transactions': 0}
+        with transaction.atomic():
+            root_ids = list(self.subtree_roots().values_list('pk', flat=True))
+            NetworkElement.objects.filter(pk__in=root_ids).shift_ancestor_totals(-1)
+            with connection.cursor() as cursor:
+                for root_id in root_ids:
+                    last_id = 0
+                    while True:
+                        cursor.execute(
+                            f'SELECT descendant_id FROM {closure_table} WHERE ancestor_id = %s AND descendant_id > %s '
+                            f'ORDER BY descendant_id LIMIT %s',
+                            [root_id, last_id, chunk_size],
+                        )
+                        ids = [row[0] for row in cursor.fetchall()]
+                        if not ids:
+                            break
+                        for name, table, column in tables:
+                            cursor.execute(f'DELETE FROM {table} WHERE {column} = ANY(%s)', [ids])
+                            if name is not None:
+                                counts[name] += cursor.rowcount
+                        # Неполная пачка - последняя, лишний запрос не нужен
+                        if len(ids) < chunk_size:
+                            break
+                        last_id = ids[-1]
+        if counts['deleted']:
+            invalidate('network')
+            schedule_refresh()
+        return counts
 
 
 class NetworkElement(models.Model):
@@ -14,31 +158,127 @@ class NetworkElement(models.Model):
     created_at = models.DateTimeField(blank=True, null=True, auto_now_add=True, verbose_name='Дата создания')
     debt_to_parent = models.DecimalField(max_digits=11, decimal_places=2, blank=True, null=True, default=0)
     network_lvl = models.IntegerField(blank=True, null=True, default=0)
+    subtree_debt = models.DecimalField(max_digits=15, decimal_places=2, default=0, editable=False,
+                                       verbose_name='Долг поддерева')
+    descendants_count = models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество потомков')
+    version = models.PositiveIntegerField(default=1, editable=False, verbose_name='Версия')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата изменения')
+
+    objects = NetworkElementQuerySet.as_manager()
 
     def clean(self):
         super().clean()
 
-        if self.parent:
-            if self.parent == self:
-                raise ValidationError('Элемент не может быть родителем самому себе')
+        if self.parent_id is None:
+            self.network_lvl = 0
+            return
 
-            parent = self.parent
-            while parent is not None:
-                if parent == self:
-                    raise ValidationError('Обнаружена циклическая ссылка в иерархии')
-                parent = parent.parent
+        if self.parent_id == self.pk:
+            raise ValidationError('Элемент не может быть родителем самому себе')
 
-        if self.parent:
-            self.network_lvl = self.parent.network_lvl + 1
-        else:
-            self.network_lvl = 0
+        # Уровень родителя и проверка цикла одним запросом: новый родитель не должен быть потомком элемента
+        parent = NetworkElement.objects.filter(pk=self.parent_id).annotate(
+            is_descendant=models.Exists(
+                NetworkElementClosure.objects.filter(ancestor_id=self.pk, descendant_id=models.OuterRef('pk'))
+            )
+        ).values('network_lvl', 'is_descendant').first()
+        if parent is None:
+            return
+        if parent['is_descendant']:
+            raise ValidationError('Обнаружена циклическая ссылка в иерархии')
+
+        self.network_lvl = parent['network_lvl'] + 1
+
+    # Поля, которые поддерживаются запросами к БД (журнал проводок и итоги поддерева) и не записываются из save()
+    MAINTAINED_FIELDS = ('debt_to_parent', 'subtree_debt', 'descendants_count')
 
     def save(self, *args, **kwargs):
-        self.full_clean()
-        if self.pk:
-            original = NetworkElement.objects.get(pk=self.pk)
-            self.debt_to_parent = original.debt_to_parent
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and not self._state.adding and not {'parent', 'parent_id'} & set(update_fields):
+            self._save_fields(*args, **kwargs)
+            return
+        if update_fields is not None:
+            # При переносе вместе с родителем меняются уровень и версия
+            kwargs['update_fields'] = {*update_fields, 'network_lvl', 'version', 'updated_at'} - set(
+                self.MAINTAINED_FIELDS)
+
+        with transaction.atomic():
+            self.full_clean()
+            adding = self._state.adding
+            if adding:
+                self.subtree_debt = 0
+                self.descendants_count = 0
+            else:
+                # Строка блокируется до конца транзакции: учет проводок и сдвиг итогов, начатые после чтения,
+                # дождутся записи и не будут ею затерты
+                original = NetworkElement.objects.select_for_update().get(pk=self.pk)
+                if update_fields is None:
+                    kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                                               if not field.primary_key and field.name not in self.MAINTAINED_FIELDS]
+                self.debt_to_parent = original.debt_to_parent
+                # Итоги поддерева поддерживаются запросами к БД, значения в памяти могут быть устаревшими
+                self.subtree_debt = original.subtree_debt
+                self.descendants_count = original.descendants_count
+                self.version = original.version + 1
+            reparented = not adding and original.parent_id != self.parent_id
+            if reparented:
+                NetworkElement.objects.filter(pk=self.pk).shift_ancestor_totals(-1)
+            super().save(*args, **kwargs)
+            element = NetworkElement.objects.filter(pk=self.pk)
+            if adding:
+                NetworkElementClosure.objects.link(self)
+                element.shift_ancestor_totals(1)
+            elif reparented:
+                NetworkElementClosure.objects.relink(self)
+                element.shift_ancestor_totals(1)
+                level_shift = self.network_lvl - original.network_lvl
+                if level_shift:
+                    # Уровни всего перенесенного поддерева сдвигаются одним UPDATE
+                    NetworkElement.objects.filter(pk__in=NetworkElementClosure.objects.filter(
+                        ancestor=self, depth__gt=0,
+                    ).values('descendant')).update(network_lvl=models.F('network_lvl') + level_shift)
+
+    def _save_fields(self, *args, update_fields, **kwargs):
+        """
+        Короткий путь save(update_fields=...) без смены родителя: проверяются только переданные поля,
+        строка не перечитывается и иерархия не проверяется, а записывается один UPDATE этих полей и версии.
+        """
+        fields = [name for name in update_fields if name not in self.MAINTAINED_FIELDS]
+        if not fields:
+            return
+        self.clean_fields(exclude=[field.name for field in self._meta.fields if field.name not in fields])
+        # Версия увеличивается в БД: параллельные записи устаревшего объекта дают разные версии
+        self.version = models.F('version') + 1
+        kwargs['update_fields'] = [*fields, 'version', 'updated_at']
         super().save(*args, **kwargs)
+        # Поле становится отложенным и перечитывается из БД только при обращении
+        del self.version
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            NetworkElement.objects.filter(pk=self.pk).shift_ancestor_totals(-1)
+            return super().delete(*args, **kwargs)
+
+    def move_to(self, parent):
+        """Переносит элемент вместе с поддеревом под нового родителя (None - сделать корнем)"""
+        self.parent = parent
+        self.save()
+
+    def get_descendants(self, include_self=False):
+        """Все потомки элемента одним запросом по таблице замыканий"""
+        min_depth = 0 if include_self else 1
+        return NetworkElement.objects.filter(
+            ancestor_links__ancestor=self,
+            ancestor_links__depth__gte=min_depth,
+        ).order_by('ancestor_links__depth', 'pk')
+
+    def get_ancestors(self, include_self=False):
+        """Цепочка предков от корня к элементу одним запросом по таблице замыканий"""
+        min_depth = 0 if include_self else 1
+        return NetworkElement.objects.filter(
+            descendant_links__descendant=self,
+            descendant_links__depth__gte=min_depth,
+        ).order_by('-descendant_links__depth')
 
     def __str__(self):
         return f"{self.name} (Уровень: {self.network_lvl})"
@@ -46,12 +286,200 @@ class NetworkElement(models.Model):
     class Meta:
         verbose_name = 'Звено сети'
         verbose_name_plural = 'Звенья сети'
+        # Индекс по parent_id создается для ForeignKey автоматически
+        indexes = [
+            models.Index(fields=['country'], name='network_country_idx'),
+            models.Index(fields=['city'], name='network_city_idx'),
+            models.Index(fields=['network_lvl'], name='network_lvl_idx'),
+            models.Index(fields=['debt_to_parent'], name='network_debt_idx'),
+            models.Index(fields=['created_at'], name='network_created_at_idx'),
+            # icontains строится как UPPER(поле) LIKE UPPER(...), поэтому триграммы индексируются по UPPER
+            GinIndex(OpClass(Upper('name'), name='gin_trgm_ops'), name='network_name_trgm_idx'),
+            GinIndex(OpClass(Upper('city'), name='gin_trgm_ops'), name='network_city_trgm_idx'),
+        ]
+
+
+class NetworkElementClosureQuerySet(models.QuerySet):
+
+    def shift_totals(self, debt, count):
+        """
+        Сдвигает итоги поддерева у предков из выборки связей на суммы выражений debt и count,
+        вычисленных по потомкам (descendant__...) этих связей. Один UPDATE на любое число предков.
+        """
+        totals = self.filter(ancestor=models.OuterRef('pk')).order_by().values('ancestor').annotate(
+            debt=models.Sum(debt, output_field=models.DecimalField()),
+            count=models.Sum(count, output_field=models.IntegerField()),
+        )
+        NetworkElement.objects.filter(pk__in=self.values('ancestor')).update_maintained(
+            subtree_debt=models.F('subtree_debt') + Coalesce(
+                models.Subquery(totals.values('debt')), models.Value(0), output_field=models.DecimalField()
+            ),
+            descendants_count=models.F('descendants_count') + Coalesce(
+                models.Subquery(totals.values('count')), models.Value(0), output_field=models.IntegerField()
+            ),
+        )
+
+
+class NetworkElementClosureManager(models.Manager.from_queryset(NetworkElementClosureQuerySet)):
+
+    def link(self, element):
+        """Добавляет связи нового элемента: с самим собой и со всеми предками родителя"""
+        self.link_many([element.pk])
+
+    def link_many(self, element_ids):
+        """Добавляет связи для пачки новых элементов, родители которых уже связаны"""
+        table = self.model._meta.db_table
+        element_table = NetworkElement._meta.db_table
+        placeholders = ', '.join(['%s'] * len(element_ids))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} (ancestor_id, descendant_id, depth) '
+                f'SELECT c.ancestor_id, e.id, c.depth + 1 FROM {table} c '
+                f'JOIN {element_table} e ON c.descendant_id = e.parent_id WHERE e.id IN ({placeholders}) '
+                f'UNION ALL SELECT id, id, 0 FROM {element_table} WHERE id IN ({placeholders})',
+                [*element_ids, *element_ids],
+            )
+
+    def relink(self, element):
+        """Переносит поддерево элемента под нового родителя двумя запросами"""
+        table = self.model._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {table} '
+                f'WHERE descendant_id IN (SELECT descendant_id FROM {table} WHERE ancestor_id = %s) '
+                f'AND ancestor_id NOT IN (SELECT descendant_id FROM {table} WHERE ancestor_id = %s)',
+                [element.pk, element.pk],
+            )
+            if element.parent_id is not None:
+                cursor.execute(
+                    f'INSERT INTO {table} (ancestor_id, descendant_id, depth) '
+                    f'SELECT a.ancestor_id, s.descendant_id, a.depth + s.depth + 1 '
+                    f'FROM {table} a CROSS JOIN {table} s '
+                    f'WHERE a.descendant_id = %s AND s.ancestor_id = %s',
+                    [element.parent_id, element.pk],
+                )
+
+    def relink_many(self, element_ids):
+        """
+        Перестраивает связи поддеревьев перенесенных элементов, родители которых уже изменены в таблице
+        элементов, вместе с итогами старых и новых предков и уровнями. Перенесенные элементы могут быть
+        вложены друг в друга; число запросов не зависит от их количества и размера поддеревьев.
+        """
+        table = self.model._meta.db_table
+        element_table = NetworkElement._meta.db_table
+        now = timezone.now()
+
+        def shift_totals(cursor, sign, subtree):
+            # Итоги меняются на разность связей: вычитаются по старым связям поддерева, прибавляются по новым
+            cursor.execute(
+                f'UPDATE {element_table} e SET subtree_debt = e.subtree_debt {sign} s.debt, '
+                f'descendants_count = e.descendants_count {sign} s.count, version = e.version + 1, updated_at = %s '
+                f'FROM (SELECT c.ancestor_id, SUM(COALESCE(d.debt_to_parent, 0)) AS debt, COUNT(*) AS count '
+                f'FROM {table} c JOIN {element_table} d ON d.id = c.descendant_id '
+                f'WHERE c.descendant_id = ANY(%s) AND c.depth > 0 GROUP BY c.ancestor_id) s '
+                f'WHERE e.id = s.ancestor_id',
+                [now, subtree],
+            )
+
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT DISTINCT descendant_id FROM {table} WHERE ancestor_id = ANY(%s)',
+                           [list(element_ids)])
+            subtree = [row[0] for row in cursor.fetchall()]
+            shift_totals(cursor, '-', subtree)
+            cursor.execute(f'DELETE FROM {table} WHERE descendant_id = ANY(%s)', [subtree])
+            cursor.execute(
+                f'WITH RECURSIVE chain (ancestor_id, descendant_id, depth) AS ('
+                f'SELECT id, id, 0 FROM {element_table} WHERE id = ANY(%s) '
+                f'UNION ALL SELECT e.parent_id, chain.descendant_id, chain.depth + 1 FROM chain '
+                f'JOIN {element_table} e ON e.id = chain.ancestor_id WHERE e.parent_id IS NOT NULL) '
+                f'INSERT INTO {table} (ancestor_id, descendant_id, depth) '
+                f'SELECT ancestor_id, descendant_id, depth FROM chain',
+                [subtree],
+            )
+            shift_totals(cursor, '+', subtree)
+            cursor.execute(
+                f'UPDATE {element_table} e SET network_lvl = s.depth, version = e.version + 1, updated_at = %s '
+                f'FROM (SELECT descendant_id, MAX(depth) AS depth FROM {table} WHERE descendant_id = ANY(%s) '
+                f'GROUP BY descendant_id) s WHERE e.id = s.descendant_id AND e.network_lvl IS DISTINCT FROM s.depth',
+                [now, subtree],
+            )
+
+    def ancestor_chains(self, element_ids):
+        """Предки каждого элемента от него самого к корню: {element_id: [element_id, parent_id, ...]}"""
+        chains = {}
+        links = self.filter(descendant__in=element_ids).order_by('descendant', 'depth')
+        for descendant_id, ancestor_id in links.values_list('descendant', 'ancestor'):
+            chains.setdefault(descendant_id, []).append(ancestor_id)
+        return chains
+
+    def shift_debt(self, deltas):
+        """Сдвигает долг поддерева у предков на изменения долга элементов: {element_id: сумма}"""
+        if not deltas:
+            return
+        table = self.model._meta.db_table
+        element_table = NetworkElement._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'UPDATE {element_table} SET subtree_debt = subtree_debt + s.amount, '
+                f'version = version + 1, updated_at = %s FROM ('
+                f'SELECT c.ancestor_id, SUM(d.amount) AS amount FROM {table} c '
+                f'JOIN UNNEST(%s::bigint[], %s::numeric[]) AS d (element_id, amount) ON c.descendant_id = d.element_id '
+                f'WHERE c.depth > 0 GROUP BY c.ancestor_id) s '
+                f'WHERE {element_table}.id = s.ancestor_id',
+                [timezone.now(), list(deltas), list(deltas.values())],
+            )
+
+
+class NetworkElementClosure(models.Model):
+    """Таблица замыканий иерархии: по строке на каждую пару (предок, потомок)"""
+    ancestor = models.ForeignKey(NetworkElement, on_delete=models.CASCADE, related_name='descendant_links',
+                                 db_index=False, verbose_name='Предок')
+    descendant = models.ForeignKey(NetworkElement, on_delete=models.CASCADE, related_name='ancestor_links',
+                                   db_index=False, verbose_name='Потомок')
+    depth = models.PositiveIntegerField(verbose_name='Глубина')
+
+    objects = NetworkElementClosureManager()
+
+    class Meta:
+        verbose_name = 'Связь иерархии'
+        verbose_name_plural = 'Связи иерархии'
+        constraints = [
+            models.UniqueConstraint(fields=['ancestor', 'descendant'], name='closure_unique_ancestor_descendant'),
+        ]
+        indexes = [
+            models.Index(fields=['descendant', 'depth'], name='closure_descendant_depth_idx'),
+            models.Index(fields=['ancestor', 'depth'], name='closure_ancestor_depth_idx'),
+        ]
+
+
+class ProductQuerySet(models.QuerySet):
+
+    def update(self, **kwargs):
+        kwargs.setdefault('version', models.F('version') + 1)
+        kwargs.setdefault('updated_at', timezone.now())
+        rows = super().update(**kwargs)
+        invalidate('product')
+        return rows
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = super().bulk_create(objs, *args, **kwargs)
+        invalidate('product')
+        return objs
 
 
 class Product(models.Model):
     name = models.CharField(max_length=100, unique=True, verbose_name='Название продукта')
     model = models.CharField(blank=True, null=True, verbose_name='Модель продукта')
     release_date = models.DateField(blank=True, null=True, verbose_name='Дата выхода')
+    version = models.PositiveIntegerField(default=1, editable=False, verbose_name='Версия')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата изменения')
+
+    objects = ProductQuerySet.as_manager()
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            self.version += 1
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return self.name
@@ -59,3 +487,161 @@ class Product(models.Model):
     class Meta:
         verbose_name = 'Продукт'
         verbose_name_plural = 'Продукты'
+
+
+class DebtTransactionManager(models.Manager):
+
+    def post(self, entries):
+        """Добавляет проводки пачкой: [(element_id, amount, comment), ...]. Строки элементов не блокируются"""
+        return self.bulk_create(
+            self.model(element_id=element_id, amount=amount, comment=comment) for element_id, amount, comment in entries
+        )
+
+    def compact(self, element_ids=None):
+        """
+        Переносит неучтенные проводки в debt_to_parent (и в итоги предков) и возвращает число затронутых элементов.
+
+        Проводки помечаются учтенными тем же UPDATE, который их выбирает, поэтому параллельные проводки и
+        параллельное сжатие не теряются и не учитываются дважды: не видимые на момент запроса проводки
+        остаются для следующего прохода.
+        """
+        table = self.model._meta.db_table
+        element_table = NetworkElement._meta.db_table
+        condition, params = '', []
+        if element_ids is not None:
+            condition, params = 'AND element_id = ANY(%s)', [list(element_ids)]
+        params.append(timezone.now())
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                f'WITH claimed AS (UPDATE {table} SET compacted = true WHERE NOT compacted {condition} '
+                f'RETURNING element_id, amount), '
+                f'deltas AS (SELECT element_id, SUM(amount) AS amount FROM claimed GROUP BY element_id) '
+                f'UPDATE {element_table} e SET debt_to_parent = COALESCE(e.debt_to_parent, 0) + d.amount, '
+                f'version = e.version + 1, updated_at = %s FROM deltas d WHERE e.id = d.element_id RETURNING e.id, d.amount',
+                params,
+            )
+            deltas = dict(cursor.fetchall())
+            NetworkElementClosure.objects.shift_debt(deltas)
+        if deltas:
+            invalidate('network')
+            schedule_refresh()
+        return len(deltas)
+
+    def pending(self):
+        """Суммы неучтенных проводок по элементам"""
+        return self.filter(compacted=False).values('element').annotate(amount=models.Sum('amount'))
+
+
+class DebtTransaction(models.Model):
+    """
+    Проводка по долгу перед поставщиком (счет - положительная сумма, оплата - отрицательная).
+    Журнал только дополняется, текущий долг элемента - debt_to_parent плюс неучтенные проводки.
+    """
+    element = models.ForeignKey(NetworkElement, on_delete=models.CASCADE, related_name='debt_transactions',
+                                verbose_name='Звено сети')
+    amount = models.DecimalField(max_digits=11, decimal_places=2, verbose_name='Сумма')
+    comment = models.CharField(blank=True, default='', verbose_name='Комментарий')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата проводки')
+    compacted = models.BooleanField(default=False, editable=False, verbose_name='Учтена в долге')
+
+    objects = DebtTransactionManager()
+
+    class Meta:
+        verbose_name = 'Проводка по долгу'
+        verbose_name_plural = 'Проводки по долгу'
+        indexes = [
+            models.Index(fields=['element'], condition=models.Q(compacted=False), name='debt_transaction_pending_idx'),
+        ]
+
+
+# Номер самой старой транзакции, которая еще может зафиксироваться: все более ранние уже завершены
+SNAPSHOT_XMIN = 'pg_snapshot_xmin(pg_current_snapshot())::text::bigint'
+
+
+class ChangeQuerySet(models.QuerySet):
+
+    def committed(self):
+        """
+        Записи транзакций, завершившихся до самой старой активной. Номер транзакции записи выдается при ее начале,
+        поэтому более поздние записи (в том числе еще невидимые) всегда будут иметь номер не меньше этого порога,
+        и курсор по (txid, id) их не пропустит.
+        """
+        return self.filter(txid__lt=models.expressions.RawSQL(SNAPSHOT_XMIN, []))
+
+    def compact(self, retention):
+        """
+        Удаляет записи, замененные более поздней записью того же объекта (клиент все равно получит последнюю),
+        и записи старше retention. Позиция последней удаленной по сроку записи сохраняется в ChangeWatermark:
+        курсор до нее мог бы пропустить удаления. Возвращает число удаленных записей.
+        """
+        table = self.model._meta.db_table
+        watermark_table = ChangeWatermark._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'WITH deleted AS (DELETE FROM {table} c USING (SELECT id, row_number() OVER (PARTITION BY model, '
+                f'object_id ORDER BY txid DESC, id DESC) AS position FROM {table} WHERE txid < {SNAPSHOT_XMIN}) s '
+                f'WHERE c.id = s.id AND (s.position > 1 OR c.created_at < %s) '
+                f'RETURNING c.txid, c.id, c.created_at < %s AS expired), '
+                f'saved AS (INSERT INTO {watermark_table} (id, txid, change_id) '
+                f'SELECT 1, txid, id FROM deleted WHERE expired ORDER BY txid DESC, id DESC LIMIT 1 '
+                f'ON CONFLICT (id) DO UPDATE SET txid = EXCLUDED.txid, change_id = EXCLUDED.change_id '
+                f'WHERE ({watermark_table}.txid, {watermark_table}.change_id) < (EXCLUDED.txid, EXCLUDED.change_id)) '
+                f'SELECT COUNT(*) FROM deleted',
+                [timezone.now() - retention] * 2,
+            )
+            return cursor.fetchone()[0]
+
+    def watermark(self):
+        """Позиция (txid, id) последней записи, удаленной по сроку хранения, или (0, 0)"""
+        return ChangeWatermark.objects.values_list('txid', 'change_id').first() or (0, 0)
+
+
+class Change(models.Model):
+    """
+    Журнал изменений элементов сети и продуктов для инкрементальной синхронизации (/changes/). Записи добавляют
+    триггеры БД (миграция 0012_change) на любые изменения таблиц, включая массовые update() и SQL-запросы.
+    """
+    UPSERT = 'upsert'
+    DELETE = 'delete'
+    ACTIONS = ((UPSERT, 'Изменение'), (DELETE, 'Удаление'))
+
+    txid = models.BigIntegerField(verbose_name='Транзакция')
+    model = models.CharField(max_length=20, verbose_name='Модель')
+    object_id = models.BigIntegerField(verbose_name='Объект')
+    action = models.CharField(max_length=10, choices=ACTIONS, verbose_name='Действие')
+    created_at = models.DateTimeField(db_default=Now(), verbose_name='Дата изменения')
+
+    objects = ChangeQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Изменение'
+        verbose_name_plural = 'Журнал изменений'
+        indexes = [
+            models.Index(fields=['txid', 'id'], name='change_position_idx'),
+        ]
+
+
+class ChangeWatermark(models.Model):
+    """
+    Граница сжатия журнала изменений (одна строка): позиция последней записи, удаленной по сроку хранения.
+    Курсор /changes/ до этой позиции мог пропустить удаленные записи и требует полной синхронизации.
+    """
+    txid = models.BigIntegerField(verbose_name='Транзакция')
+    change_id = models.BigIntegerField(verbose_name='Запись журнала')
+
+    class Meta:
+        verbose_name = 'Граница журнала изменений'
+        verbose_name_plural = 'Границы журнала изменений'
+
+
+class NetworkStatsState(models.Model):
+    """
+    Состояние материализованного представления статистики (одна строка): отметку об устаревании ставят
+    массовые записи, снимает пересчет командой refresh_network_stats (см. stats.py)
+    """
+    stale = models.BooleanField(default=True, verbose_name='Требует пересчета')
+    refreshed_at = models.DateTimeField(blank=True, null=True, verbose_name='Дата пересчета')
+
+    class Meta:
+        verbose_name = 'Состояние статистики сети'
+        verbose_name_plural = 'Состояние статистики сети'
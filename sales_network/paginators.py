@@ -0,0 +1,49 @@
+from rest_framework.pagination import Cursor, CursorPagination
+
+
+class NetworkCursorPagination(CursorPagination):
+    """Курсорная пагинация по первичному ключу: страницы не сдвигаются при параллельных вставках"""
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    ordering = 'id'
+
+    async def apaginate_queryset(self, queryset, request):
+        """
+        Асинхронная выборка страницы. Порядок по уникальному id позволяет обойтись без смещений в курсоре,
+        поэтому курсоры совместимы с синхронным paginate_queryset.
+        """
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        cursor = self.decode_cursor(request)
+        reverse = cursor is not None and cursor.reverse
+        position = cursor.position if cursor is not None else None
+
+        if position is not None:
+            queryset = queryset.filter(pk__lt=position) if reverse else queryset.filter(pk__gt=position)
+        queryset = queryset.order_by('-pk' if reverse else 'pk')[:self.page_size + 1]
+        page = [item async for item in queryset.aiterator(chunk_size=self.page_size + 1)]
+
+        has_more = len(page) > self.page_size
+        page = page[:self.page_size]
+        if reverse:
+            page.reverse()
+        has_next = has_more if not reverse else position is not None
+        has_previous = has_more if reverse else position is not None
+        self.next_position = page[-1].pk if page and has_next else None
+        self.previous_position = page[0].pk if page and has_previous else None
+        return page
+
+    def get_page_data(self, data):
+        """Тело ответа страницы, выбранной apaginate_queryset, в формате get_paginated_response"""
+        def link(position, reverse):
+            if position is None:
+                return None
+            return self.encode_cursor(Cursor(offset=0, reverse=reverse, position=str(position)))
+
+        return {
+            'next': link(self.next_position, False),
+            'previous': link(self.previous_position, True),
+            'results': data,
+        }
@@ -0,0 +1,56 @@
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+from .metrics import timed
+
+# Необязательные зависимости: без orjson JSON кодирует стандартный json, без msgpack двоичный формат недоступен
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Типы, которых нет в JSON (Decimal, даты, UUID, ленивые строки), приводятся так же, как в JSONRenderer
+encode_default = JSONEncoder().default
+
+
+class InstrumentedJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer, время которого учитывается в метриках запроса. Компактный JSON кодирует orjson (если установлен)
+    с тем же результатом байт в байт; JSON с отступами (Accept: application/json; indent=4) - как раньше.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with timed('render_time'):
+            if orjson is None or data is None or self.ensure_ascii or not self.compact \
+                    or self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+                return super().render(data, accepted_media_type, renderer_context)
+            content = orjson.dumps(
+                data, default=encode_default,
+                # Даты форматируются кодировщиком DRF (миллисекунды, Z), ключи-числа - строками, как в json
+                option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS,
+            )
+            # JSONRenderer экранирует разделители строк, чтобы ответ оставался подмножеством JavaScript
+            return content.replace('\u2028'.encode(), b'\\u2028').replace('\u2029'.encode(), b'\\u2029')
+
+
+class MessagePackRenderer(BaseRenderer):
+    """Компактный двоичный формат MessagePack (Accept: application/msgpack или ?format=msgpack)"""
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        with timed('render_time'):
+            return msgpack.packb(data, default=encode_default, use_bin_type=True)
+
+
+# Дополнительные форматы ответов ViewSet элементов и продуктов
+BINARY_RENDERER_CLASSES = [MessagePackRenderer] if msgpack is not None else []
@@ -0,0 +1,93 @@
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework.permissions import SAFE_METHODS
+
+KEY_PREFIX = 'sales_network:replicas'
+WRITTEN_KEY = f'{KEY_PREFIX}:written'
+
+# БД для чтения в текущем запросе; None - решение остается за Django (основная БД или БД объекта)
+_read_database = ContextVar('read_database', default=None)
+
+
+def _pinned_key(user_id):
+    return f'{KEY_PREFIX}:pinned:{user_id}'
+
+
+def pin(user_id):
+    """После записи пользователь читает с основной БД, пока реплики могут не содержать его изменений"""
+    if settings.REPLICA_DATABASES and settings.REPLICA_STICKY_SECONDS:
+        cache.set(_pinned_key(user_id), True, settings.REPLICA_STICKY_SECONDS)
+
+
+def is_pinned(user_id):
+    return cache.get(_pinned_key(user_id), False)
+
+
+def mark_written():
+    """Данные изменены: реплики могут отставать еще REPLICA_STICKY_SECONDS секунд"""
+    if settings.REPLICA_DATABASES and settings.REPLICA_STICKY_SECONDS:
+        cache.set(WRITTEN_KEY, True, settings.REPLICA_STICKY_SECONDS)
+
+
+def may_be_stale():
+    """
+    Чтение идет с реплики вскоре после записи: в данных изменений может еще не быть, хотя поколение кэша
+    уже новое. Такие ответы не кэшируются, иначе устаревшие данные отдавались бы до следующей записи.
+    """
+    return _read_database.get() is not None and cache.get(WRITTEN_KEY, False)
+
+
+def choose_replica(request):
+    """Реплика для чтения в запросе или None, если запрос пишет, реплик нет или пользователь закреплен"""
+    if not settings.REPLICA_DATABASES or request.method not in SAFE_METHODS:
+        return None
+    user = request.user
+    if user is not None and user.is_authenticated and is_pinned(user.pk):
+        return None
+    return random.choice(settings.REPLICA_DATABASES)
+
+
+class ReplicaRouter:
+    """
+    Чтение с реплики, выбранной для запроса ReplicaReadMixin; запись и все остальные чтения идут
+    в основную БД. Миграции применяются только к основной БД, реплики получают схему репликацией.
+    """
+
+    def db_for_read(self, model, **hints):
+        return _read_database.get()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплики содержат те же данные, что и основная БД
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in settings.REPLICA_DATABASES
+
+
+class ReplicaReadMixin:
+    """
+    Чтения ViewSet (GET, HEAD, OPTIONS) выполняются на случайной реплике из REPLICA_DATABASES.
+    Пользователь, недавно писавший в БД, читает с основной БД (см. pin()).
+    """
+    read_database = None
+    _read_token = None
+
+    def initial(self, request, *args, **kwargs):
+        # Выбор после аутентификации: закрепление проверяется по пользователю
+        super().initial(request, *args, **kwargs)
+        self.read_database = choose_replica(request)
+        if self.read_database is not None:
+            self._read_token = _read_database.set(self.read_database)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        if self._read_token is not None:
+            _read_database.reset(self._read_token)
+            self._read_token = None
+        return super().finalize_response(request, response, *args, **kwargs)
@@ -1,16 +1,315 @@
+from django.core.exceptions import ValidationError as DjangoValidationError
 from rest_framework import serializers
 
-from .models import Product, NetworkElement
+from .metrics import timed
+from .models import Product, NetworkElement, NetworkElementClosure, DebtTransaction
 
 
-class ProductSerializer(serializers.ModelSerializer):
+class InstrumentedSerializerMixin:
+    """Время serializer.data, включая ленивые запросы к БД при сериализации, попадает в метрики запроса"""
+
+    @property
+    def data(self):
+        with timed('serialization_time'):
+            return super().data
+
+
+class InstrumentedListSerializer(InstrumentedSerializerMixin, serializers.ListSerializer):
+    pass
+
+
+class SparseFieldsMixin:
+    """Только поля из context['fields'], если набор задан (см. SparseFieldsetMixin)"""
+
+    def get_fields(self):
+        fields = super().get_fields()
+        requested = self.context.get('fields')
+        if requested is not None:
+            fields = {name: field for name, field in fields.items() if name in requested}
+        return fields
+
+
+class ValuesListSerializer:
+    """
+    Сериализация списков только для чтения без создания моделей: строки берутся из queryset.values(),
+    значения простых полей (строки, числа, ссылки по pk) копируются как есть, остальные форматируются полями
+    serializer_class. Поэтому результат совпадает с serializer_class(many=True), а связи многие-ко-многим
+    читаются одним запросом к таблице связей на страницу, как при prefetch_related.
+    """
+    PLAIN_FIELDS = (serializers.CharField, serializers.IntegerField, serializers.BooleanField,
+                    serializers.PrimaryKeyRelatedField)
+
+    def __init__(self, serializer_class, context=None):
+        serializer = serializer_class(context=context or {})
+        self.model = serializer.Meta.model
+        self.fields = [field for field in serializer.fields.values() if not field.write_only]
+
+    @property
+    def supported(self):
+        """Все поля читаются из колонок или связей модели; вычисляемые поля требуют обычного сериализатора"""
+        names = {field.name for field in self.model._meta.get_fields()}
+        for field in self.fields:
+            if field.source not in names:
+                return False
+            if isinstance(field, serializers.RelatedField) and not isinstance(field, serializers.PrimaryKeyRelatedField):
+                return False
+            if isinstance(field, serializers.ManyRelatedField) and not isinstance(
+                    field.child_relation, serializers.PrimaryKeyRelatedField):
+                return False
+        return True
+
+    def values(self, queryset):
+        """Строки выборки: первичный ключ (для курсора пагинации) и колонки полей"""
+        columns = [field.source for field in self.fields if not isinstance(field, serializers.ManyRelatedField)]
+        return queryset.prefetch_related(None).values(*dict.fromkeys([self.model._meta.pk.name, *columns]))
+
+    def related_ids(self, field, pks):
+        relation = self.model._meta.get_field(field.source)
+        source, target = relation.m2m_field_name(), relation.m2m_reverse_field_name()
+        # Тот же порядок, что у NetworkElementQuerySet.with_products(): по id связанного объекта
+        links = relation.remote_field.through.objects.filter(**{f'{source}__in': pks}).order_by(target)
+        related = {pk: [] for pk in pks}
+        for pk, related_pk in links.values_list(f'{source}_id', f'{target}_id'):
+            related[pk].append(related_pk)
+        return related
+
+    def to_representation(self, rows):
+        with timed('serialization_time'):
+            return self._to_representation(list(rows))
+
+    def _to_representation(self, rows):
+        pk_name = self.model._meta.pk.name
+        pks = [row[pk_name] for row in rows]
+        many = {field.field_name: self.related_ids(field, pks)
+                for field in self.fields if isinstance(field, serializers.ManyRelatedField)}
+
+        data = []
+        for row in rows:
+            item = {}
+            for field in self.fields:
+                if field.field_name in many:
+                    item[field.field_name] = many[field.field_name][row[pk_name]]
+                    continue
+                value = row[field.source]
+                if value is None or isinstance(field, self.PLAIN_FIELDS):
+                    item[field.field_name] = value
+                else:
+                    item[field.field_name] = field.to_representation(value)
+            data.append(item)
+        return data
+
+
+class ProductSerializer(InstrumentedSerializerMixin, SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Product
-        fields = '__all__'
+        # Версия строки отдается в заголовке ETag
+        exclude = ('version', 'updated_at')
+        list_serializer_class = InstrumentedListSerializer
 
 
-class NetworkElementSerializer(serializers.ModelSerializer):
+class NetworkElementSerializer(InstrumentedSerializerMixin, SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = NetworkElement
-        fields = '__all__'
-        # read_only_fields = ('debt_to_parent',)
+        exclude = ('version', 'updated_at')
+        list_serializer_class = InstrumentedListSerializer
+
+    def get_fields(self):
+        fields = super().get_fields()
+        if self.instance is not None and 'debt_to_parent' in fields:
+            # Начальный долг задается при создании, дальше он меняется только через журнал проводок
+            fields['debt_to_parent'].read_only = True
+        return fields
+
+    def update(self, instance, validated_data):
+        """Сохраняет только изменившиеся поля: без смены родителя это один UPDATE без чтения строки"""
+        products = validated_data.pop('products', None)
+        changed = []
+        for name, value in validated_data.items():
+            field = NetworkElement._meta.get_field(name)
+            new = value.pk if field.is_relation and value is not None else value
+            if getattr(instance, field.attname) != new:
+                setattr(instance, name, value)
+                changed.append(name)
+        if changed:
+            try:
+                instance.save(update_fields=changed)
+            except DjangoValidationError as error:
+                # Проверки иерархии в clean() (циклы) возвращаются как ошибки запроса, а не 500
+                raise serializers.ValidationError(serializers.as_serializer_error(error))
+        if products is not None:
+            instance.products.set(products)
+        return instance
+
+
+BULK_MAX_SIZE = 1000
+BULK_FIELDS = ('name', 'email', 'country', 'city', 'street', 'building', 'parent', 'products')
+
+
+class NetworkElementBulkUpdateListSerializer(InstrumentedListSerializer):
+    """
+    Пакетное изменение элементов. Пачка проверяется целиком (существование элементов, родителей и продуктов,
+    циклы с учетом всех переносов пачки) и применяется постоянным числом запросов. instance - выборка,
+    из которой берутся изменяемые элементы (обычно с select_for_update); проверка и запись должны идти
+    в одной транзакции вызывающего кода.
+    """
+
+    def to_internal_value(self, data):
+        # Ошибки пачки возвращаются так же, как ошибки полей: списком по строкам, а не в non_field_errors
+        attrs = super().to_internal_value(data)
+        errors = [{} for _ in attrs]
+        ids = [item['id'] for item in attrs]
+        self.elements = self.instance.in_bulk(ids)
+        seen = set()
+        for index, pk in enumerate(ids):
+            if pk not in self.elements:
+                errors[index]['id'] = [f'Элемент с id={pk} не найден']
+            elif pk in seen:
+                errors[index]['id'] = ['Элемент указан в пачке несколько раз']
+            seen.add(pk)
+
+        # Переносы: новые родители проверяются по их текущим цепочкам предков, в которых перенесенные
+        # элементы пачки заменяются их новыми родителями
+        moves = {
+            item['id']: item['parent_id'] for item in attrs
+            if 'parent_id' in item and item['id'] in self.elements
+            and self.elements[item['id']].parent_id != item['parent_id']
+        }
+        chains = NetworkElementClosure.objects.ancestor_chains({parent for parent in moves.values() if parent})
+        for index, item in enumerate(attrs):
+            parent_id = moves.get(item['id'])
+            if parent_id is None:
+                continue
+            if parent_id == item['id']:
+                errors[index]['parent'] = ['Элемент не может быть родителем самому себе']
+            elif parent_id not in chains:
+                errors[index]['parent'] = [f'Родитель с id={parent_id} не найден']
+            elif self.in_cycle(item['id'], moves, chains):
+                errors[index]['parent'] = ['Обнаружена циклическая ссылка в иерархии']
+
+        product_ids = {product for item in attrs for product in item.get('products', ())}
+        existing = set(Product.objects.filter(pk__in=product_ids).values_list('pk', flat=True)) if product_ids else set()
+        for index, item in enumerate(attrs):
+            missing = set(item.get('products', ())) - existing
+            if missing:
+                errors[index]['products'] = [f'Продукты не найдены: {sorted(missing)}']
+
+        if any(errors):
+            raise serializers.ValidationError(errors)
+        self.moves = moves
+        return attrs
+
+    @staticmethod
+    def in_cycle(pk, moves, chains):
+        visited = {pk}
+        parent_id = moves[pk]
+        while parent_id is not None:
+            moved = next((ancestor for ancestor in chains.get(parent_id, ()) if ancestor in moves), None)
+            if moved is None:
+                return False
+            if moved in visited:
+                return True
+            visited.add(moved)
+            parent_id = moves[moved]
+        return False
+
+    def update(self, queryset, validated_data):
+        elements = []
+        fields = set()
+        for item in validated_data:
+            element = self.elements[item['id']]
+            for name, value in item.items():
+                if name not in ('id', 'products'):
+                    setattr(element, name, value)
+                    fields.add('parent' if name == 'parent_id' else name)
+            elements.append(element)
+
+        # Массовое обновление меняет версии всех строк пачки, в том числе при изменении только продуктов
+        if fields:
+            NetworkElement.objects.bulk_update(elements, sorted(fields))
+        else:
+            NetworkElement.objects.filter(pk__in=self.elements).touch()
+        if self.moves:
+            NetworkElementClosure.objects.relink_many(list(self.moves))
+
+        products = {item['id']: set(item['products']) for item in validated_data if 'products' in item}
+        if products:
+            through = NetworkElement.products.through
+            through.objects.filter(networkelement_id__in=products).delete()
+            through.objects.bulk_create([
+                through(networkelement_id=element_id, product_id=product_id)
+                for element_id, product_ids in products.items()
+                for product_id in product_ids
+            ])
+        return elements
+
+
+class NetworkElementBulkUpdateSerializer(serializers.ModelSerializer):
+    """Строка пакетного изменения: id элемента и изменяемые поля. Долг меняется только через журнал проводок"""
+    id = serializers.IntegerField()
+    # Ссылки проверяются для всей пачки одним запросом в NetworkElementBulkUpdateListSerializer
+    parent = serializers.IntegerField(source='parent_id', allow_null=True, required=False)
+    products = serializers.ListField(child=serializers.IntegerField(), required=False)
+
+    class Meta:
+        model = NetworkElement
+        fields = ('id', *BULK_FIELDS)
+        extra_kwargs = {name: {'required': False} for name in BULK_FIELDS}
+        list_serializer_class = NetworkElementBulkUpdateListSerializer
+
+
+class NetworkElementBulkDeleteSerializer(serializers.Serializer):
+    ids = serializers.ListField(child=serializers.IntegerField(), allow_empty=False, max_length=BULK_MAX_SIZE)
+
+    def validate_ids(self, ids):
+        existing = set(NetworkElement.objects.filter(pk__in=ids).values_list('pk', flat=True))
+        missing = set(ids) - existing
+        if missing:
+            raise serializers.ValidationError(f'Элементы не найдены: {sorted(missing)}')
+        return ids
+
+
+class DebtSummarySerializer(InstrumentedSerializerMixin, serializers.ModelSerializer):
+    class Meta:
+        model = NetworkElement
+        fields = ('id', 'debt_to_parent', 'subtree_debt', 'descendants_count')
+        read_only_fields = fields
+
+
+class NetworkLevelStatsSerializer(serializers.Serializer):
+    network_lvl = serializers.IntegerField()
+    elements = serializers.IntegerField()
+    debt_to_parent = serializers.DecimalField(max_digits=20, decimal_places=2)
+    elements_with_products = serializers.IntegerField()
+
+
+class NetworkCountryStatsSerializer(InstrumentedSerializerMixin, serializers.Serializer):
+    country = serializers.CharField()
+    elements = serializers.IntegerField()
+    debt_to_parent = serializers.DecimalField(max_digits=20, decimal_places=2)
+    elements_with_products = serializers.IntegerField()
+    levels = NetworkLevelStatsSerializer(many=True)
+
+
+class DebtTransactionListSerializer(InstrumentedListSerializer):
+
+    def validate(self, attrs):
+        # Существование элементов проверяется одним запросом на всю пачку
+        element_ids = {item['element_id'] for item in attrs}
+        existing = set(NetworkElement.objects.filter(pk__in=element_ids).values_list('pk', flat=True))
+        missing = element_ids - existing
+        if missing:
+            raise serializers.ValidationError({'element': f'Элементы не найдены: {sorted(missing)}'})
+        return attrs
+
+    def create(self, validated_data):
+        return DebtTransaction.objects.bulk_create(DebtTransaction(**item) for item in validated_data)
+
+
+class DebtTransactionSerializer(InstrumentedSerializerMixin, serializers.ModelSerializer):
+    element = serializers.IntegerField(source='element_id')
+
+    class Meta:
+        model = DebtTransaction
+        fields = ('id', 'element', 'amount', 'comment', 'created_at', 'compacted')
+        read_only_fields = ('created_at', 'compacted')
+        list_serializer_class = DebtTransactionListSerializer
@@ -0,0 +1,52 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .cache import invalidate
+from .models import NetworkElement, Product
+from .stats import schedule_refresh
+
+
+@receiver([post_save, post_delete], sender=NetworkElement)
+def invalidate_network(sender, **kwargs):
+    invalidate('network')
+    schedule_refresh()
+
+
+@receiver(m2m_changed, sender=NetworkElement.products.through)
+def invalidate_network_products(sender, action, **kwargs):
+    if action.startswith('post_'):
+        invalidate('network')
+        # Меняется число элементов с продуктами
+        schedule_refresh()
+
+
+@receiver(m2m_changed, sender=NetworkElement.products.through)
+def touch_network_products(sender, instance, action, reverse, pk_set, **kwargs):
+    # Список продуктов входит в ответ элемента, поэтому меняется версия элементов, а не продуктов.
+    # При очистке со стороны продукта элементы известны только до удаления связей
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        NetworkElement.objects.filter(pk=instance.pk).touch()
+    elif pk_set is None:
+        NetworkElement.objects.filter(products=instance).touch()
+    else:
+        NetworkElement.objects.filter(pk__in=pk_set).touch()
+
+
+@receiver(post_save, sender=Product)
+def invalidate_product(sender, **kwargs):
+    invalidate('product')
+
+
+@receiver(pre_delete, sender=Product)
+def touch_product_elements(sender, instance, **kwargs):
+    # Связи удаляются каскадом без m2m_changed
+    NetworkElement.objects.filter(products=instance).touch()
+
+
+@receiver(post_delete, sender=Product)
+def invalidate_deleted_product(sender, **kwargs):
+    # Вместе с продуктом удаляются его связи с элементами сети
+    invalidate('product', 'network')
+    schedule_refresh()
@@ -0,0 +1,109 @@
+from decimal import Decimal
+
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+# Материализованное представление со статистикой по странам и уровням (миграция 0011_network_stats)
+STATS_VIEW = 'sales_network_networkstats'
+STATS_FIELDS = ('elements', 'debt_to_parent', 'elements_with_products')
+# Отметка об устаревшей статистике (модель NetworkStatsState, одна строка)
+STATE_TABLE = 'sales_network_networkstatsstate'
+
+
+def has_stats_view(connection):
+    # На других СУБД (например, SQLite) статистика считается агрегатным запросом
+    return connection.vendor == 'postgresql'
+
+
+def refresh_stats(concurrently=True, using=DEFAULT_DB_ALIAS):
+    """
+    Пересчитывает статистику. CONCURRENTLY не блокирует чтение представления на время пересчета
+    (нужен уникальный индекс по стране и уровню).
+    """
+    connection = connections[using]
+    if not has_stats_view(connection):
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'REFRESH MATERIALIZED VIEW {"CONCURRENTLY " if concurrently else ""}{STATS_VIEW}')
+
+
+def mark_stale(using=DEFAULT_DB_ALIAS):
+    """Ставит отметку об устаревшей статистике; уже поставленная отметка не перезаписывается"""
+    connection = connections[using]
+    if not has_stats_view(connection):
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {STATE_TABLE} (id, stale, refreshed_at) VALUES (1, true, NULL) '
+            f'ON CONFLICT (id) DO UPDATE SET stale = true WHERE NOT {STATE_TABLE}.stale',
+        )
+
+
+def schedule_refresh():
+    """
+    Отметка после коммита любой записи элементов и их продуктов (сигналы моделей, update(), импорт, учет проводок,
+    удаление поддеревьев). Сам пересчет - полный агрегат по таблице - выполняет refresh_network_stats вне запроса,
+    сколько бы записей ни было между его запусками.
+    """
+    transaction.on_commit(mark_stale)
+
+
+def refresh_stale(concurrently=True, using=DEFAULT_DB_ALIAS):
+    """
+    Пересчитывает статистику, если после прошлого пересчета были записи, и возвращает, был ли пересчет.
+    Отметка снимается до пересчета: записи, сделанные во время него, поставят ее снова.
+    """
+    connection = connections[using]
+    if not has_stats_view(connection):
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(f'UPDATE {STATE_TABLE} SET stale = false WHERE id = 1 AND stale RETURNING id')
+        if cursor.fetchone() is None:
+            return False
+    try:
+        refresh_stats(concurrently, using)
+    except Exception:
+        mark_stale(using)
+        raise
+    with connection.cursor() as cursor:
+        cursor.execute(f'UPDATE {STATE_TABLE} SET refreshed_at = now() WHERE id = 1')
+    return True
+
+
+def network_stats(queryset, countries=None):
+    """
+    Строки статистики по странам и уровням: одно чтение материализованного представления по уникальному индексу
+    либо агрегатный запрос по выборке элементов. Чтение идет из БД выборки (с учетом реплик).
+    """
+    connection = connections[queryset.db]
+    if not has_stats_view(connection):
+        if countries:
+            queryset = queryset.filter(country__in=countries)
+        return list(queryset.country_stats())
+
+    condition, params = '', []
+    if countries:
+        condition, params = 'WHERE country = ANY(%s)', [list(countries)]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT country, network_lvl, {", ".join(STATS_FIELDS)} FROM {STATS_VIEW} {condition} '
+            f'ORDER BY country, network_lvl',
+            params,
+        )
+        columns = [column.name for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def group_by_country(rows):
+    """Итоги по странам с разбивкой по уровням; все показатели аддитивны, поэтому суммируются в памяти"""
+    countries = {}
+    for row in rows:
+        country = countries.get(row['country'])
+        if country is None:
+            country = countries[row['country']] = {
+                'country': row['country'], 'elements': 0, 'debt_to_parent': Decimal(0),
+                'elements_with_products': 0, 'levels': [],
+            }
+        for field in STATS_FIELDS:
+            country[field] += row[field]
+        country['levels'].append({'network_lvl': row['network_lvl'], **{field: row[field] for field in STATS_FIELDS}})
+    return list(countries.values())
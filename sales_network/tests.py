@@ -1,13 +1,36 @@
 from rest_framework import status
 from rest_framework.exceptions import ValidationError
+from rest_framework.renderers import JSONRenderer
 from rest_framework.reverse import reverse
-from rest_framework.test import APITestCase
+from rest_framework.test import APIClient, APITestCase
+from asgiref.sync import sync_to_async
 from datetime import datetime
-from django.test import TestCase
+from decimal import Decimal
+import io
+import json
+import tempfile
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.conf import settings
+from django.db import connection, connections, models, transaction
+from django.http import HttpResponse
+from unittest import mock, skipUnless
+from django.test import AsyncClient, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.core.exceptions import ValidationError
 
-from .models import Product, NetworkElement
+from .benchmarks import QUERY_BUDGETS, benchmark_network, benchmark_rendering, generate_network
+from .cache import get_stats
+from .changes import change_page
+from .importers import NetworkImporter, read_csv, read_jsonl
+from .metrics import registry
+from .middleware import InstrumentationMiddleware
+from .renderers import InstrumentedJSONRenderer, msgpack
+from .serializers import BULK_MAX_SIZE, NetworkElementSerializer, ProductSerializer, ValuesListSerializer
+from .models import Change, Product, NetworkElement, NetworkElementClosure, DebtTransaction
 from users.models import User
+from users.serializers import ClaimsTokenObtainPairSerializer
 
 
 class ProductTestCase(APITestCase):
@@ -19,7 +42,7 @@ class ProductTestCase(APITestCase):
     def test_product_list(self):
         url = reverse('network:product-list')
         response = self.client.get(url)
-        data = response.json()
+        data = response.json()['results']
         result = [
             {
                 'id': self.product.pk,
@@ -89,7 +112,7 @@ class NetworkElementTestCase(APITestCase):
     def test_element_list(self):
         url = reverse('network:network-list')
         response = self.client.get(url)
-        data = response.json()
+        data = response.json()['results']
         result = [
             {
                 "id": self.element.pk,
@@ -102,6 +125,8 @@ class NetworkElementTestCase(APITestCase):
                 "created_at": self.element.created_at.isoformat().replace("+00:00", "Z"),
                 "debt_to_parent": "100.00",
                 "network_lvl": 0,
+                "subtree_debt": "0.00",
+                "descendants_count": 0,
                 "parent": None,
                 "products": [
                     self.product.pk
@@ -147,13 +172,13 @@ class NetworkElementTestCase(APITestCase):
 
         response_Russia = self.client.get(url, {'country': 'Russia'})
         self.assertEqual(response_Russia.status_code, 200)
-        self.assertEqual(len(response_Russia.data), 1)
-        self.assertEqual(response_Russia.data[0]['country'], 'Russia')
+        self.assertEqual(len(response_Russia.data['results']), 1)
+        self.assertEqual(response_Russia.data['results'][0]['country'], 'Russia')
 
         response_USA = self.client.get(url, {'country': 'USA'})
         self.assertEqual(response_USA.status_code, 200)
-        self.assertEqual(len(response_USA.data), 1)
-        self.assertEqual(response_USA.data[0]['country'], 'USA')
+        self.assertEqual(len(response_USA.data['results']), 1)
+        self.assertEqual(response_USA.data['results'][0]['country'], 'USA')
 
 
     def test_element_update(self):
@@ -177,6 +202,45 @@ class NetworkElementTestCase(APITestCase):
             NetworkElement.objects.all().count(), 0
         )
 
+    def test_element_update_query_count(self):
+        """Тест короткого пути сохранения: PATCH имени и email без чтения строки и проверки иерархии"""
+        url = reverse('network:network-detail', args=(self.element.pk,))
+        # Элемент с продуктами, один UPDATE изменившихся полей, продукты для ответа
+        with self.assertNumQueries(4):
+            response = self.client.patch(url, {'name': 'element 1 new', 'email': 'new@mail.com'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        element = NetworkElement.objects.get(pk=self.element.pk)
+        self.assertEqual((element.name, element.email, element.debt_to_parent), ('element 1 new', 'new@mail.com', 100))
+        self.assertEqual(element.version, 3)
+
+        response = self.client.patch(url, {'email': 'invalid'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_stale_instances_get_distinct_versions(self):
+        """Тест: две записи одного устаревшего объекта увеличивают версию дважды"""
+        self.element.refresh_from_db()
+        first, second = NetworkElement.objects.get(pk=self.element.pk), NetworkElement.objects.get(pk=self.element.pk)
+        first.name = 'first'
+        first.save(update_fields=['name'])
+        second.email = 'second@mail.com'
+        second.save(update_fields=['email'])
+        # Версия после записи перечитывается из БД
+        self.assertEqual((first.version, second.version), (self.element.version + 2,) * 2)
+
+    def test_element_update_parent(self):
+        parent = NetworkElement.objects.create(name='parent', email='mail@mail.com', country='Russia', city='Moscow',
+                                               street='Street', building='1')
+        url = reverse('network:network-detail', args=(self.element.pk,))
+        response = self.client.patch(url, {'parent': parent.pk, 'name': 'child'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['network_lvl'], 1)
+        parent.refresh_from_db()
+        self.assertEqual((parent.subtree_debt, parent.descendants_count), (100, 1))
+
+        response = self.client.patch(reverse('network:network-detail', args=(parent.pk,)), {'parent': self.element.pk},
+                                     format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_element_none_update_debt(self):
         # Хоть статус и 200_OK, но изменения для долга не сохраняются
         url = reverse('network:network-detail', args=(self.element.pk,))
@@ -305,6 +369,1698 @@ class NetworkElementCleanMethodTests(TestCase):
         new_element.full_clean()
         self.assertEqual(new_element.network_lvl, 0)
 
+    def create_chain(self, depth):
+        element = self.root
+        for level in range(depth):
+            element = NetworkElement.objects.create(
+                name=f'Level {level + 1}',
+                email='chain@example.com',
+                country='Country',
+                city='City',
+                street='Street',
+                building='1',
+                parent=element
+            )
+        return element
+
+    def test_cycle_detection_query_budget(self):
+        """Тест постоянного числа запросов при проверке цикла независимо от глубины"""
+        for depth in (5, 40):
+            deepest = self.create_chain(depth)
+            # Проверка FK родителя + один запрос на уровень и цикл
+            root = NetworkElement.objects.get(pk=self.root.pk)
+            root.parent_id = deepest.pk
+            with self.assertNumQueries(2):
+                with self.assertRaises(ValidationError) as context:
+                    root.full_clean()
+            self.assertIn('Обнаружена циклическая ссылка в иерархии', str(context.exception))
+
+            leaf = NetworkElement(
+                name='Leaf',
+                email='leaf@example.com',
+                country='Country',
+                city='City',
+                street='Street',
+                building='1',
+                parent_id=deepest.pk
+            )
+            with self.assertNumQueries(2):
+                leaf.full_clean()
+            self.assertEqual(leaf.network_lvl, depth + 1)
+
+
+class NetworkElementHierarchyTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='user', )
+        self.client.force_authenticate(user=self.user)
+        self.factory = self.create_element('Factory', None)
+        self.retail = self.create_element('Retail', self.factory)
+        self.shop = self.create_element('Shop', self.retail)
+        self.other = self.create_element('Other factory', None)
+
+    @staticmethod
+    def create_element(name, parent, country='Russia'):
+        return NetworkElement.objects.create(
+            name=name,
+            email='mail@mail.com',
+            country=country,
+            city='Moscow',
+            street='Street',
+            building='1',
+            parent=parent
+        )
+
+    def links(self, element):
+        return set(
+            NetworkElementClosure.objects.filter(descendant=element).values_list('ancestor_id', 'depth')
+        )
+
+    def test_closure_on_create(self):
+        """Тест заполнения таблицы замыканий при создании"""
+        self.assertEqual(self.links(self.shop), {(self.shop.pk, 0), (self.retail.pk, 1), (self.factory.pk, 2)})
+        self.assertEqual(self.links(self.other), {(self.other.pk, 0)})
+
+    def test_closure_on_reparent(self):
+        """Тест перестроения связей поддерева при смене родителя"""
+        self.retail.parent = self.other
+        self.retail.save()
+
+        self.assertEqual(self.links(self.shop), {(self.shop.pk, 0), (self.retail.pk, 1), (self.other.pk, 2)})
+        self.assertEqual(list(self.factory.get_descendants()), [])
+
+        self.retail.parent = None
+        self.retail.save()
+        self.assertEqual(self.links(self.shop), {(self.shop.pk, 0), (self.retail.pk, 1)})
+
+    def test_closure_on_delete(self):
+        """Тест удаления связей вместе с поддеревом"""
+        self.retail.delete()
+        self.assertFalse(NetworkElementClosure.objects.filter(descendant_id=self.shop.pk).exists())
+        self.assertEqual(self.links(self.factory), {(self.factory.pk, 0)})
+
+    def test_descendants_and_ancestors_single_query(self):
+        """Тест получения поддерева и цепочки предков одним запросом"""
+        with self.assertNumQueries(1):
+            self.assertEqual(list(self.factory.get_descendants()), [self.retail, self.shop])
+        with self.assertNumQueries(1):
+            self.assertEqual(list(self.shop.get_ancestors()), [self.factory, self.retail])
+
+    def build_subtree(self, root, depth, fan_out):
+        level = [root]
+        for _ in range(depth):
+            level = [self.create_element('Node', parent) for parent in level for _ in range(fan_out)]
+        return level
+
+    def assertLevelsMatchDepth(self):
+        for element in NetworkElement.objects.all():
+            self.assertEqual(element.network_lvl, element.get_ancestors().count())
+
+    def test_move_deep_subtree_levels(self):
+        """Тест сдвига уровней глубокого поддерева при переносе"""
+        self.build_subtree(self.shop, depth=30, fan_out=1)
+        self.retail.move_to(self.other)
+        self.assertLevelsMatchDepth()
+
+        self.retail.move_to(None)
+        self.assertEqual(NetworkElement.objects.get(pk=self.shop.pk).network_lvl, 1)
+        self.assertLevelsMatchDepth()
+
+    def test_move_wide_subtree_levels(self):
+        """Тест сдвига уровней широкого поддерева при переносе"""
+        self.build_subtree(self.shop, depth=2, fan_out=15)
+        deeper = self.create_element('Deeper', self.create_element('Deep', self.other))
+        self.retail.move_to(deeper)
+        self.assertLevelsMatchDepth()
+        self.assertEqual(NetworkElement.objects.filter(network_lvl=6).count(), 15 * 15)
+
+    def test_move_query_count_independent_of_subtree_size(self):
+        """Тест постоянного числа запросов при переносе поддерева любого размера"""
+        small = self.create_element('Small', self.factory)
+        self.create_element('Small child', small)
+        self.build_subtree(self.shop, depth=3, fan_out=6)
+        target = self.create_element('Target', self.other)
+
+        with CaptureQueriesContext(connection) as small_move:
+            small.move_to(target)
+        with CaptureQueriesContext(connection) as big_move:
+            self.retail.move_to(target)
+        self.assertEqual(len(small_move), len(big_move))
+        self.assertLevelsMatchDepth()
+
+    def test_descendants_action(self):
+        self.create_element('Foreign shop', self.retail, country='USA')
+        url = reverse('network:network-descendants', args=(self.factory.pk,))
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.json()['results']), 3)
+
+        response = self.client.get(url, {'country': 'USA'})
+        self.assertEqual([item['name'] for item in response.json()['results']], ['Foreign shop'])
+
+    def test_ancestors_action(self):
+        url = reverse('network:network-ancestors', args=(self.shop.pk,))
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([item['id'] for item in response.json()], [self.factory.pk, self.retail.pk])
+
+    def test_hierarchy_actions_non_numeric_pk(self):
+        for name in ('network:network-descendants', 'network:network-ancestors'):
+            response = self.client.get(reverse(name, args=('abc',)))
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class PaginationTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='user', )
+        self.client.force_authenticate(user=self.user)
+        self.products = [Product.objects.create(name=f'product {number}') for number in range(3)]
+        for number in range(30):
+            element = NetworkElement.objects.create(
+                name=f'element {number}',
+                email='mail@mail.com',
+                country='Russia',
+                city='Moscow',
+                street='Street',
+                building='1'
+            )
+            element.products.set(self.products[:number % 3 + 1])
+
+    def test_network_list_query_count_constant(self):
+        """Тест постоянного числа запросов для любой длины страницы"""
+        url = reverse('network:network-list')
+        for page_size in (5, 30):
+            # Агрегат версий для ETag, страница и prefetch товаров
+            with self.assertNumQueries(3):
+                response = self.client.get(url, {'page_size': page_size})
+            self.assertEqual(len(response.json()['results']), page_size)
+
+    def test_product_list_query_count_constant(self):
+        url = reverse('network:product-list')
+        for page_size in (1, 3):
+            with self.assertNumQueries(2):
+                response = self.client.get(url, {'page_size': page_size})
+            self.assertEqual(len(response.json()['results']), page_size)
+
+    def test_cursor_stable_under_inserts(self):
+        """Тест отсутствия пропусков и повторов при вставках между запросами страниц"""
+        url = reverse('network:network-list')
+        first_page = self.client.get(url, {'page_size': 10}).json()
+        NetworkElement.objects.create(
+            name='new element',
+            email='mail@mail.com',
+            country='Russia',
+            city='Moscow',
+            street='Street',
+            building='1'
+        )
+        second_page = self.client.get(first_page['next']).json()
+
+        names = [item['name'] for item in first_page['results'] + second_page['results']]
+        self.assertEqual(names, [f'element {number}' for number in range(20)])
+
+
+class NetworkElementFilterTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='user', )
+        self.client.force_authenticate(user=self.user)
+        self.factory = NetworkElement.objects.create(
+            name='Главный завод', email='mail@mail.com', country='Russia', city='Moscow', street='Street',
+            building='1'
+        )
+        self.retail = NetworkElement.objects.create(
+            name='Розничная сеть', email='mail@mail.com', country='USA', city='New York', street='Street',
+            building='1', parent=self.factory, debt_to_parent=500
+        )
+        self.shop = NetworkElement.objects.create(
+            name='Магазин у завода', email='mail@mail.com', country='China', city='Shanghai', street='Street',
+            building='1', parent=self.retail, debt_to_parent=50
+        )
+
+    def filter_names(self, params):
+        response = self.client.get(reverse('network:network-list'), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return {item['name'] for item in response.json()['results']}
+
+    def test_multi_value_filters(self):
+        self.assertEqual(self.filter_names({'country': 'Russia,China'}), {'Главный завод', 'Магазин у завода'})
+        self.assertEqual(self.filter_names({'city': 'New York'}), {'Розничная сеть'})
+
+    def test_range_filters(self):
+        self.assertEqual(self.filter_names({'debt_to_parent_min': 10, 'debt_to_parent_max': 100}),
+                         {'Магазин у завода'})
+        self.assertEqual(self.filter_names({'network_lvl_min': 1}), {'Розничная сеть', 'Магазин у завода'})
+        self.assertEqual(self.filter_names({'created_at_after': '2000-01-01T00:00:00'}), {
+            'Главный завод', 'Розничная сеть', 'Магазин у завода'
+        })
+        self.assertEqual(self.filter_names({'created_at_before': '2000-01-01T00:00:00'}), set())
+
+    def test_case_insensitive_search(self):
+        self.assertEqual(self.filter_names({'search': 'ЗАВОД'}), {'Главный завод', 'Магазин у завода'})
+        self.assertEqual(self.filter_names({'search': 'york'}), {'Розничная сеть'})
+        self.assertEqual(self.filter_names({'name': 'сеть'}), {'Розничная сеть'})
+
+    def test_parent_filter(self):
+        self.assertEqual(self.filter_names({'parent': self.retail.pk}), {'Магазин у завода'})
+
+    def test_search_uses_trigram_indexes(self):
+        """Тест использования триграммных индексов для поиска подстроки"""
+        queryset = NetworkElement.objects.filter(name__icontains='завод')
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            plan = queryset.explain()
+        self.assertIn('network_name_trgm_idx', plan)
+
+
+class SubtreeTotalsTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='user', )
+        self.client.force_authenticate(user=self.user)
+        self.supplier = self.create_element('Supplier', None, 0)
+        self.factory = self.create_element('Factory', self.supplier, 100)
+        self.retail = self.create_element('Retail', self.factory, 20)
+        self.shop = self.create_element('Shop', self.retail, 3)
+        self.other = self.create_element('Other', None, 0)
+
+    @staticmethod
+    def create_element(name, parent, debt):
+        return NetworkElement.objects.create(
+            name=name,
+            email='mail@mail.com',
+            country='Russia',
+            city='Moscow',
+            street='Street',
+            building='1',
+            parent=parent,
+            debt_to_parent=debt
+        )
+
+    def assertTotals(self, element, debt, count):
+        element = NetworkElement.objects.get(pk=element.pk)
+        self.assertEqual((element.subtree_debt, element.descendants_count), (debt, count))
+
+    def assertTotalsMatchSubtree(self):
+        for element in NetworkElement.objects.all():
+            descendants = element.get_descendants()
+            self.assertEqual(element.descendants_count, descendants.count())
+            self.assertEqual(element.subtree_debt, sum(item.debt_to_parent for item in descendants))
+
+    def test_totals_on_create(self):
+        self.assertTotals(self.supplier, 123, 3)
+        self.assertTotals(self.factory, 23, 2)
+        self.assertTotals(self.shop, 0, 0)
+
+    def test_totals_on_reparent(self):
+        """Тест переноса итогов поддерева от старых предков к новым"""
+        self.retail.move_to(self.other)
+        self.assertTotals(self.supplier, 100, 1)
+        self.assertTotals(self.factory, 0, 0)
+        self.assertTotals(self.other, 23, 2)
+        self.assertTotalsMatchSubtree()
+
+    def test_stale_instance_save_keeps_totals(self):
+        """Тест: сохранение устаревшего объекта не затирает итоги"""
+        self.supplier.name = 'Supplier new'
+        self.supplier.save()
+        self.assertTotals(self.supplier, 123, 3)
+
+    def test_totals_on_delete(self):
+        self.retail.delete()
+        self.assertTotals(self.supplier, 100, 1)
+        self.assertTotals(self.factory, 0, 0)
+
+    def test_totals_on_queryset_delete(self):
+        NetworkElement.objects.filter(pk__in=[self.retail.pk, self.shop.pk]).delete()
+        self.assertTotals(self.supplier, 100, 1)
+        self.assertTotalsMatchSubtree()
+
+    def test_update_rejects_maintained_fields(self):
+        """Тест: update() долга обошел бы итоги предков, поэтому запрещен"""
+        with self.assertRaises(ValueError):
+            NetworkElement.objects.filter(pk=self.shop.pk).update(debt_to_parent=500)
+        self.assertTotals(self.supplier, 123, 3)
+
+    def test_save_keeps_compaction_between_read_and_write(self):
+        """Тест: учет проводок между чтением строки в save() и ее записью не затирается"""
+        element = NetworkElement.objects.get(pk=self.retail.pk)
+        element.name = 'Retail new'
+        DebtTransaction.objects.post([(self.retail.pk, 5, '')])
+        save = models.Model.save
+
+        def compact_then_save(instance, *args, **kwargs):
+            DebtTransaction.objects.compact()
+            return save(instance, *args, **kwargs)
+
+        with mock.patch.object(models.Model, 'save', compact_then_save):
+            element.save()
+        self.assertEqual(NetworkElement.objects.get(pk=self.retail.pk).debt_to_parent, 25)
+        self.assertTotals(self.supplier, 128, 3)
+        self.assertTotalsMatchSubtree()
+
+    def test_totals_on_zero_debt(self):
+        """Тест обнуления долга для выбранных элементов, в том числе вложенных друг в друга"""
+        NetworkElement.objects.filter(pk__in=[self.factory.pk, self.shop.pk]).zero_debt()
+        self.assertTotals(self.supplier, 20, 3)
+        self.assertTotals(self.factory, 20, 2)
+        self.assertTotals(self.retail, 0, 1)
+        self.assertTotalsMatchSubtree()
+
+    def test_totals_on_admin_zero_debt(self):
+        admin = User.objects.create(username='admin', is_staff=True, is_superuser=True)
+        self.client.force_login(admin)
+        response = self.client.post(reverse('admin:sales_network_networkelement_changelist'), {
+            'action': 'make_zero_debt',
+            '_selected_action': [self.retail.pk],
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertTotals(self.supplier, 103, 3)
+        self.assertTotalsMatchSubtree()
+
+    def test_totals_on_import(self):
+        records = [
+            {'ref': 'a', 'parent_id': self.retail.pk, 'debt_to_parent': '5'},
+            {'ref': 'b', 'parent': 'a', 'debt_to_parent': '7'},
+        ]
+        for record in records:
+            record.update(name='Imported', email='mail@mail.com', country='Russia', city='Moscow',
+                          street='Street', building='1')
+        NetworkImporter(chunk_size=1).run(records)
+        self.assertTotals(self.supplier, 135, 5)
+        self.assertTotalsMatchSubtree()
+
+    def test_debt_summary_action(self):
+        url = reverse('network:network-debt-summary', args=(self.supplier.pk,))
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), {
+            'id': self.supplier.pk,
+            'debt_to_parent': '0.00',
+            'subtree_debt': '123.00',
+            'descendants_count': 3,
+        })
+
+        # Права на объект проверяются так же, как в других действиях над элементом
+        with mock.patch('sales_network.views.NetworkElementViewSet.check_object_permissions') as check:
+            self.client.get(url)
+        self.assertEqual(check.call_args.args[1].pk, self.supplier.pk)
+
+    def test_totals_read_only_in_api(self):
+        url = reverse('network:network-detail', args=(self.shop.pk,))
+        response = self.client.patch(url, {'subtree_debt': '999', 'descendants_count': 9}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTotals(self.shop, 0, 0)
+
+
+class NetworkBulkTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='user', )
+        self.client.force_authenticate(user=self.user)
+        self.supplier = SubtreeTotalsTests.create_element('Supplier', None, 0)
+        self.factory = SubtreeTotalsTests.create_element('Factory', self.supplier, 100)
+        self.retail = SubtreeTotalsTests.create_element('Retail', self.factory, 20)
+        self.shop = SubtreeTotalsTests.create_element('Shop', self.retail, 3)
+        self.other = SubtreeTotalsTests.create_element('Other', None, 0)
+        self.url = reverse('network:network-bulk')
+
+    assertTotals = SubtreeTotalsTests.assertTotals
+    assertTotalsMatchSubtree = SubtreeTotalsTests.assertTotalsMatchSubtree
+
+    def patch(self, rows):
+        return self.client.patch(self.url, rows, format='json')
+
+    def test_fields_and_nested_moves(self):
+        """Тест переноса элемента и его потомка в одной пачке вместе с изменением полей"""
+        response = self.patch([
+            {'id': self.retail.pk, 'parent': self.other.pk},
+            {'id': self.shop.pk, 'parent': self.supplier.pk, 'city': 'Kazan'},
+            {'id': self.factory.pk, 'name': 'Factory new'},
+        ])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), {'updated': 3})
+
+        self.assertTotals(self.supplier, 103, 2)
+        self.assertTotals(self.other, 20, 1)
+        self.assertTotals(self.retail, 0, 0)
+        self.assertTotalsMatchSubtree()
+        self.assertEqual(list(self.shop.get_ancestors()), [self.supplier])
+        self.assertEqual(list(self.retail.get_ancestors()), [self.other])
+        levels = dict(NetworkElement.objects.values_list('name', 'network_lvl'))
+        self.assertEqual((levels['Retail'], levels['Shop'], levels['Factory new']), (1, 1, 1))
+        self.assertEqual(NetworkElement.objects.get(pk=self.shop.pk).city, 'Kazan')
+
+    def test_cycle_across_batch(self):
+        """Тест цикла, который образуют только два переноса вместе"""
+        response = self.patch([
+            {'id': self.factory.pk, 'parent': self.other.pk},
+            {'id': self.other.pk, 'parent': self.retail.pk},
+            {'id': self.supplier.pk, 'parent': self.supplier.pk},
+        ])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json(), [
+            {'parent': ['Обнаружена циклическая ссылка в иерархии']},
+            {'parent': ['Обнаружена циклическая ссылка в иерархии']},
+            {'parent': ['Элемент не может быть родителем самому себе']},
+        ])
+        self.assertEqual(NetworkElement.objects.get(pk=self.factory.pk).parent_id, self.supplier.pk)
+
+    def test_per_row_errors(self):
+        response = self.patch([{'id': self.shop.pk}, {'id': self.retail.pk, 'email': 'invalid'}])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(list(response.json()[1]), ['email'])
+
+        response = self.patch([
+            {'id': 0},
+            {'id': self.shop.pk, 'parent': 0},
+            {'id': self.retail.pk, 'products': [0]},
+            {'id': self.retail.pk, 'city': 'Kazan'},
+        ])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json(), [
+            {'id': ['Элемент с id=0 не найден']},
+            {'parent': ['Родитель с id=0 не найден']},
+            {'products': ['Продукты не найдены: [0]']},
+            {'id': ['Элемент указан в пачке несколько раз']},
+        ])
+
+    def test_products(self):
+        product = Product.objects.create(name='product 1')
+        version = NetworkElement.objects.get(pk=self.shop.pk).version
+        response = self.patch([{'id': self.shop.pk, 'products': [product.pk]}, {'id': self.retail.pk, 'products': []}])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(list(self.shop.products.all()), [product])
+        self.assertGreater(NetworkElement.objects.get(pk=self.shop.pk).version, version)
+
+    def test_query_count_constant(self):
+        """Тест постоянного числа запросов для пачек разного размера"""
+        generate_network(depth=2, fan_out=4, roots=2)
+        roots = list(NetworkElement.objects.filter(name__startswith='Element', network_lvl=0))
+        counts = []
+        for size in (2, 8):
+            elements = NetworkElement.objects.filter(network_lvl=2, parent__parent=roots[0])[:size]
+            rows = [{'id': element.pk, 'parent': roots[1].pk, 'city': 'Kazan'} for element in elements]
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.patch(rows).status_code, status.HTTP_200_OK)
+            counts.append(len(queries))
+            roots.reverse()
+        self.assertEqual(counts[0], counts[1])
+        self.assertTotalsMatchSubtree()
+
+    def test_bulk_delete(self):
+        response = self.client.delete(self.url, {'ids': [self.retail.pk, self.other.pk]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), {'deleted': 3, 'product_links': 0, 'debt_transactions': 0})
+        self.assertTotals(self.supplier, 100, 1)
+
+        response = self.client.delete(self.url, {'ids': [self.factory.pk, 0]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json(), {'ids': ['Элементы не найдены: [0]']})
+        self.assertTrue(NetworkElement.objects.filter(pk=self.factory.pk).exists())
+
+
+class SubtreeDeleteTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='user', )
+        self.client.force_authenticate(user=self.user)
+        self.product = Product.objects.create(name='product 1', model='model 1', release_date='2024-12-12')
+        self.supplier = SubtreeTotalsTests.create_element('Supplier', None, 0)
+        self.factory = SubtreeTotalsTests.create_element('Factory', self.supplier, 100)
+        self.retail = SubtreeTotalsTests.create_element('Retail', self.factory, 20)
+        self.shops = [SubtreeTotalsTests.create_element(f'Shop {number}', self.retail, 3) for number in range(3)]
+        self.other = SubtreeTotalsTests.create_element('Other', None, 0)
+        for element in (self.factory, self.retail, *self.shops, self.other):
+            element.products.add(self.product)
+        DebtTransaction.objects.post([(self.retail.pk, 5, ''), (self.shops[0].pk, 1, '')])
+        self.subtree = [self.factory.pk, self.retail.pk, *(shop.pk for shop in self.shops)]
+
+    assertTotals = SubtreeTotalsTests.assertTotals
+    assertTotalsMatchSubtree = SubtreeTotalsTests.assertTotalsMatchSubtree
+
+    def assertSubtreeDeleted(self):
+        self.assertFalse(NetworkElement.objects.filter(pk__in=self.subtree).exists())
+        self.assertFalse(NetworkElementClosure.objects.filter(descendant__in=self.subtree).exists())
+        self.assertFalse(DebtTransaction.objects.filter(element__in=self.subtree).exists())
+        self.assertEqual(list(self.product.product.all()), [self.other])
+        self.assertTotals(self.supplier, 0, 0)
+        self.assertTotalsMatchSubtree()
+
+    def test_subtree_action(self):
+        url = reverse('network:network-subtree', args=(self.factory.pk,))
+        response = self.client.delete(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), {'deleted': 5, 'product_links': 5, 'debt_transactions': 2})
+        self.assertSubtreeDeleted()
+        self.assertEqual(self.client.delete(url).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_without_deletion_collector(self):
+        """Тест: поддерево удаляется пачками SQL, число запросов зависит от числа пачек, а не от глубины"""
+        with mock.patch('django.db.models.deletion.Collector.collect', side_effect=AssertionError('сборщик')), \
+                CaptureQueriesContext(connection) as queries:
+            counts = NetworkElement.objects.filter(pk__in=[self.factory.pk, self.shops[0].pk]).delete_subtrees(
+                chunk_size=2)
+        self.assertEqual(counts, {'deleted': 5, 'product_links': 5, 'debt_transactions': 2})
+        # Корни и сдвиг итогов предков, затем на каждую из 3 пачек выборка id и 4 удаления
+        self.assertEqual(len([query for query in queries if query['sql'].startswith(('SELECT', 'UPDATE', 'DELETE'))]),
+                         2 + 3 * 5)
+        self.assertSubtreeDeleted()
+
+    def test_destroy(self):
+        response = self.client.delete(reverse('network:network-detail', args=(self.factory.pk,)))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertSubtreeDeleted()
+
+    def test_change_feed_records_delete(self):
+        NetworkElement.objects.filter(pk=self.factory.pk).delete_subtrees()
+        for element_id in self.subtree:
+            self.assertEqual(Change.objects.filter(model='network', object_id=element_id).latest('id').action,
+                             Change.DELETE)
+
+    def test_admin_action(self):
+        admin = User.objects.create(username='admin', is_staff=True, is_superuser=True)
+        self.client.force_login(admin)
+        response = self.client.post(reverse('admin:sales_network_networkelement_changelist'), {
+            'action': 'delete_subtrees',
+            '_selected_action': [self.factory.pk, self.retail.pk],
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertSubtreeDeleted()
+        self.assertTrue(NetworkElement.objects.filter(pk=self.other.pk).exists())
+
+
+class ProductReverseLookupTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='user', )
+        self.client.force_authenticate(user=self.user)
+        self.tv, self.radio, self.phone = (Product.objects.create(name=name) for name in ('TV', 'Radio', 'Phone'))
+        self.supplier = SubtreeTotalsTests.create_element('Supplier', None, 0)
+        self.factory = SubtreeTotalsTests.create_element('Factory', self.supplier, 0)
+        self.retail = SubtreeTotalsTests.create_element('Retail', self.factory, 0)
+        self.other = SubtreeTotalsTests.create_element('Other', None, 0)
+        self.factory.products.set([self.tv])
+        self.retail.products.set([self.tv, self.radio])
+        self.other.products.set([self.tv, self.phone])
+        NetworkElement.objects.filter(pk=self.retail.pk).update(country='USA')
+
+    def test_product_elements(self):
+        url = reverse('network:product-elements', args=(self.tv.pk,))
+        with self.assertNumQueries(3):
+            response = self.client.get(url)
+        self.assertEqual([item['id'] for item in response.json()['results']],
+                         [self.factory.pk, self.retail.pk, self.other.pk])
+
+        response = self.client.get(url, {'country': 'Russia', 'network_lvl_min': 1})
+        self.assertEqual([item['id'] for item in response.json()['results']], [self.factory.pk])
+        response = self.client.get(url, {'page_size': 2})
+        self.assertEqual(len(response.json()['results']), 2)
+        self.assertEqual(len(self.client.get(response.json()['next']).json()['results']), 1)
+        self.assertEqual(self.client.get(reverse('network:product-elements', args=(0,))).status_code,
+                         status.HTTP_404_NOT_FOUND)
+
+    def test_subtree_products(self):
+        url = reverse('network:network-subtree-products', args=(self.supplier.pk,))
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+        self.assertEqual([item['name'] for item in response.json()['results']], ['TV', 'Radio'])
+
+        response = self.client.get(url, {'country': 'Russia'})
+        self.assertEqual([item['name'] for item in response.json()['results']], ['TV'])
+        response = self.client.get(reverse('network:network-subtree-products', args=(self.retail.pk,)),
+                                   {'network_lvl_max': 1})
+        self.assertEqual(response.json()['results'], [])
+        self.assertEqual(self.client.get(url, {'network_lvl_min': 'x'}).status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class SparseFieldsetTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='user', )
+        self.client.force_authenticate(user=self.user)
+        self.product = Product.objects.create(name='product 1', model='model 1')
+        self.root = SubtreeTotalsTests.create_element('Root', None, 100)
+        self.root.products.set([self.product])
+        self.child = SubtreeTotalsTests.create_element('Child', self.root, 10)
+        self.list_url = reverse('network:network-list')
+
+    def get(self, url, params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.json(), [query['sql'] for query in queries]
+
+    def test_fields_drive_queryset(self):
+        """Тест выборки только нужных колонок и отсутствия запроса продуктов без поля products"""
+        data, queries = self.get(self.list_url, {'fields': 'id,name,parent'})
+        self.assertEqual(data['results'][0], {'id': self.root.pk, 'name': 'Root', 'parent': None})
+        self.assertFalse(any('networkelement_products' in sql for sql in queries))
+        self.assertFalse(any('"street"' in sql for sql in queries))
+
+        data, queries = self.get(self.list_url, {'fields': 'id,products'})
+        self.assertEqual(data['results'][0], {'id': self.root.pk, 'products': [self.product.pk]})
+        self.assertTrue(any('networkelement_products' in sql for sql in queries))
+
+    def test_exclude(self):
+        data, _ = self.get(reverse('network:network-detail', args=(self.child.pk,)),
+                           {'exclude': 'products,street,building,debt_to_parent'})
+        self.assertNotIn('street', data)
+        self.assertNotIn('debt_to_parent', data)
+        self.assertEqual(data['name'], 'Child')
+
+        data, _ = self.get(self.list_url, {'fields': 'id,name,city', 'exclude': 'city'})
+        self.assertEqual(set(data['results'][0]), {'id', 'name'})
+
+    def test_unknown_fields(self):
+        response = self.client.get(self.list_url, {'fields': 'id,password', 'exclude': 'secret'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(set(response.json()), {'fields', 'exclude'})
+
+        response = self.client.get(self.list_url, {'fields': 'id', 'exclude': 'id'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_actions(self):
+        """Тест наборов полей у дерева, потомков и поиска по продуктам"""
+        data, _ = self.get(reverse('network:network-tree'), {'fields': 'name'})
+        self.assertEqual(data, [{'id': self.root.pk, 'parent': None, 'name': 'Root', 'children': [
+            {'id': self.child.pk, 'parent': self.root.pk, 'name': 'Child', 'children': []},
+        ]}])
+
+        data, _ = self.get(reverse('network:network-descendants', args=(self.root.pk,)), {'fields': 'name'})
+        self.assertEqual(data['results'], [{'name': 'Child'}])
+
+        data, _ = self.get(reverse('network:product-elements', args=(self.product.pk,)), {'fields': 'name'})
+        self.assertEqual(data['results'], [{'name': 'Root'}])
+
+        data, _ = self.get(reverse('network:network-subtree-products', args=(self.root.pk,)), {'fields': 'model'})
+        self.assertEqual(data['results'], [{'model': 'model 1'}])
+
+    def test_ignored_on_write(self):
+        url = reverse('network:network-detail', args=(self.child.pk,))
+        response = self.client.patch(f'{url}?fields=id', {'name': 'Child 2'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['name'], 'Child 2')
+
+
+class DebtLedgerTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='user', )
+        self.client.force_authenticate(user=self.user)
+        self.supplier = SubtreeTotalsTests.create_element('Supplier', None, 0)
+        self.factory = SubtreeTotalsTests.create_element('Factory', self.supplier, 100)
+        self.retail = SubtreeTotalsTests.create_element('Retail', self.factory, 20)
+        self.url = reverse('network:debt-transaction-list')
+
+    def debt(self, element):
+        element = NetworkElement.objects.get(pk=element.pk)
+        return element.debt_to_parent, element.subtree_debt
+
+    def test_bulk_posting_is_append_only(self):
+        """Тест пакетной проводки: долг элементов не меняется до сжатия журнала"""
+        response = self.client.post(self.url, [
+            {'element': self.factory.pk, 'amount': '50.00', 'comment': 'Счет'},
+            {'element': self.retail.pk, 'amount': '-5.00', 'comment': 'Оплата'},
+            {'element': self.retail.pk, 'amount': '-10.00'},
+        ], format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(response.json()), 3)
+        self.assertEqual(self.debt(self.factory), (100, 20))
+        self.assertEqual(DebtTransaction.objects.filter(compacted=False).count(), 3)
+
+        response = self.client.post(self.url, {'element': self.retail.pk, 'amount': '1.00'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_bulk_posting_size_limited(self):
+        entries = [{'element': self.retail.pk, 'amount': '1.00'}] * (BULK_MAX_SIZE + 1)
+        response = self.client.post(self.url, entries, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(DebtTransaction.objects.exists())
+
+    def test_posting_to_missing_element(self):
+        response = self.client.post(self.url, [{'element': 0, 'amount': '1.00'}], format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(DebtTransaction.objects.exists())
+
+    def test_compaction_updates_debt_and_totals(self):
+        DebtTransaction.objects.post([
+            (self.factory.pk, 50, 'Счет'),
+            (self.retail.pk, -5, 'Оплата'),
+            (self.retail.pk, -10, 'Оплата'),
+        ])
+        # Два запроса на любой объем журнала плюс SAVEPOINT/RELEASE вложенной транзакции
+        with self.assertNumQueries(4):
+            self.assertEqual(DebtTransaction.objects.compact(), 2)
+        self.assertEqual(self.debt(self.factory), (150, 5))
+        self.assertEqual(self.debt(self.retail), (5, 0))
+        self.assertEqual(self.debt(self.supplier), (0, 155))
+        self.assertFalse(DebtTransaction.objects.filter(compacted=False).exists())
+
+        # Повторное сжатие ничего не учитывает дважды, новые проводки попадают в следующий проход
+        self.assertEqual(DebtTransaction.objects.compact(), 0)
+        DebtTransaction.objects.post([(self.retail.pk, 1, '')])
+        DebtTransaction.objects.compact()
+        self.assertEqual(self.debt(self.factory), (150, 6))
+        self.assertEqual(self.debt(self.supplier), (0, 156))
+
+    def test_compact_endpoint_and_command(self):
+        DebtTransaction.objects.post([(self.factory.pk, 50, '')])
+        response = self.client.post(reverse('network:debt-transaction-compact'))
+        self.assertEqual(response.json(), {'elements': 1})
+
+        DebtTransaction.objects.post([(self.factory.pk, 50, '')])
+        out = io.StringIO()
+        call_command('compact_debt', stdout=out)
+        self.assertIn('1', out.getvalue())
+        self.assertEqual(self.debt(self.factory), (200, 20))
+
+    def test_zero_debt_is_ledger_write(self):
+        """Тест аннулирования долга встречной проводкой с учетом неучтенных проводок"""
+        DebtTransaction.objects.post([(self.retail.pk, 7, '')])
+        NetworkElement.objects.filter(pk=self.retail.pk).zero_debt()
+        self.assertEqual(self.debt(self.retail), (0, 0))
+        self.assertEqual(self.debt(self.factory), (100, 0))
+        self.assertEqual(self.debt(self.supplier), (0, 100))
+        self.assertEqual(
+            list(DebtTransaction.objects.filter(element=self.retail).order_by('pk').values_list('amount', 'compacted')),
+            [(7, True), (-27, True)],
+        )
+
+
+class NetworkStatsTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='user', )
+        self.client.force_authenticate(user=self.user)
+        self.product = Product.objects.create(name='product 1')
+        self.factory = SubtreeTotalsTests.create_element('Factory', None, 100)
+        self.factory.products.set([self.product])
+        self.retail = SubtreeTotalsTests.create_element('Retail', self.factory, 10)
+        self.dealer = SubtreeTotalsTests.create_element('Dealer', None, 5)
+        NetworkElement.objects.filter(pk=self.dealer.pk).update(country='USA')
+        self.url = reverse('network:network-stats')
+        self.expected = [
+            {'country': 'Russia', 'elements': 2, 'debt_to_parent': '110.00', 'elements_with_products': 1, 'levels': [
+                {'network_lvl': 0, 'elements': 1, 'debt_to_parent': '100.00', 'elements_with_products': 1},
+                {'network_lvl': 1, 'elements': 1, 'debt_to_parent': '10.00', 'elements_with_products': 0},
+            ]},
+            {'country': 'USA', 'elements': 1, 'debt_to_parent': '5.00', 'elements_with_products': 0, 'levels': [
+                {'network_lvl': 0, 'elements': 1, 'debt_to_parent': '5.00', 'elements_with_products': 0},
+            ]},
+        ]
+
+    def test_stats_from_materialized_view(self):
+        """Тест статистики: одно чтение представления после пересчета командой"""
+        call_command('refresh_network_stats', '--force', stdout=io.StringIO())
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), self.expected)
+
+        response = self.client.get(self.url, {'country': 'USA,France'})
+        self.assertEqual(response.json(), self.expected[1:])
+
+    def test_aggregate_fallback(self):
+        """Тест расчета агрегатным запросом на СУБД без материализованных представлений"""
+        with mock.patch.object(connections['default'], 'vendor', 'sqlite'):
+            self.assertEqual(self.client.get(self.url).json(), self.expected)
+            self.assertEqual(self.client.get(self.url, {'country': 'Russia'}).json(), self.expected[:1])
+
+    def test_refreshed_after_single_create(self):
+        """Тест: создание одного элемента через API тоже отмечает статистику устаревшей"""
+        call_command('refresh_network_stats', '--force', stdout=io.StringIO())
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('network:network-list'), {
+                'name': 'Shop', 'email': 'mail@mail.com', 'country': 'USA', 'city': 'Boston', 'street': 'Street',
+                'building': '1', 'parent': self.dealer.pk, 'products': [self.product.pk],
+            }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        call_command('refresh_network_stats', stdout=io.StringIO())
+        usa = self.client.get(self.url, {'country': 'USA'}).json()[0]
+        self.assertEqual([level['network_lvl'] for level in usa['levels']], [0, 1])
+        self.assertEqual((usa['elements'], usa['elements_with_products']), (2, 1))
+
+    def test_refreshed_after_bulk_update(self):
+        """Тест: пакетное изменение только отмечает статистику устаревшей, пересчитывает ее команда"""
+        call_command('refresh_network_stats', '--blocking', '--force', stdout=io.StringIO())
+        with self.captureOnCommitCallbacks(execute=True), CaptureQueriesContext(connection) as queries:
+            response = self.client.patch(reverse('network:network-bulk'), [
+                {'id': self.dealer.pk, 'parent': self.factory.pk},
+            ], format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse([query for query in queries if 'REFRESH' in query['sql']])
+        self.assertEqual(self.client.get(self.url, {'country': 'USA'}).json()[0]['levels'][0]['network_lvl'], 0)
+
+        output = io.StringIO()
+        call_command('refresh_network_stats', '--blocking', stdout=output)
+        self.assertEqual(output.getvalue().strip(), 'Статистика сети пересчитана')
+        usa = self.client.get(self.url, {'country': 'USA'}).json()[0]
+        self.assertEqual(usa['levels'], [
+            {'network_lvl': 1, 'elements': 1, 'debt_to_parent': '5.00', 'elements_with_products': 0},
+        ])
+
+        # Без новых записей повторный пересчет не нужен
+        output = io.StringIO()
+        call_command('refresh_network_stats', '--blocking', stdout=output)
+        self.assertEqual(output.getvalue().strip(), 'Статистика сети актуальна')
+
+
+# В тестах один процесс, поэтому локальный кэш ведет себя как общий
+@override_settings(SHARED_CACHE=True)
+class ResponseCacheTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='user', )
+        self.client.force_authenticate(user=self.user)
+        self.product = Product.objects.create(name='product 1')
+        self.element = NetworkElement.objects.create(
+            name='element 1',
+            email='mail@mail.com',
+            country='Russia',
+            city='Moscow',
+            street='Street',
+            building='1',
+            debt_to_parent=10
+        )
+        self.element.products.set([self.product])
+        self.list_url = reverse('network:network-list')
+        self.detail_url = reverse('network:network-detail', args=(self.element.pk,))
+
+    def assertCached(self, url, params=None):
+        self.client.get(url, params)
+        with self.assertNumQueries(0):
+            return self.client.get(url, params).json()
+
+    def test_list_and_retrieve_cached(self):
+        self.assertCached(self.list_url)
+        self.assertCached(self.detail_url)
+        self.assertCached(reverse('network:product-list'))
+        self.assertEqual(get_stats()['network'], {'hits': 2, 'misses': 2})
+        self.assertEqual(get_stats()['product'], {'hits': 1, 'misses': 1})
+
+    @override_settings(SHARED_CACHE=False)
+    def test_not_cached_without_shared_cache(self):
+        """Тест: без общего кэша ответы и версии не кэшируются, другие процессы не отдадут устаревшие данные"""
+        self.client.get(self.list_url)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(self.list_url)
+        self.assertTrue(queries)
+        self.assertEqual(get_stats()['network'], {'hits': 0, 'misses': 0})
+
+    def test_key_includes_filters(self):
+        self.assertEqual(len(self.assertCached(self.list_url, {'country': 'Russia'})['results']), 1)
+        self.assertEqual(len(self.assertCached(self.list_url, {'country': 'USA'})['results']), 0)
+
+    def test_invalidated_by_save_and_delete(self):
+        self.assertCached(self.detail_url)
+        self.element.name = 'element 1 new'
+        self.element.save()
+        self.assertEqual(self.client.get(self.detail_url).json()['name'], 'element 1 new')
+
+        self.assertCached(self.list_url)
+        self.element.delete()
+        self.assertEqual(self.client.get(self.list_url).json()['results'], [])
+
+    def test_invalidated_by_m2m_change(self):
+        self.assertCached(self.detail_url)
+        self.element.products.clear()
+        self.assertEqual(self.client.get(self.detail_url).json()['products'], [])
+
+    def test_invalidated_by_queryset_update(self):
+        """Тест сброса кэша массовым обновлением (обнуление долга в админке)"""
+        self.assertCached(self.detail_url)
+        NetworkElement.objects.filter(pk=self.element.pk).zero_debt()
+        self.assertEqual(self.client.get(self.detail_url).json()['debt_to_parent'], '0.00')
+
+    def test_product_delete_invalidates_network(self):
+        self.assertCached(self.detail_url)
+        self.product.delete()
+        self.assertEqual(self.client.get(self.detail_url).json()['products'], [])
+
+    def test_cache_stats_endpoint(self):
+        self.client.get(self.list_url)
+        response = self.client.get(reverse('network:cache-stats'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['network']['misses'], 1)
+
+
+@override_settings(SHARED_CACHE=True)
+class ConditionalGetTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='user', )
+        self.client.force_authenticate(user=self.user)
+        self.product = Product.objects.create(name='product 1')
+        self.element = NetworkElement.objects.create(
+            name='element 1',
+            email='mail@mail.com',
+            country='Russia',
+            city='Moscow',
+            street='Street',
+            building='1',
+        )
+        self.element.products.set([self.product])
+        self.list_url = reverse('network:network-list')
+        self.detail_url = reverse('network:network-detail', args=(self.element.pk,))
+
+    def etag(self, url, params=None):
+        cache.clear()
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response['ETag']
+
+    def test_not_modified_after_single_query(self):
+        for url, params in ((self.detail_url, None), (self.list_url, {'country': 'Russia'}),
+                            (reverse('network:product-list'), None)):
+            etag = self.etag(url, params)
+            cache.clear()
+            with self.assertNumQueries(1):
+                response = self.client.get(url, params, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+            self.assertEqual(response['ETag'], etag)
+            self.assertFalse(response.content)
+
+    def test_last_modified_on_detail(self):
+        response = self.client.get(self.detail_url)
+        self.assertIn('no-cache', response['Cache-Control'])
+        response = self.client.get(self.detail_url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertNotIn('Last-Modified', self.client.get(self.list_url))
+
+    def test_etag_changes_on_writes(self):
+        """Тест смены ETag при сохранении, изменении связей, массовом обновлении, вставке и удалении"""
+        writes = [
+            lambda: self.element.save(),
+            lambda: self.element.products.clear(),
+            lambda: self.product.product.add(self.element),
+            lambda: NetworkElement.objects.filter(pk=self.element.pk).update(city='Kazan'),
+            lambda: DebtTransaction.objects.post([(self.element.pk, 10, '')]) and DebtTransaction.objects.compact(),
+            lambda: self.product.delete(),
+        ]
+        etags = [self.etag(self.detail_url)]
+        for write in writes:
+            write()
+            etags.append(self.etag(self.detail_url))
+        self.assertEqual(len(set(etags)), len(etags))
+
+        list_etag = self.etag(self.list_url)
+        NetworkElement.objects.create(name='element 2', email='mail@mail.com', country='Russia', city='Moscow',
+                                      street='Street', building='1', parent=self.element)
+        self.assertNotEqual(self.etag(self.list_url), list_etag)
+        list_etag = self.etag(self.list_url)
+        NetworkElement.objects.filter(parent=self.element).delete()
+        self.assertNotEqual(self.etag(self.list_url), list_etag)
+
+    def test_non_numeric_pk_not_found(self):
+        for name in ('network:network-detail', 'network:product-detail'):
+            response = self.client.get(reverse(name, args=('abc',)))
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_product_version(self):
+        self.product.save()
+        Product.objects.filter(pk=self.product.pk).update(model='x')
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.version, 3)
+
+    def test_cached_response_has_etag(self):
+        etag = self.client.get(self.detail_url)['ETag']
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=etag).status_code,
+                             status.HTTP_304_NOT_MODIFIED)
+            self.assertEqual(self.client.get(self.detail_url)['ETag'], etag)
+
+
+class RequestMetricsTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        registry.reset()
+        self.user = User.objects.create(username='user', )
+        self.client.force_authenticate(user=self.user)
+        self.product = Product.objects.create(name='product')
+        for number in range(3):
+            element = NetworkElement.objects.create(
+                name=f'element {number}', email='mail@mail.com', country='Russia', city='Moscow', street='Street',
+                building='1'
+            )
+            element.products.add(self.product)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def metrics(self, **headers):
+        headers.setdefault('HTTP_AUTHORIZATION', 'Bearer secret')
+        return self.client.get(reverse('network:metrics'), **headers)
+
+    def test_metrics_per_endpoint(self):
+        self.client.get(reverse('network:network-list'))
+        self.client.get(reverse('network:network-detail', args=(NetworkElement.objects.first().pk,)))
+        body = self.metrics().content.decode()
+
+        self.assertIn('sales_network_requests_total{endpoint="NetworkElementViewSet.list",method="GET",status="200"} 1',
+                      body)
+        # Агрегат версий для ETag, страница элементов и prefetch товаров
+        self.assertIn('sales_network_db_queries_total{endpoint="NetworkElementViewSet.list",method="GET"} 3', body)
+        self.assertIn('sales_network_request_duration_seconds_count{endpoint="NetworkElementViewSet.retrieve",'
+                      'method="GET"} 1', body)
+        self.assertIn('sales_network_duplicate_query_requests_total{endpoint="NetworkElementViewSet.list",'
+                      'method="GET"} 0', body)
+        for line in body.splitlines():
+            if line.startswith(('sales_network_serialization_seconds_total', 'sales_network_render_seconds_total',
+                                'sales_network_response_bytes_total')) and 'NetworkElementViewSet.list' in line:
+                self.assertGreater(float(line.rsplit(' ', 1)[1]), 0)
+
+    @override_settings(DUPLICATE_QUERY_THRESHOLD=3)
+    def test_duplicate_queries_flagged(self):
+        """Тест обнаружения N+1: по запросу products на каждую строку"""
+        def view(request):
+            for element in NetworkElement.objects.all():
+                list(element.products.all())
+            return HttpResponse('ok')
+
+        with self.assertLogs('sales_network.requests', 'WARNING') as logs:
+            InstrumentationMiddleware(view)(RequestFactory().get('/n-plus-one/'))
+        self.assertIn('(3 раз)', logs.output[0])
+        self.assertIn('sales_network_duplicate_query_requests_total{endpoint="unresolved",method="GET"} 1',
+                      registry.render())
+
+    @override_settings(SLOW_REQUEST_SECONDS=0.000001)
+    def test_slow_request_log(self):
+        with self.assertLogs('sales_network.requests', 'WARNING') as logs:
+            self.client.get(reverse('network:product-list'))
+        self.assertIn('ProductViewSet.list', logs.output[0])
+
+    def test_metrics_token(self):
+        self.assertEqual(self.metrics(HTTP_AUTHORIZATION='').status_code, 401)
+        self.assertEqual(self.metrics(HTTP_AUTHORIZATION='Bearer other').status_code, 401)
+        self.assertEqual(self.metrics().status_code, 200)
+
+    @override_settings(METRICS_TOKEN=None)
+    def test_metrics_closed_without_token(self):
+        self.assertEqual(self.client.get(reverse('network:metrics')).status_code, 404)
+
+
+# Аутентификация по claims без запросов к БД (в тестах один процесс, кэш отметок об отзыве общий)
+@override_settings(SHARED_CACHE=True)
+class AsyncReadTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='user', )
+        self.token = str(ClaimsTokenObtainPairSerializer.get_token(self.user).access_token)
+        generate_network(depth=2, fan_out=3, roots=2, products=3, products_per_element=2)
+        self.sync_client = APIClient()
+        self.sync_client.force_authenticate(user=self.user)
+        self.async_client = AsyncClient()
+
+    def aget(self, url, data=None):
+        # AsyncClient не передает заголовки из конструктора в ASGI scope, поэтому токен указывается в каждом запросе
+        return self.async_client.get(url, data, headers={'Authorization': f'Bearer {self.token}'})
+
+    async def test_list_matches_sync(self):
+        """Тест совпадения страниц и курсоров асинхронного и синхронного списков"""
+        sync_url, async_url = reverse('network:network-list'), reverse('network:async-network-list')
+        params = {'page_size': 10}
+        for _ in range(3):
+            expected = (await sync_to_async(self.sync_client.get)(sync_url, params)).json()
+            response = await self.aget(async_url, params)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            page = response.json()
+            self.assertEqual(page['results'], expected['results'])
+            self.assertEqual(*(link and link.split('?')[1] for link in (page['next'], expected['next'])))
+            self.assertEqual(*(link and link.split('?')[1] for link in (page['previous'], expected['previous'])))
+            async_url, params = page['next'], None
+            sync_url = expected['next']
+
+        previous = (await self.aget(page['previous'])).json()
+        self.assertEqual(len(previous['results']), 10)
+        self.assertLess(previous['results'][-1]['id'], page['results'][0]['id'])
+
+    async def test_list_filters_and_query_count(self):
+        registry.reset()
+        response = await self.aget(reverse('network:async-network-list'), {'network_lvl_min': 2})
+        self.assertEqual(len(response.json()['results']), 18)
+        # Страница элементов и prefetch товаров
+        self.assertIn('sales_network_db_queries_total{endpoint="NetworkElementListView",method="GET"} 2',
+                      registry.render())
+        response = await self.aget(reverse('network:async-network-list'), {'network_lvl_min': 'x'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    async def test_retrieve_and_tree(self):
+        element = await NetworkElement.objects.filter(network_lvl=1).afirst()
+        expected = (await sync_to_async(self.sync_client.get)(
+            reverse('network:network-detail', args=(element.pk,)))).json()
+        response = await self.aget(reverse('network:async-network-detail', args=(element.pk,)))
+        self.assertEqual(response.json(), expected)
+        response = await self.aget(reverse('network:async-network-detail', args=(0,)))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        params = {'root': element.pk, 'max_depth': 1}
+        expected = (await sync_to_async(self.sync_client.get)(reverse('network:network-tree'), params)).json()
+        response = await self.aget(reverse('network:async-network-tree'), params)
+        self.assertEqual(response.json(), expected)
+        response = await self.aget(reverse('network:async-network-tree'), {'max_depth': -1})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        product = await Product.objects.afirst()
+        response = await self.aget(reverse('network:async-product-detail', args=(product.pk,)))
+        self.assertEqual(response.json()['name'], product.name)
+        response = await self.aget(reverse('network:async-product-list'))
+        self.assertEqual(len(response.json()['results']), 3)
+
+    async def test_authentication(self):
+        response = await AsyncClient().get(reverse('network:async-product-list'))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertIn('Bearer', response['WWW-Authenticate'])
+
+        self.user.is_active = False
+        await sync_to_async(self.user.save)()
+        response = await self.aget(reverse('network:async-product-list'))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class NetworkTreeTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='user', )
+        self.client.force_authenticate(user=self.user)
+        generate_network(depth=3, fan_out=3, roots=2, products=4, products_per_element=2)
+        self.url = reverse('network:network-tree')
+
+    def count_nodes(self, nodes):
+        return sum(1 + self.count_nodes(node['children']) for node in nodes)
+
+    def depth(self, nodes):
+        return max((1 + self.depth(node['children']) for node in nodes), default=0)
+
+    def test_full_tree(self):
+        """Тест сборки всей сети двумя запросами: элементы и продукты"""
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        tree = response.json()
+        self.assertEqual(len(tree), 2)
+        self.assertEqual(self.count_nodes(tree), NetworkElement.objects.count())
+        self.assertEqual(self.depth(tree), 4)
+        self.assertEqual(len(tree[0]['children'][0]['products']), 2)
+
+    def test_rooted_tree_with_max_depth(self):
+        root = NetworkElement.objects.get(name='Element 3')
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url, {'root': root.pk, 'max_depth': 1})
+
+        tree = response.json()
+        self.assertEqual([node['id'] for node in tree], [root.pk])
+        self.assertEqual(
+            sorted(node['id'] for node in tree[0]['children']),
+            sorted(root.child.values_list('pk', flat=True))
+        )
+        self.assertTrue(all(node['children'] == [] for node in tree[0]['children']))
+
+    def test_tree_max_depth_without_root(self):
+        tree = self.client.get(self.url, {'max_depth': 0}).json()
+        self.assertEqual(self.count_nodes(tree), 2)
+
+    def test_tree_bad_params(self):
+        self.assertEqual(self.client.get(self.url, {'max_depth': 'x'}).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(self.url, {'max_depth': -1}).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(self.url, {'root': 0}).status_code, status.HTTP_404_NOT_FOUND)
+
+
+class NetworkBenchmarkTests(TestCase):
+
+    def test_operations_within_query_budgets(self):
+        """Тест бюджета запросов операций на малой сети: число запросов не зависит от ее размера"""
+        result = benchmark_network(depth=2, fan_out=3, roots=2, products=3, products_per_element=1,
+                                   countries=('Russia', 'USA'), repeat=3)
+        json.dumps(result)
+        self.assertEqual(result['network']['elements'], 26)
+        self.assertEqual(set(result['operations']), set(QUERY_BUDGETS))
+        for name, row in result['operations'].items():
+            self.assertLessEqual(row['queries_max'], row['query_budget'], name)
+            self.assertLessEqual(row['p50_ms'], row['p95_ms'])
+
+
+class FastRenderingTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='user', )
+        self.client.force_authenticate(user=self.user)
+        self.products = [Product.objects.create(name=f'product {number}', model='Модель', release_date='2025-01-02')
+                         for number in range(2)]
+        self.root = SubtreeTotalsTests.create_element('Завод', None, '100.50')
+        # Связи добавляются не в порядке id продуктов
+        for product in reversed(self.products):
+            self.root.products.add(product)
+        self.child = SubtreeTotalsTests.create_element('Retail\u2028', self.root, 10)
+        self.list_url = reverse('network:network-list')
+
+    def test_fast_json_matches_drf(self):
+        """Тест побайтного совпадения orjson с JSONRenderer, в том числе дат, Decimal и разделителей строк"""
+        data = NetworkElementSerializer(NetworkElement.objects.order_by('pk'), many=True).data
+        data = {'results': data, 'extra': [Decimal('1.50'), datetime(2025, 1, 2, 3, 4, 5, 678901), {1: None}]}
+        self.assertEqual(InstrumentedJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertEqual(InstrumentedJSONRenderer().render(data, 'application/json; indent=4'),
+                         JSONRenderer().render(data, 'application/json; indent=4'))
+
+    def test_values_serializer_matches_model_serializer(self):
+        for serializer_class, queryset, context in (
+            (NetworkElementSerializer, NetworkElement.objects.with_products(), {}),
+            (NetworkElementSerializer, NetworkElement.objects.all(), {'fields': {'name', 'parent', 'created_at'}}),
+            (ProductSerializer, Product.objects.all(), {}),
+        ):
+            fast = ValuesListSerializer(serializer_class, context)
+            self.assertTrue(fast.supported)
+            expected = serializer_class(queryset.order_by('pk'), many=True, context=context).data
+            many = any(field.field_name == 'products' for field in fast.fields)
+            with self.assertNumQueries(2 if many else 1):
+                data = fast.to_representation(fast.values(queryset).order_by('pk'))
+            self.assertEqual(JSONRenderer().render(data), JSONRenderer().render(expected))
+
+    def test_list_without_model_instances(self):
+        with mock.patch.object(NetworkElement, 'from_db', side_effect=AssertionError('создана модель')):
+            response = self.client.get(self.list_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['results'][0]['products'], [product.pk for product in self.products])
+        self.assertEqual(response.json()['results'][1]['debt_to_parent'], '10.00')
+
+    def test_products_order_matches_other_reads(self):
+        """Тест одинакового порядка продуктов в списке, элементе и дереве"""
+        expected = [product.pk for product in self.products]
+        self.assertEqual(self.client.get(self.list_url).json()['results'][0]['products'], expected)
+        detail = self.client.get(reverse('network:network-detail', args=(self.root.pk,))).json()
+        self.assertEqual(detail['products'], expected)
+        tree = self.client.get(reverse('network:network-tree')).json()
+        self.assertEqual(tree[0]['products'], expected)
+
+    @skipUnless(msgpack, 'msgpack не установлен')
+    def test_msgpack(self):
+        response = self.client.get(self.list_url, HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        self.assertEqual(msgpack.unpackb(response.content), self.client.get(self.list_url).json())
+
+    def test_benchmark_rendering(self):
+        result = benchmark_rendering(depth=1, fan_out=3, products=2, products_per_element=1, page_size=10, repeat=1)
+        json.dumps(result)
+        for name, row in result['paths'].items():
+            self.assertTrue(row['equal'], name)
+            self.assertTrue(row.get('byte_equal', True), name)
+
+
+class NetworkImportTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='user', )
+        self.client.force_authenticate(user=self.user)
+        self.product = Product.objects.create(name='product 1')
+        self.existing = NetworkElement.objects.create(
+            name='Existing',
+            email='mail@mail.com',
+            country='Russia',
+            city='Moscow',
+            street='Street',
+            building='1'
+        )
+
+    def record(self, ref, **extra):
+        return {'ref': ref, 'name': f'Element {ref}', 'email': 'mail@mail.com', 'country': 'Russia',
+                'city': 'Moscow', 'street': 'Street', 'building': '1', **extra}
+
+    def jsonl(self, records):
+        return io.StringIO('\n'.join(json.dumps(record) for record in records))
+
+    def test_import_forward_references(self):
+        """Тест импорта со ссылками на строки, которые идут ниже в файле"""
+        records = [
+            self.record('shop', parent='retail', products=[self.product.pk]),
+            self.record('retail', parent='factory', debt_to_parent='10.50'),
+            self.record('factory', parent_id=self.existing.pk),
+            self.record('root'),
+        ]
+        result = NetworkImporter(chunk_size=2).run(read_jsonl(self.jsonl(records)))
+
+        self.assertEqual((result.created, result.failed), (4, 0))
+        shop = NetworkElement.objects.get(name='Element shop')
+        self.assertEqual(shop.network_lvl, 3)
+        self.assertEqual(list(shop.products.all()), [self.product])
+        self.assertEqual(
+            [element.name for element in shop.get_ancestors()],
+            ['Existing', 'Element factory', 'Element retail']
+        )
+        self.assertEqual(NetworkElement.objects.get(name='Element retail').debt_to_parent, 10.5)
+        self.assertEqual(NetworkElement.objects.get(name='Element root').network_lvl, 0)
+
+    def test_import_reports_cycles_and_missing_parents(self):
+        """Тест обнаружения циклов и отсутствующих родителей в памяти"""
+        records = [
+            self.record('a', parent='b'),
+            self.record('b', parent='a'),
+            self.record('c', parent='a'),
+            self.record('d', parent='unknown'),
+            self.record('e', parent_id=0),
+            self.record('f', email='not an email'),
+            self.record('g', parent='f'),
+            self.record('h', products=[0]),
+            self.record('ok'),
+        ]
+        result = NetworkImporter().run(read_jsonl(self.jsonl(records)))
+
+        self.assertEqual((result.created, result.failed), (1, 8))
+        errors = {error['line']: error['error'] for error in result.errors}
+        self.assertEqual(errors[1], 'Обнаружена циклическая ссылка в иерархии')
+        self.assertEqual(errors[4], 'Родительская строка "unknown" не найдена')
+        self.assertIn('email', errors[6])
+        self.assertEqual(errors[7], 'Родительская строка не импортирована')
+        self.assertEqual(NetworkElement.objects.count(), 2)
+
+    def test_import_reports_malformed_lines(self):
+        """Тест: некорректный JSON и записи не-объекты становятся ошибками строк, а не прерывают импорт"""
+        stream = io.StringIO('\n'.join([
+            json.dumps(self.record('a')),
+            '{"ref": "broken"',
+            json.dumps([self.record('list')]),
+            '42',
+            json.dumps(self.record('b', parent='a')),
+        ]))
+        result = NetworkImporter().run(read_jsonl(stream))
+
+        self.assertEqual((result.created, result.failed), (2, 3))
+        errors = {error['line']: error['error'] for error in result.errors}
+        self.assertTrue(errors[2].startswith('Некорректный JSON'))
+        self.assertEqual(errors[3], 'Строка должна быть JSON-объектом')
+        self.assertEqual(errors[4], 'Строка должна быть JSON-объектом')
+        self.assertEqual(NetworkElement.objects.get(name='Element b').network_lvl, 1)
+
+    def test_import_csv(self):
+        stream = io.StringIO(
+            'ref,parent,name,email,country,city,street,building,products\n'
+            f'r1,,Root,root@mail.com,Russia,Moscow,Street,1,{self.product.pk}\n'
+            'r2,r1,Child,child@mail.com,Russia,Moscow,Street,2,\n'
+        )
+        result = NetworkImporter().run(read_csv(stream))
+        self.assertEqual(result.created, 2)
+        self.assertEqual(NetworkElement.objects.get(name='Child').network_lvl, 1)
+
+    def test_import_command(self):
+        records = [self.record(str(number), parent=str(number - 1) if number else None) for number in range(10)]
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl', delete=False) as file:
+            file.write('\n'.join(json.dumps(record) for record in records))
+        out = io.StringIO()
+        call_command('import_network', file.name, '--chunk-size', '3', stdout=out)
+
+        self.assertIn('Импортировано: 10', out.getvalue())
+        self.assertIn('строк/с', out.getvalue())
+        self.assertEqual(NetworkElement.objects.get(name='Element 9').get_ancestors().count(), 9)
+
+    def test_import_endpoint(self):
+        url = reverse('network:network-bulk-import')
+        content = '\n'.join(json.dumps(self.record(ref)) for ref in ('a', 'b')).encode()
+        upload = SimpleUploadedFile('network.jsonl', content)
+        response = self.client.post(url, {'file': upload}, format='multipart')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.json()['created'], 2)
+        self.assertEqual(NetworkElement.objects.count(), 3)
+
+
+class NetworkExportTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='user', )
+        self.client.force_authenticate(user=self.user)
+        self.products = [Product.objects.create(name=f'product {number}') for number in range(2)]
+        self.root = NetworkElement.objects.create(
+            name='Root',
+            email='root@mail.com',
+            country='Russia',
+            city='Moscow',
+            street='Street',
+            building='1',
+            debt_to_parent=100
+        )
+        self.root.products.set(self.products)
+        self.child = NetworkElement.objects.create(
+            name='Child',
+            email='child@mail.com',
+            country='USA',
+            city='Florida',
+            street='Street',
+            building='2',
+            parent=self.root
+        )
+
+    def read_ndjson(self, response):
+        return [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+
+    def test_export_ndjson(self):
+        url = reverse('network:network-export')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+
+        rows = self.read_ndjson(response)
+        self.assertEqual([row['name'] for row in rows], ['Root', 'Child'])
+        self.assertEqual(rows[0]['products'], [product.pk for product in self.products])
+        self.assertEqual(rows[0]['debt_to_parent'], '100.00')
+        self.assertEqual(rows[1]['products'], [])
+        self.assertEqual(rows[1]['parent'], self.root.pk)
+
+    def test_export_single_query(self):
+        """Тест агрегации продуктов в SQL: один запрос на всю выгрузку"""
+        for number in range(20):
+            element = NetworkElement.objects.create(
+                name=f'element {number}',
+                email='mail@mail.com',
+                country='Russia',
+                city='Moscow',
+                street='Street',
+                building='1'
+            )
+            element.products.set(self.products)
+        url = reverse('network:network-export')
+        response = self.client.get(url)
+        with self.assertNumQueries(1):
+            rows = self.read_ndjson(response)
+        self.assertEqual(len(rows), 22)
+
+    def test_export_csv_country_filter(self):
+        url = reverse('network:network-export')
+        response = self.client.get(url, {'output': 'csv', 'country': 'Russia'})
+        self.assertEqual(response['Content-Type'], 'text/csv')
+
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[0].startswith('id,name,email'))
+        self.assertTrue(lines[1].endswith(';'.join(str(product.pk) for product in self.products)))
+
+    def test_export_reimport(self):
+        """Тест: выгрузку CSV и NDJSON можно импортировать обратно с той же иерархией и продуктами"""
+        grandchild = NetworkElement.objects.create(name='Grandchild', email='mail@mail.com', country='Russia',
+                                                   city='Moscow', street='Street', building='3', parent=self.child)
+        # Родитель с большим id, чем у потомка: ссылка вперед по файлу
+        grandchild.move_to(None)
+        self.root.move_to(grandchild)
+
+        def structure():
+            return sorted(NetworkElement.objects.values_list('name', 'parent__name', 'network_lvl'))
+
+        expected = structure()
+        for output, reader in (('csv', read_csv), ('ndjson', read_jsonl)):
+            response = self.client.get(reverse('network:network-export'), {'output': output})
+            content = b''.join(response.streaming_content).decode()
+            NetworkElement.objects.filter(parent=None).delete_subtrees()
+            result = NetworkImporter().run(reader(io.StringIO(content, newline='')))
+            self.assertEqual((result.created, result.errors), (3, []), output)
+            self.assertEqual(structure(), expected, output)
+            self.assertEqual(list(NetworkElement.objects.get(name='Root').products.order_by('pk')), self.products)
+
+    def test_export_command(self):
+        out = io.StringIO()
+        call_command('export_network', '--country', 'USA', stdout=out)
+        rows = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual([row['name'] for row in rows], ['Child'])
+
+
+# Реплики в тестах - зеркала основной БД (TEST MIRROR) на отдельных соединениях
+REPLICA_TEST_DATABASES = [alias for alias, database in settings.DATABASES.items()
+                          if database.get('TEST', {}).get('MIRROR') == 'default']
+
+
+@skipUnless(REPLICA_TEST_DATABASES, 'Не настроено зеркало основной БД')
+@override_settings(REPLICA_DATABASES=REPLICA_TEST_DATABASES[:1], REPLICA_STICKY_SECONDS=5, SHARED_CACHE=True)
+class ReplicaRoutingTests(TransactionTestCase):
+    """Данные зеркалу видны только после коммита, поэтому тесты идут без транзакции"""
+    databases = {'default', *REPLICA_TEST_DATABASES}
+
+    def setUp(self):
+        cache.clear()
+        self.replica = connections[REPLICA_TEST_DATABASES[0]]
+        self.user = User.objects.create(username='user', )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.element = NetworkElement.objects.create(
+            name='element 1',
+            email='mail@mail.com',
+            country='Russia',
+            city='Moscow',
+            street='Street',
+            building='1',
+            debt_to_parent=10
+        )
+        self.detail_url = reverse('network:network-detail', args=(self.element.pk,))
+
+    def get(self, client, url):
+        """Ответ и число запросов к основной БД и к реплике"""
+        with CaptureQueriesContext(connection) as primary, CaptureQueriesContext(self.replica) as replica:
+            response = client.get(url)
+            if response.streaming:
+                response.streamed = b''.join(response.streaming_content)
+        return response, len(primary), len(replica)
+
+    def test_reads_from_replica(self):
+        urls = [
+            reverse('network:network-list'),
+            self.detail_url,
+            reverse('network:network-tree'),
+            reverse('network:product-list'),
+            reverse('network:network-export'),
+        ]
+        for url in urls:
+            response, primary, replica = self.get(self.client, url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK, url)
+            self.assertEqual(primary, 0, url)
+            self.assertGreater(replica, 0, url)
+        # Выгрузка читается уже после выхода из представления, но с той же реплики
+        self.assertIn(b'element 1', response.streamed)
+
+    def test_write_pins_user_to_primary(self):
+        """Тест read-your-writes: после записи автор читает с основной БД, остальные - с реплики"""
+        response = self.client.patch(self.detail_url, {'name': 'element 1 new'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        response, primary, replica = self.get(self.client, self.detail_url)
+        self.assertEqual(response.json()['name'], 'element 1 new')
+        self.assertGreater(primary, 0)
+        self.assertEqual(replica, 0)
+
+        other = APIClient()
+        other.force_authenticate(user=User.objects.create(username='other', ))
+        response, primary, replica = self.get(other, reverse('network:network-list'))
+        self.assertEqual(primary, 0)
+        self.assertGreater(replica, 0)
+
+    def test_replica_reads_after_write_not_cached(self):
+        self.element.name = 'element 1 new'
+        self.element.save()
+        self.get(self.client, self.detail_url)
+        response, primary, replica = self.get(self.client, self.detail_url)
+        self.assertGreater(replica, 0)
+
+        cache.delete('sales_network:replicas:written')
+        self.get(self.client, self.detail_url)
+        response, primary, replica = self.get(self.client, self.detail_url)
+        self.assertEqual(primary + replica, 0)
+
+
+class ChangeFeedTests(TransactionTestCase):
+    """Записи журнала видны только после фиксации транзакции, поэтому тесты идут без транзакции"""
+
+    def setUp(self):
+        self.user = User.objects.create(username='user', )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('network:changes')
+        self.product = Product.objects.create(name='product 1')
+        self.element = SubtreeTotalsTests.create_element('Factory', None, 100)
+        self.element.products.set([self.product])
+
+    def feed(self, since=None, **params):
+        if since is not None:
+            params['since'] = since
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.json()
+
+    @staticmethod
+    def actions(page):
+        return [(change['model'], change['id'], change['action']) for change in page['changes']]
+
+    def test_upserts_and_tombstones(self):
+        """Тест сведения изменений объекта к последнему: продукт удален, элемент изменен удалением связи"""
+        product_id = self.product.pk
+        self.product.delete()
+        page = self.feed()
+        self.assertEqual(self.actions(page), [
+            ('network', self.element.pk, 'upsert'),
+            ('product', product_id, 'delete'),
+        ])
+        self.assertEqual(page['changes'][0]['data']['products'], [])
+        self.assertFalse(page['has_more'])
+
+    def test_cursor_returns_only_new_changes(self):
+        """Тест курсора: массовое обновление (аннулирование долга) попадает в журнал, старые записи - нет"""
+        since = self.feed()['next']
+        other = SubtreeTotalsTests.create_element('Retail', None, 10)
+        NetworkElement.objects.filter(pk=other.pk).zero_debt()
+
+        page = self.feed(since)
+        self.assertEqual(self.actions(page), [('network', other.pk, 'upsert')])
+        self.assertEqual(page['changes'][0]['data']['debt_to_parent'], '0.00')
+
+        # Без новых изменений курсор остается на месте
+        page = self.feed(page['next'])
+        self.assertEqual(page['changes'], [])
+        self.assertEqual(self.feed(page['next'])['changes'], [])
+
+    def test_pages_and_query_count(self):
+        """Тест постоянного числа запросов на страницу"""
+        for number in range(10):
+            SubtreeTotalsTests.create_element(f'element {number}', None, 0).products.set([self.product])
+        page = self.feed(page_size=1)
+        self.assertTrue(page['has_more'])
+        self.assertEqual(self.actions(page), [('product', self.product.pk, 'upsert')])
+
+        # Журнал, граница сжатия, элементы и их продукты
+        with self.assertNumQueries(4):
+            page = change_page({'since': page['next'], 'page_size': 1000})
+        self.assertEqual(len(page['changes']), 11)
+        self.assertFalse(page['has_more'])
+
+    def test_uncommitted_changes_not_visible(self):
+        with transaction.atomic():
+            since = change_page({})['next']
+            SubtreeTotalsTests.create_element('Retail', None, 10)
+            self.assertEqual(change_page({'since': since})['changes'], [])
+        self.assertEqual(len(change_page({'since': since})['changes']), 1)
+
+    def test_invalid_and_expired_cursor(self):
+        response = self.client.get(self.url, {'since': 'cursor'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        # Клиент прочитал первую страницу, а остальные записи (и удаление продукта) удалены по сроку хранения
+        since = self.feed(page_size=1)['next']
+        latest = self.feed()['next']
+        call_command('compact_changes', '--days', '-1', stdout=io.StringIO())
+        response = self.client.get(self.url, {'since': since})
+        self.assertEqual(response.status_code, status.HTTP_410_GONE)
+        # Курсор, дошедший до конца журнала, ничего не пропустил
+        self.assertEqual(self.feed(latest)['changes'], [])
+
+    def test_feed_without_cursor_after_expiry(self):
+        """Тест: чтение с начала после удаления по сроку получает 410 и курсор на конец журнала"""
+        call_command('compact_changes', '--days', '-1', stdout=io.StringIO())
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_410_GONE)
+        head = response.json()['next']
+
+        other = SubtreeTotalsTests.create_element('Retail', None, 10)
+        self.assertEqual(self.actions(self.feed(head)), [('network', other.pk, 'upsert')])
+        self.assertEqual(self.client.get(self.url, {'since': 'MDow'}).status_code, status.HTTP_410_GONE)
+
+    def test_compact_changes(self):
+        """Тест сжатия журнала: остается последняя запись каждого объекта, затем все удаляются по сроку"""
+        self.element.name = 'Factory 2'
+        self.element.save()
+        self.assertGreater(Change.objects.filter(model='network').count(), 1)
+
+        call_command('compact_changes', stdout=io.StringIO())
+        self.assertEqual(Change.objects.filter(model='network').count(), 1)
+        self.assertEqual(self.actions(self.feed()), [
+            ('product', self.product.pk, 'upsert'),
+            ('network', self.element.pk, 'upsert'),
+        ])
+
+        call_command('compact_changes', '--days', '-1', stdout=io.StringIO())
+        self.assertFalse(Change.objects.exists())
+
 
 class InactiveUserTestCase(APITestCase):
     def setUp(self):
@@ -0,0 +1,50 @@
+from rest_framework.exceptions import ParseError, ValidationError
+
+from .models import NetworkElement
+
+
+def parse_tree_params(query_params):
+    """Параметры root и max_depth запроса дерева"""
+    try:
+        root_id = int(query_params['root']) if 'root' in query_params else None
+        max_depth = int(query_params['max_depth']) if 'max_depth' in query_params else None
+    except ValueError:
+        raise ParseError('root и max_depth должны быть целыми числами')
+    if max_depth is not None and max_depth < 0:
+        raise ValidationError({'max_depth': ['Глубина не может быть отрицательной']})
+    return root_id, max_depth
+
+
+def tree_queryset(root_id=None, max_depth=None):
+    """
+    Элементы дерева одним запросом: поддерево root_id по таблице замыканий
+    либо вся сеть, с ограничением глубины относительно корня.
+    """
+    if root_id is None:
+        queryset = NetworkElement.objects.all()
+        if max_depth is not None:
+            queryset = queryset.filter(network_lvl__lte=max_depth)
+    else:
+        links = {'ancestor_links__ancestor_id': root_id}
+        if max_depth is not None:
+            # Условия на связь задаются одним filter(), иначе Django добавит второй JOIN
+            links['ancestor_links__depth__lte'] = max_depth
+        queryset = NetworkElement.objects.filter(**links)
+    return queryset.order_by('pk').with_products()
+
+
+def build_tree(items):
+    """Собирает вложенную структуру из плоского списка сериализованных элементов за O(n)"""
+    nodes = {}
+    for item in items:
+        node = dict(item, children=[])
+        nodes[node['id']] = node
+
+    roots = []
+    for node in nodes.values():
+        parent = nodes.get(node['parent'])
+        if parent is None:
+            roots.append(node)
+        else:
+            parent['children'].append(node)
+    return roots
@@ -1,12 +1,26 @@
-from .views import NetworkElementViewSet, ProductViewSet
+from .views import (
+    NetworkElementViewSet, ProductViewSet, DebtTransactionViewSet, CacheStatsView, ChangeFeedView, metrics_view,
+)
 from django.urls import path
 from rest_framework.routers import DefaultRouter
 
+from . import async_views
+
 router = DefaultRouter()
 
 app_name = 'network'
 
 router.register(r'product', ProductViewSet, basename='product')
 router.register(r'network', NetworkElementViewSet, basename='network')
+router.register(r'debt-transactions', DebtTransactionViewSet, basename='debt-transaction')
 
-urlpatterns = router.urls
+urlpatterns = [
+    path('cache/stats/', CacheStatsView.as_view(), name='cache-stats'),
+    path('changes/', ChangeFeedView.as_view(), name='changes'),
+    path('metrics/', metrics_view, name='metrics'),
+    path('async/network/', async_views.NetworkElementListView.as_view(), name='async-network-list'),
+    path('async/network/tree/', async_views.NetworkTreeView.as_view(), name='async-network-tree'),
+    path('async/network/<int:pk>/', async_views.NetworkElementDetailView.as_view(), name='async-network-detail'),
+    path('async/product/', async_views.ProductListView.as_view(), name='async-product-list'),
+    path('async/product/<int:pk>/', async_views.ProductDetailView.as_view(), name='async-product-detail'),
+] + router.urls
@@ -1,22 +1,280 @@
+import secrets
+
+from django.conf import settings
+from django.db import transaction
+from django.http import HttpResponse, StreamingHttpResponse
 from django.shortcuts import render
-from rest_framework import viewsets
+from rest_framework import mixins, viewsets, status
+from rest_framework.decorators import action
+from rest_framework.generics import get_object_or_404
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.views import APIView
 from django_filters.rest_framework import DjangoFilterBackend
 
-from .models import Product, NetworkElement
+from .cache import CachedReadMixin, ConditionalReadMixin, get_stats
+from .changes import change_page
+from .fieldsets import SparseFieldsetMixin
+from .filters import NetworkElementFilter, filter_elements
+from .exporters import EXPORT_FORMATS, export_rows
+from .metrics import registry
+from .importers import NetworkImporter, READERS, open_text
+from .models import Product, NetworkElement, DebtTransaction
+from .paginators import NetworkCursorPagination
+from .replicas import ReplicaReadMixin
 from users.permissions import IsActiveUser
-from .serializers import ProductSerializer, NetworkElementSerializer
+from .tree import build_tree, parse_tree_params, tree_queryset
+from .renderers import BINARY_RENDERER_CLASSES
+from .serializers import (
+    BULK_MAX_SIZE, ValuesListSerializer, ProductSerializer, NetworkElementSerializer, NetworkElementBulkDeleteSerializer,
+    NetworkElementBulkUpdateSerializer, NetworkCountryStatsSerializer, DebtSummarySerializer, DebtTransactionSerializer,
+)
+from .stats import group_by_country, network_stats, schedule_refresh
+
+
+class ValuesListMixin:
+    """
+    list через ValuesListSerializer: без создания моделей и по-полевой обработки, с тем же ответом.
+    Ответы доступны и в двоичном формате MessagePack, если установлен msgpack.
+    """
+    renderer_classes = [*api_settings.DEFAULT_RENDERER_CLASSES, *BINARY_RENDERER_CLASSES]
 
+    def list(self, request, *args, **kwargs):
+        serializer = ValuesListSerializer(self.get_serializer_class(), self.get_serializer_context())
+        if not serializer.supported:
+            return super().list(request, *args, **kwargs)
+        queryset = serializer.values(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(queryset)
+        if page is None:
+            return Response(serializer.to_representation(queryset))
+        return self.get_paginated_response(serializer.to_representation(page))
 
-class ProductViewSet(viewsets.ModelViewSet):
+
+class ProductViewSet(SparseFieldsetMixin, ReplicaReadMixin, ConditionalReadMixin, CachedReadMixin, ValuesListMixin,
+                     viewsets.ModelViewSet):
+    cache_namespace = 'product'
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
+    pagination_class = NetworkCursorPagination
     permission_classes = [IsActiveUser, IsAuthenticated]
 
+    def get_serializer_class(self):
+        # Набор полей (?fields=) у элементов продукта относится к полям элемента
+        if self.action == 'elements':
+            return NetworkElementSerializer
+        return super().get_serializer_class()
+
+    @action(detail=True)
+    def elements(self, request, pk=None):
+        """Элементы сети, у которых есть продукт, с фильтрами списка элементов (?country=...&network_lvl_min=...)"""
+        product = self.get_object()
+        # Соединение с таблицей связей идет по индексу (product_id, networkelement_id)
+        queryset = filter_elements(request, NetworkElement.objects.filter(products=product))
+        page = self.paginate_queryset(self.restrict_queryset(queryset.with_products()))
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
 
-class NetworkElementViewSet(viewsets.ModelViewSet):
-    queryset = NetworkElement.objects.all()
+
+class NetworkElementViewSet(SparseFieldsetMixin, ReplicaReadMixin, ConditionalReadMixin, CachedReadMixin,
+                            ValuesListMixin, viewsets.ModelViewSet):
+    cache_namespace = 'network'
+    # parent сериализуется как pk и не требует JOIN, а products подгружаются одним запросом на страницу
+    queryset = NetworkElement.objects.with_products()
     serializer_class = NetworkElementSerializer
+    pagination_class = NetworkCursorPagination
     filter_backends = [DjangoFilterBackend]
-    filterset_fields = ['country']
+    filterset_class = NetworkElementFilter
     permission_classes = [IsActiveUser, IsAuthenticated]
+    # Дерево собирается по id и parent
+    fieldset_required = {'tree': ('id', 'parent')}
+
+    def get_serializer_class(self):
+        if self.action == 'subtree_products':
+            return ProductSerializer
+        return super().get_serializer_class()
+
+    def get_hierarchy_root(self, queryset=None):
+        # Фильтры применяются к найденным предкам/потомкам, а не к самому элементу
+        queryset = NetworkElement.objects.all() if queryset is None else queryset
+        element = get_object_or_404(queryset, pk=self.kwargs['pk'])
+        self.check_object_permissions(self.request, element)
+        return element
+
+    @action(detail=True)
+    def descendants(self, request, pk=None):
+        queryset = self.filter_queryset(self.get_hierarchy_root().get_descendants().with_products())
+        page = self.paginate_queryset(self.restrict_queryset(queryset))
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=True)
+    def ancestors(self, request, pk=None):
+        queryset = self.filter_queryset(self.get_hierarchy_root().get_ancestors().with_products())
+        serializer = self.get_serializer(self.restrict_queryset(queryset), many=True)
+        return Response(serializer.data)
+
+    @action(detail=True, url_path='subtree-products')
+    def subtree_products(self, request, pk=None):
+        """
+        Продукты, которые есть у элемента или у кого-либо в его поддереве. Фильтры списка элементов
+        (?country=...&network_lvl_min=...) отбирают элементы поддерева, продукты которых учитываются.
+        """
+        elements = self.filter_queryset(self.get_hierarchy_root().get_descendants(include_self=True))
+        links = NetworkElement.products.through.objects.filter(networkelement__in=elements.order_by())
+        page = self.paginate_queryset(self.restrict_queryset(Product.objects.filter(pk__in=links.values('product_id'))))
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=False)
+    def tree(self, request):
+        """Вложенное дерево сети (?root=<id>&max_depth=<n>): один запрос на элементы и один на продукты"""
+        root_id, max_depth = parse_tree_params(request.query_params)
+        serializer = self.get_serializer(self.restrict_queryset(tree_queryset(root_id, max_depth)), many=True)
+        items = serializer.data
+        if root_id is not None and not items:
+            return Response({'detail': 'Элемент не найден'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(build_tree(items))
+
+    @action(detail=False)
+    def stats(self, request):
+        """
+        Статистика по странам (?country=Russia,USA) и уровням: число элементов, долг и число элементов
+        с продуктами. Читается из материализованного представления, которое пересчитывает команда
+        refresh_network_stats (после массовых записей), поэтому может отставать от изменений.
+        """
+        countries = [country for country in request.query_params.get('country', '').split(',') if country]
+        rows = network_stats(NetworkElement.objects.all(), countries)
+        return Response(NetworkCountryStatsSerializer(group_by_country(rows), many=True).data)
+
+    def perform_destroy(self, instance):
+        # Поддерево удаляется пачками SQL-запросов, а не сборщиком удаления Django
+        NetworkElement.objects.filter(pk=instance.pk).delete_subtrees()
+
+    @action(detail=True, methods=['delete'])
+    def subtree(self, request, pk=None):
+        """
+        Удаление элемента вместе с поддеревом пачками SQL-запросов в одной транзакции; в ответе число удаленных
+        элементов, связей с продуктами и проводок. Память не зависит от размера поддерева.
+        """
+        element = self.get_hierarchy_root()
+        return Response(NetworkElement.objects.filter(pk=element.pk).delete_subtrees())
+
+    @action(detail=True, url_path='debt-summary')
+    def debt_summary(self, request, pk=None):
+        """Долг всего поддерева из поддерживаемых итогов, без обхода потомков"""
+        element = self.get_hierarchy_root(NetworkElement.objects.only(*DebtSummarySerializer.Meta.fields))
+        return Response(DebtSummarySerializer(element).data)
+
+    @action(detail=False, methods=['patch', 'delete'])
+    def bulk(self, request):
+        """
+        Пакетное изменение (PATCH [{"id": 1, "parent": 2, "city": "..."}, ...]) или удаление вместе с поддеревьями
+        (DELETE {"ids": [1, 2]}) в одной транзакции. При любой ошибке пачка не применяется, ошибки возвращаются
+        списком по строкам.
+        """
+        with transaction.atomic():
+            if request.method == 'DELETE':
+                serializer = NetworkElementBulkDeleteSerializer(data=request.data)
+                serializer.is_valid(raise_exception=True)
+                elements = NetworkElement.objects.filter(pk__in=serializer.validated_data['ids'])
+                return Response(elements.delete_subtrees())
+
+            serializer = NetworkElementBulkUpdateSerializer(
+                NetworkElement.objects.select_for_update(), data=request.data, many=True, allow_empty=False,
+                max_length=BULK_MAX_SIZE,
+            )
+            serializer.is_valid(raise_exception=True)
+            serializer.save()
+            schedule_refresh()
+            return Response({'updated': len(serializer.validated_data)})
+
+    @action(detail=False, methods=['post'], url_path='import')
+    def bulk_import(self, request):
+        """Импорт элементов из загруженного CSV/JSONL файла (поле file)"""
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({'file': ['Файл не передан']}, status=status.HTTP_400_BAD_REQUEST)
+        file_format = request.data.get('file_format') or upload.name.rsplit('.', 1)[-1].lower()
+        if file_format not in READERS:
+            return Response({'file_format': [f'Неизвестный формат файла: {file_format}']},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        result = NetworkImporter().run(READERS[file_format](open_text(upload.file)))
+        return Response({
+            'created': result.created,
+            'failed': result.failed,
+            'errors': result.errors,
+            'rows_per_second': round(result.rows_per_second),
+        }, status=status.HTTP_201_CREATED if result.created else status.HTTP_400_BAD_REQUEST)
+
+    @action(detail=False)
+    def export(self, request):
+        """Потоковая выгрузка всей сети в NDJSON (по умолчанию) или CSV: ?output=csv"""
+        output = request.query_params.get('output', 'ndjson')
+        if output not in EXPORT_FORMATS:
+            return Response({'output': [f'Неизвестный формат выгрузки: {output}']},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        lines, content_type = EXPORT_FORMATS[output]
+        queryset = self.filter_queryset(NetworkElement.objects.all())
+        # Строки читаются уже после выхода из представления, поэтому БД запроса фиксируется заранее
+        rows = export_rows(queryset.using(queryset.db))
+        response = StreamingHttpResponse(lines(rows), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="network.{output}"'
+        return response
+
+
+class DebtTransactionViewSet(mixins.CreateModelMixin, mixins.ListModelMixin, viewsets.GenericViewSet):
+    """Журнал проводок по долгу: только добавление (по одной или списком до BULK_MAX_SIZE) и чтение"""
+    queryset = DebtTransaction.objects.all()
+    serializer_class = DebtTransactionSerializer
+    pagination_class = NetworkCursorPagination
+    filter_backends = [DjangoFilterBackend]
+    filterset_fields = ['element', 'compacted']
+    permission_classes = [IsActiveUser, IsAuthenticated]
+
+    def create(self, request, *args, **kwargs):
+        entries = request.data if isinstance(request.data, list) else [request.data]
+        serializer = self.get_serializer(data=entries, many=True, max_length=BULK_MAX_SIZE)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['post'])
+    def compact(self, request):
+        """Учитывает накопленные проводки в долге элементов"""
+        return Response({'elements': DebtTransaction.objects.compact()})
+
+
+class ChangeFeedView(APIView):
+    """
+    Изменения элементов сети и продуктов для синхронизации: ?since=<next из предыдущего ответа>&page_size=500.
+    Без since журнал читается с начала, пока has_more - следующая страница запрашивается сразу.
+
+    Если часть журнала уже удалена по сроку хранения, чтение с начала (как и с устаревшим since) получает
+    410 с курсором next на конец журнала: клиент сохраняет его, загружает /network/ и /product/ целиком
+    и продолжает с next. Изменения, сделанные во время загрузки, придут повторно как upsert.
+    """
+    permission_classes = [IsActiveUser, IsAuthenticated]
+
+    def get(self, request):
+        return Response(change_page(request.query_params, context={'request': request}))
+
+
+class CacheStatsView(APIView):
+    """Счетчики попаданий и промахов кэша ответов"""
+    permission_classes = [IsActiveUser, IsAuthenticated]
+
+    def get(self, request):
+        return Response(get_stats())
+
+
+def metrics_view(request):
+    """Метрики запросов в текстовом формате Prometheus"""
+    # Без токена эндпоинт закрыт: метрики раскрывают трафик и время ответа по эндпоинтам
+    if not settings.METRICS_TOKEN:
+        return HttpResponse(status=404)
+    if not secrets.compare_digest(request.headers.get('Authorization', ''), f'Bearer {settings.METRICS_TOKEN}'):
+        return HttpResponse(status=401)
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
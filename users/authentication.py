@@ -0,0 +1,90 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+
+CACHE_ALIAS = 'users'
+
+
+def _revoked_key(user_id):
+    return f'users:revoked:{user_id}'
+
+
+def revoke(user_id):
+    """
+    Отзывает выданные пользователю access-токены. Отметка живет столько же, сколько access-токен:
+    новые токены неактивному или удаленному пользователю не выдаются, а старые к тому времени истекут.
+    """
+    caches[CACHE_ALIAS].set(_revoked_key(user_id), True, api_settings.ACCESS_TOKEN_LIFETIME.total_seconds())
+
+
+def restore(user_id):
+    caches[CACHE_ALIAS].delete(_revoked_key(user_id))
+
+
+def is_revoked(user_id):
+    return caches[CACHE_ALIAS].get(_revoked_key(user_id), False)
+
+
+class ClaimsUser(TokenUser):
+    """Пользователь, собранный из подписанных claims токена без обращения к таблице пользователей"""
+
+    @property
+    def is_active(self):
+        return bool(self.token.get('is_active', False))
+
+
+def claims_only(validated_token):
+    """
+    Пользователь проверяется только по claims, если токен их содержит и кэш отметок об отзыве общий для всех
+    процессов (SHARED_CACHE). Отметка в локальном кэше процесса не видна остальным воркерам.
+    """
+    return settings.SHARED_CACHE and 'is_active' in validated_token
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    """
+    JWT-аутентификация без запроса к БД: активность берется из claim is_active, а отзыв токенов
+    (деактивация или удаление пользователя) проверяется по отметке в общем кэше. Токены, выданные до
+    появления claim is_active, и все токены без общего кэша проверяются по БД, как в JWTAuthentication.
+    """
+
+    def get_user(self, validated_token):
+        if not claims_only(validated_token):
+            return super().get_user(validated_token)
+        user_id = self.get_user_id(validated_token)
+        return self.claims_user(validated_token, is_revoked(user_id))
+
+    async def aauthenticate(self, request):
+        """Асинхронный вариант authenticate() для представлений без DRF: кэш читается без блокировки потока"""
+        header = self.get_header(request)
+        if header is None:
+            return None
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+        validated_token = self.get_validated_token(raw_token)
+        return await self.aget_user(validated_token), validated_token
+
+    async def aget_user(self, validated_token):
+        if not claims_only(validated_token):
+            return await sync_to_async(super().get_user)(validated_token)
+        user_id = self.get_user_id(validated_token)
+        revoked = await caches[CACHE_ALIAS].aget(_revoked_key(user_id), False)
+        return self.claims_user(validated_token, revoked)
+
+    @staticmethod
+    def get_user_id(validated_token):
+        try:
+            return validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise AuthenticationFailed('Токен не содержит идентификатор пользователя', code='token_not_valid')
+
+    @staticmethod
+    def claims_user(validated_token, revoked):
+        if not validated_token['is_active'] or revoked:
+            raise AuthenticationFailed('Пользователь неактивен или удален', code='user_inactive')
+        return ClaimsUser(validated_token)
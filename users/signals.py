@@ -0,0 +1,20 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .authentication import restore, revoke
+from .models import User
+
+
+@receiver(post_save, sender=User)
+def sync_token_revocation(sender, instance, **kwargs):
+    # Массовый User.objects.update(is_active=...) сигналов не отправляет, деактивация должна идти через save()
+    if instance.is_active:
+        transaction.on_commit(lambda: restore(instance.pk))
+    else:
+        revoke(instance.pk)
+
+
+@receiver(post_delete, sender=User)
+def revoke_deleted_user(sender, instance, **kwargs):
+    revoke(instance.pk)
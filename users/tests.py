@@ -1,3 +1,74 @@
-from django.test import TestCase
+from django.core.cache import cache, caches
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework import status
+from rest_framework.reverse import reverse
+from rest_framework.test import APITestCase
+from rest_framework_simplejwt.tokens import AccessToken
 
-# Create your tests here.
+from users.models import User
+
+
+# В тестах один процесс, поэтому локальный кэш ведет себя как общий
+@override_settings(SHARED_CACHE=True)
+class ClaimsJWTAuthenticationTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        caches['users'].clear()
+        self.user = User.objects.create(username='user')
+        self.user.set_password('password')
+        self.user.save()
+        self.url = reverse('network:product-list')
+
+    def obtain_token(self):
+        response = self.client.post(reverse('users:token_obtain_pair'),
+                                    {'username': 'user', 'password': 'password'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.json()['access']
+
+    def get_with_token(self, token):
+        return self.client.get(self.url, HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def test_token_contains_claims(self):
+        token = AccessToken(self.obtain_token())
+        self.assertEqual((token['username'], token['is_active']), ('user', True))
+
+    def test_authentication_without_users_table(self):
+        """Тест аутентификации по claims без запросов к таблице пользователей"""
+        token = self.obtain_token()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.get_with_token(token)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse([query for query in queries if User._meta.db_table in query['sql']])
+
+    def test_deactivation_revokes_and_activation_restores(self):
+        token = self.obtain_token()
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.get_with_token(token).status_code, status.HTTP_401_UNAUTHORIZED)
+
+        self.user.is_active = True
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        self.assertEqual(self.get_with_token(token).status_code, status.HTTP_200_OK)
+
+    def test_deleted_user_revoked(self):
+        token = self.obtain_token()
+        self.user.delete()
+        self.assertEqual(self.get_with_token(token).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_token_without_claims_checked_in_database(self):
+        """Тест токенов, выданных до появления claim is_active"""
+        token = AccessToken.for_user(self.user)
+        self.assertEqual(self.get_with_token(token).status_code, status.HTTP_200_OK)
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertEqual(self.get_with_token(token).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    @override_settings(SHARED_CACHE=False)
+    def test_checked_in_database_without_shared_cache(self):
+        """Тест: без общего кэша деактивация в другом процессе (без отметки в этом) видна сразу"""
+        token = self.obtain_token()
+        self.assertEqual(self.get_with_token(token).status_code, status.HTTP_200_OK)
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertEqual(self.get_with_token(token).status_code, status.HTTP_401_UNAUTHORIZED)